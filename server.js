@@ -2,7 +2,7 @@ require('dotenv').config();
 const express = require('express');
 const cors = require('cors');
 const http = require('http');
-const { chatHandler } = require('./src/controllers/chatController');
+const { chatHandler, streamChatHandler } = require('./src/controllers/chatController');
 
 // --- Helper function to format links ---
 function formatLinks(text) {
@@ -60,6 +60,8 @@ const formatAiResponseMiddleware = (req, res, next) => {
 };
 
 app.post('/api/ai-chat', formatAiResponseMiddleware, chatHandler);
+// Token streaming (Server-Sent Events); links are formatted in the final `done` event
+app.post('/api/ai-chat/stream', streamChatHandler);
 
 // Health check endpoint
 app.get('/api/health', (req, res) => {
@@ -1,4 +1,4 @@
-const { getRagResponse } = require('../services/ragService');
+const { getRagResponse, streamRagResponse } = require('../services/ragService');
 const { HfInference } = require('@huggingface/inference');
 
 const chatHandler = async (req, res) => {
@@ -35,4 +35,61 @@ const chatHandler = async (req, res) => {
     }
 };
 
-module.exports = { chatHandler };
+// Streams the answer as Server-Sent Events (proxied from the Python service).
+// Logs time-to-first-byte so perceived latency can be tracked end to end.
+const streamChatHandler = async (req, res) => {
+    const { message, userId, huggingFaceToken } = req.body || {};
+
+    if (!message) {
+        return res.status(400).json({ error: 'Message is required' });
+    }
+
+    const tokenToUse = huggingFaceToken || process.env.HUGGINGFACE_API_KEY;
+    if (!tokenToUse) {
+        return res.status(400).json({ error: 'Hugging Face token is missing. Please provide one in the chat settings.' });
+    }
+
+    const started = Date.now();
+    let upstream;
+    try {
+        upstream = await streamRagResponse(message, userId, tokenToUse, req.ip);
+    } catch (error) {
+        console.error('Error opening chat stream:', error.message);
+        if (error.status) {
+            // Pass the Python service's answer through (429 + Retry-After from admission control)
+            if (error.retryAfter) {
+                res.set('Retry-After', error.retryAfter);
+            }
+            return res.status(error.status).json(error.body || { error: 'Failed to open stream from AI model' });
+        }
+        return res.status(502).json({ error: 'Failed to open stream from AI model', details: error.message });
+    }
+
+    res.writeHead(200, {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive',
+        'X-Accel-Buffering': 'no'
+    });
+
+    let firstChunk = true;
+    upstream.on('data', (chunk) => {
+        if (firstChunk) {
+            firstChunk = false;
+            console.log(`chat stream TTFB: ${Date.now() - started}ms (user: ${userId || 'anonymous'})`);
+        }
+        res.write(chunk);
+    });
+    upstream.on('end', () => {
+        console.log(`chat stream finished in ${Date.now() - started}ms`);
+        res.end();
+    });
+    upstream.on('error', (err) => {
+        res.write(`event: error\ndata: ${JSON.stringify({ error: err.message })}\n\n`);
+        res.end();
+    });
+    // Client went away: stop the upstream generation as well
+    req.on('close', () => upstream.destroy());
+};
+
+module.exports = { chatHandler, streamChatHandler };
@@ -0,0 +1,41 @@
+// node --test: streamChatHandler against a stub Python SSE endpoint.
+const test = require('node:test');
+const assert = require('node:assert');
+const http = require('http');
+const express = require('express');
+
+function listen(server) {
+    return new Promise((resolve) => server.listen(0, '127.0.0.1', () => resolve(server.address().port)));
+}
+
+test('streamChatHandler passes a 429 and its Retry-After through', async (t) => {
+    const python = http.createServer((req, res) => {
+        res.writeHead(429, { 'Content-Type': 'application/json', 'Retry-After': '7' });
+        res.end(JSON.stringify({ error: 'Server is busy, please retry later.', reason: 'rate_limited' }));
+    });
+    const pythonPort = await listen(python);
+    t.after(() => python.close());
+
+    process.env.PYTHON_STREAM_URL = `http://127.0.0.1:${pythonPort}/api-chat/stream`;
+    const { streamChatHandler } = require('./chatController');
+
+    const app = express();
+    app.use(express.json());
+    app.post('/api/ai-chat/stream', streamChatHandler);
+    const server = http.createServer(app);
+    const port = await listen(server);
+    t.after(() => server.close());
+
+    const response = await fetch(`http://127.0.0.1:${port}/api/ai-chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message: 'xin chào', huggingFaceToken: 'hf_test' }),
+    });
+
+    assert.strictEqual(response.status, 429);
+    assert.strictEqual(response.headers.get('retry-after'), '7');
+    assert.deepStrictEqual(await response.json(), {
+        error: 'Server is busy, please retry later.',
+        reason: 'rate_limited',
+    });
+});
@@ -4,7 +4,10 @@ from typing import Optional
 import uvicorn
 import os
 
-app = FastAPI()
+from .routes import lifespan, setup_routes
+
+# One long-lived event loop per uvicorn worker; the chatbot is built in `lifespan`
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -15,15 +18,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Health check endpoint
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
-
-# Import and setup routes
-from .routes import setup_routes
+# Chat, streaming and health routes
 setup_routes(app)
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8002))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
\ No newline at end of file
+    # python -m src.main (from the repository root)
+    uvicorn.run("src.main:app", host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,334 @@
+# File: admission.py
+"""
+Admission control and priority scheduling in front of the chatbot.
+
+A burst of chats overloads the HF router, Mongo and the CPU encoder at once.
+AdmissionController bounds the number of chats processed concurrently and
+orders the waiting ones by priority:
+
+    PRIORITY_EMERGENCY  validate_input flagged an emergency (never rejected)
+    PRIORITY_SHORT      short FAQ / price / small-talk queries
+    PRIORITY_LONG       medical or long queries (retrieval + long generation)
+
+Each user also has a token bucket so one client cannot monopolise the pool.
+When the queue is full, a user is over their rate, or a request waited longer
+than `queue_timeout`, acquire raises Overloaded with a Retry-After estimate
+(chat_runner turns it into HTTP 429).
+
+Waiters park on concurrent.futures.Future objects, so the controller can be
+shared by sync threads and by any number of event loops (Flask async views
+run each request in its own loop).
+
+Configuration (env):
+    ADMISSION_MAX_CONCURRENCY   chats processed at once (8)
+    ADMISSION_MAX_QUEUE         waiting chats before rejecting (64)
+    ADMISSION_QUEUE_TIMEOUT_S   max wait in the queue (15)
+    ADMISSION_USER_RATE         sustained requests/second per user (0.5)
+    ADMISSION_USER_BURST        bucket size per user (5)
+    TRUSTED_PROXIES             reverse proxies in front of the service whose
+                                X-Forwarded-For entries are believed (0: socket peer)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+PRIORITY_EMERGENCY = 0
+PRIORITY_SHORT = 1
+PRIORITY_LONG = 2
+PRIORITY_NAMES = {PRIORITY_EMERGENCY: "emergency", PRIORITY_SHORT: "short", PRIORITY_LONG: "long"}
+
+# Queries up to this many characters count as "short"
+SHORT_QUERY_CHARS = 160
+
+
+def classify_priority(validation: Dict[str, Any], intent: Optional[str], text: str) -> int:
+    """Scheduling class for a chat from its input validation and (cheap) intent."""
+    if validation.get("is_emergency"):
+        return PRIORITY_EMERGENCY
+    if intent in ("faq", "price"):
+        return PRIORITY_SHORT
+    if intent == "medical" or len(text) > SHORT_QUERY_CHARS:
+        return PRIORITY_LONG
+    return PRIORITY_SHORT
+
+
+def anonymous_user_id(session_id: Optional[str] = None, address: Optional[str] = None) -> str:
+    """
+    user_id for a caller that sent none: its session, else its address. Anonymous
+    callers must not share one token bucket (and one chat history) under a constant.
+    """
+    if session_id:
+        return f"session:{session_id}"
+    return f"anon:{address or 'unknown'}"
+
+
+def client_address(peer: Optional[str], forwarded_for: Optional[str] = None,
+                   trusted_proxies: Optional[int] = None) -> Optional[str]:
+    """
+    Caller address for keying anonymous callers. X-Forwarded-For is set by the
+    client, so only the entry appended by the outermost of `trusted_proxies`
+    proxies is believed; with none configured the socket peer is used.
+    """
+    if trusted_proxies is None:
+        trusted_proxies = int(os.getenv("TRUSTED_PROXIES", "0"))
+    if trusted_proxies > 0 and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        if hops:
+            return hops[-min(trusted_proxies, len(hops))]
+    return peer
+
+
+class Overloaded(Exception):
+    """The chat was not admitted; retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(f"overloaded ({reason}), retry after {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """0.0 if a token was taken, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+@dataclass
+class Ticket:
+    priority: int
+    user_id: str
+    enqueued_at: float
+    admitted_at: float = 0.0
+    released: bool = field(default=False, repr=False)
+
+    @property
+    def waited_ms(self) -> float:
+        return (self.admitted_at - self.enqueued_at) * 1000
+
+
+class AdmissionController:
+    """Bounded concurrency + priority queue + per-user token buckets."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_queue: int = 64,
+        queue_timeout: float = 15.0,
+        user_rate: float = 0.5,
+        user_burst: float = 5.0,
+        max_tracked_users: int = 10000,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_tracked_users = max_tracked_users
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue: List[Tuple[int, int, concurrent.futures.Future, Ticket]] = []
+        self._seq = itertools.count()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._service_s = 1.0  # EWMA of time a chat holds a slot
+        self._waits: Dict[int, Deque[float]] = {p: deque(maxlen=512) for p in PRIORITY_NAMES}
+        self._stats = {"admitted": 0, "queued": 0, "rejected_queue_full": 0,
+                       "rejected_rate_limited": 0, "rejected_timeout": 0}
+
+    # --- internals ----------------------------------------------------------
+
+    def _retry_after_locked(self) -> float:
+        backlog = len(self._queue) + 1
+        return max(1.0, math.ceil(self._service_s * backlog / max(1, self.max_concurrency)))
+
+    def _check_rate_locked(self, user_id: str) -> float:
+        bucket = self._buckets.pop(user_id, None) or TokenBucket(self.user_rate, self.user_burst)
+        self._buckets[user_id] = bucket
+        while len(self._buckets) > self.max_tracked_users:
+            self._buckets.popitem(last=False)
+        return bucket.take()
+
+    def _enter(
+        self, priority: int, user_id: str, rate_limited: bool = True
+    ) -> Tuple[Ticket, Optional[concurrent.futures.Future]]:
+        """Admit immediately, enqueue (returns a future), or raise Overloaded."""
+        ticket = Ticket(priority=priority, user_id=user_id, enqueued_at=time.monotonic())
+        with self._lock:
+            if priority != PRIORITY_EMERGENCY and rate_limited:
+                wait = self._check_rate_locked(user_id)
+                if wait > 0:
+                    self._stats["rejected_rate_limited"] += 1
+                    raise Overloaded("rate_limited", max(1.0, math.ceil(wait)))
+            if self._active < self.max_concurrency and not self._queue:
+                self._active += 1
+                self._admit_locked(ticket)
+                return ticket, None
+            # Emergencies are always queued (ahead of everyone else)
+            if priority != PRIORITY_EMERGENCY and len(self._queue) >= self.max_queue:
+                self._stats["rejected_queue_full"] += 1
+                raise Overloaded("queue_full", self._retry_after_locked())
+            fut: concurrent.futures.Future = concurrent.futures.Future()
+            heapq.heappush(self._queue, (priority, next(self._seq), fut, ticket))
+            self._stats["queued"] += 1
+            return ticket, fut
+
+    def _admit_locked(self, ticket: Ticket) -> None:
+        ticket.admitted_at = time.monotonic()
+        self._stats["admitted"] += 1
+        self._waits[ticket.priority].append(ticket.waited_ms)
+
+    def _abandon(self, ticket: Ticket, fut: concurrent.futures.Future) -> None:
+        """Waiter gave up (timeout/cancel): leave the queue, or hand back a slot granted meanwhile."""
+        with self._lock:
+            granted = fut.done() and not fut.cancelled()
+            if not granted:
+                fut.cancel()
+                self._queue = [entry for entry in self._queue if entry[2] is not fut]
+                heapq.heapify(self._queue)
+                self._stats["rejected_timeout"] += 1
+        if granted:
+            self.release(ticket)
+
+    # --- public API ---------------------------------------------------------
+
+    def check_rate(self, user_id: str) -> None:
+        """Take one token from the user's bucket without asking for a slot; raises Overloaded."""
+        with self._lock:
+            wait = self._check_rate_locked(user_id)
+            if wait > 0:
+                self._stats["rejected_rate_limited"] += 1
+                raise Overloaded("rate_limited", max(1.0, math.ceil(wait)))
+
+    def acquire(self, priority: int, user_id: str, timeout: Optional[float] = None,
+                rate_limited: bool = True) -> Ticket:
+        """Block until admitted; raises Overloaded. `rate_limited=False` skips the user's bucket."""
+        ticket, fut = self._enter(priority, user_id, rate_limited)
+        if fut is None:
+            return ticket
+        try:
+            return fut.result(timeout=self.queue_timeout if timeout is None else timeout)
+        except concurrent.futures.TimeoutError:
+            self._abandon(ticket, fut)
+            with self._lock:
+                retry = self._retry_after_locked()
+            raise Overloaded("timeout", retry)
+
+    async def aacquire(self, priority: int, user_id: str, timeout: Optional[float] = None,
+                       rate_limited: bool = True) -> Ticket:
+        """Await admission from any event loop; raises Overloaded."""
+        ticket, fut = self._enter(priority, user_id, rate_limited)
+        if fut is None:
+            return ticket
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(fut)),
+                timeout=self.queue_timeout if timeout is None else timeout,
+            )
+        except asyncio.TimeoutError:
+            self._abandon(ticket, fut)
+            with self._lock:
+                retry = self._retry_after_locked()
+            raise Overloaded("timeout", retry)
+        except asyncio.CancelledError:
+            self._abandon(ticket, fut)
+            raise
+
+    def release(self, ticket: Ticket) -> None:
+        """Free the slot held by `ticket` and hand it to the highest-priority waiter."""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            held = time.monotonic() - ticket.admitted_at
+            self._service_s = 0.9 * self._service_s + 0.1 * held
+            while self._queue:
+                _, _, fut, waiter = heapq.heappop(self._queue)
+                if fut.cancelled():
+                    continue
+                # The slot passes straight to the waiter (active count unchanged)
+                self._admit_locked(waiter)
+                fut.set_result(waiter)
+                return
+            self._active -= 1
+
+    @contextmanager
+    def slot(self, priority: int, user_id: str) -> Iterator[Ticket]:
+        ticket = self.acquire(priority, user_id)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, priority: int, user_id: str) -> AsyncIterator[Ticket]:
+        ticket = await self.aacquire(priority, user_id)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for prio, _, fut, _ in self._queue:
+                if not fut.cancelled():
+                    depth[PRIORITY_NAMES[prio]] += 1
+            waits = {}
+            for prio, samples in self._waits.items():
+                ordered = sorted(samples)
+                waits[PRIORITY_NAMES[prio]] = {
+                    "p50_ms": ordered[len(ordered) // 2] if ordered else 0.0,
+                    "p95_ms": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else 0.0,
+                }
+            return {
+                **self._stats,
+                "active": self._active,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": sum(depth.values()),
+                "queue_depth_by_priority": depth,
+                "wait": waits,
+                "service_ewma_ms": self._service_s * 1000,
+            }
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """Process-wide controller configured from the environment."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    max_concurrency=int(os.getenv("ADMISSION_MAX_CONCURRENCY", "8")),
+                    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+                    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", "15")),
+                    user_rate=float(os.getenv("ADMISSION_USER_RATE", "0.5")),
+                    user_burst=float(os.getenv("ADMISSION_USER_BURST", "5")),
+                )
+    return _controller
@@ -0,0 +1,114 @@
+# File: bench_batch.py
+"""
+Batch answering: N questions one by one (sequential /api-chat round-trips)
+vs RAGMedicalChatbot.run_batch, on the local stand-ins of bench_pipeline.py.
+
+Reports wall time as a multiple of the single-question latency, and how many
+encode() calls the batch needed (batched embedding) vs one per question.
+
+Run:
+    python bench_batch.py --questions 500 --concurrency 32 --llm-latency-ms 300
+    python bench_batch.py --path stream --sequential 20
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import List
+
+from bench_pipeline import QUERIES
+from local_backends import HashEncoder, InMemoryVectorCollection, build_corpus
+from main import HuggingFaceAPILLM, RAGMedicalChatbot
+from mock_llm_server import MockLLMConfig, start_mock_server
+from rag_system import RAGSystem
+
+
+class CountingEncoder(HashEncoder):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+
+    def encode(self, texts: List[str], *args, **kwargs):
+        self.calls += 1
+        return super().encode(texts, *args, **kwargs)
+
+
+def questions(n: int, offset: int = 0) -> List[str]:
+    # Unique questions (no cache / flight sharing between items)
+    return [f"{QUERIES[i % len(QUERIES)]} (câu {offset + i})" for i in range(n)]
+
+
+async def one(chatbot: RAGMedicalChatbot, path: str, message: str, user_id: str) -> None:
+    if path == "stream":
+        async for _ in chatbot.run_stream(message, user_id=user_id):
+            pass
+    else:
+        await chatbot.run(message, user_id=user_id)
+
+
+async def sequential(chatbot: RAGMedicalChatbot, path: str, n: int) -> float:
+    started = time.perf_counter()
+    for i, message in enumerate(questions(n, offset=1_000_000)):
+        await one(chatbot, path, message, f"seq_{i}")
+    return (time.perf_counter() - started) / n
+
+
+async def batch(chatbot: RAGMedicalChatbot, path: str, n: int, concurrency: int) -> tuple:
+    items = [{"message": m} for m in questions(n)]
+    started = time.perf_counter()
+    first = None
+    failed = 0
+    async for result in chatbot.run_batch(items, concurrency=concurrency, path=path):
+        first = first or time.perf_counter() - started
+        failed += not result["ok"]
+    return time.perf_counter() - started, first, failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sequential chats vs run_batch")
+    parser.add_argument("--path", choices=["run", "stream"], default="run")
+    parser.add_argument("--questions", type=int, default=500)
+    parser.add_argument("--sequential", type=int, default=20, help="questions timed one by one")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-s", type=float, default=40.0)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--encode-ms", type=float, default=15.0)
+    parser.add_argument("--per-text-ms", type=float, default=2.0)
+    parser.add_argument("--mongo-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    os.environ["LLM_CACHE_DISABLED"] = "1"
+    os.chdir(tempfile.mkdtemp(prefix="bench_batch_"))  # fresh embedding cache
+    server = start_mock_server(config=MockLLMConfig(
+        latency_ms=args.llm_latency_ms, latency_dist="lognormal", tokens_per_s=args.tokens_per_s,
+        answer_tokens=args.answer_tokens,
+    ))
+    encoder = CountingEncoder(encode_ms=args.encode_ms, per_text_ms=args.per_text_ms)
+    collection = InMemoryVectorCollection(build_corpus(encoder), latency_ms=args.mongo_ms)
+    chatbot = RAGMedicalChatbot(rag_system=RAGSystem(collection=collection, model=encoder),
+                                llm=HuggingFaceAPILLM(base_url=server.base_url))
+    if args.path == "run" and chatbot.rails is None:
+        print("⚠️ NeMo Guardrails unavailable; use --path stream")
+        return
+
+    loop = asyncio.new_event_loop()
+    try:
+        single = loop.run_until_complete(sequential(chatbot, args.path, args.sequential))
+        encoder.calls = 0
+        elapsed, first, failed = loop.run_until_complete(batch(chatbot, args.path, args.questions, args.concurrency))
+    finally:
+        loop.close()
+        server.shutdown()
+
+    print(f"single question:      {single * 1000:.0f} ms")
+    print(f"{args.questions} one by one:    ~{single * args.questions:.1f} s (estimated)")
+    print(f"run_batch (c={args.concurrency}):  {elapsed:.1f} s = {elapsed / single:.1f}x single latency, "
+          f"first result after {first * 1000:.0f} ms, {failed} failed")
+    print(f"encode() calls in the batch: {encoder.calls} (vs {args.questions} one by one)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# File: bench_llm_clients.py
+"""
+Per-call latency: fresh OpenAI client per request vs. pooled keep-alive client.
+
+Starts mock_llm_server in-process and issues the same completions twice:
+1) the old main.py behaviour (new OpenAI(...) → new connection each call)
+2) llm_clients.ClientPool (shared httpx transport, connection reuse)
+
+Run:
+    python bench_llm_clients.py --calls 200 --latency-ms 0
+Against a real TLS endpoint the saving is larger (handshake per call).
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+import httpx
+from openai import OpenAI
+
+from llm_clients import ClientPool
+from mock_llm_server import MockLLMConfig, start_mock_server
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _run(label: str, calls: int, get_client: Callable[[], OpenAI], server) -> List[float]:
+    before = server.stats.snapshot()["connections"]
+    timings = []
+    for i in range(calls):
+        client = get_client()
+        t0 = time.perf_counter()
+        client.chat.completions.create(
+            model="mock", messages=[{"role": "user", "content": f"câu hỏi {i}"}], max_tokens=16
+        )
+        timings.append((time.perf_counter() - t0) * 1000)
+    conns = server.stats.snapshot()["connections"] - before
+    print(
+        f"{label:<10} mean={statistics.mean(timings):7.2f}ms p50={_percentile(timings, 50):7.2f}ms "
+        f"p95={_percentile(timings, 95):7.2f}ms connections={conns}"
+    )
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark pooled vs per-call LLM clients")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_mock_server(config=MockLLMConfig(latency_ms=args.latency_ms))
+    base_url = server.base_url
+    print(f"🧪 Mock LLM at {base_url}, {args.calls} calls each")
+
+    fresh_clients: List[OpenAI] = []
+
+    def fresh() -> OpenAI:
+        # Mirrors the previous main.HuggingFaceAPILLM._call (one client per request)
+        client = OpenAI(api_key="hf_mock", base_url=base_url, http_client=httpx.Client())
+        fresh_clients.append(client)
+        return client
+
+    pool = ClientPool()
+    fresh_t = _run("per-call", args.calls, fresh, server)
+    pooled_t = _run("pooled", args.calls, lambda: pool.get("hf_mock", base_url), server)
+    saved = statistics.mean(fresh_t) - statistics.mean(pooled_t)
+    print(f"✅ saved {saved:.2f}ms per call ({saved / statistics.mean(fresh_t) * 100:.1f}%) | pool={pool.stats()}")
+
+    for c in fresh_clients:
+        c.close()
+    pool.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
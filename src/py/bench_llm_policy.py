@@ -0,0 +1,111 @@
+# File: bench_llm_policy.py
+"""
+Tail latency of LLM calls with and without the transport policy / hedging.
+
+Starts mock_llm_server in-process with injected long-tail latency and errors,
+then issues the same completions in three modes:
+1) raw       pooled client, no policy (errors surface to the caller)
+2) retry     TransportPolicy with deadline + jittered retries
+3) hedge     same, plus a hedged second request after the observed p95
+Finally the provider is switched to 100% errors to show the circuit breaker
+failing fast instead of burning the deadline on every call.
+
+Run:
+    python bench_llm_policy.py --calls 400 --latency-ms 20 --slow-rate 0.05 --slow-ms 800 --error-rate 0.03
+"""
+
+import argparse
+import concurrent.futures
+import time
+from typing import Callable, List, Optional, Tuple
+
+from llm_clients import ClientPool
+from llm_policy import CircuitBreaker, LLMUnavailable, TransportPolicy
+from mock_llm_server import MockLLMConfig, start_mock_server
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _run(label: str, calls: int, concurrency: int, fn: Callable[[int], None]) -> Tuple[List[float], int]:
+    def one(i: int) -> Tuple[float, bool]:
+        t0 = time.perf_counter()
+        try:
+            fn(i)
+            ok = True
+        except Exception:
+            ok = False
+        return (time.perf_counter() - t0) * 1000, ok
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(calls)))
+    timings = [t for t, _ in results]
+    ok = sum(1 for _, good in results if good)
+    print(
+        f"{label:<8} p50={_percentile(timings, 50):7.1f}ms p95={_percentile(timings, 95):7.1f}ms "
+        f"p99={_percentile(timings, 99):7.1f}ms max={max(timings):7.1f}ms success={ok / calls * 100:5.1f}%"
+    )
+    return timings, ok
+
+
+def _policy(hedge: bool, deadline: float) -> TransportPolicy:
+    return TransportPolicy(deadline=deadline, max_retries=2, backoff_base=0.05, backoff_max=0.5,
+                           hedge=hedge, breaker=CircuitBreaker(failure_threshold=5, reset_timeout=5.0))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark LLM transport policy (retries, hedging, breaker)")
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-ms", type=float, default=800.0)
+    parser.add_argument("--error-rate", type=float, default=0.03)
+    parser.add_argument("--deadline", type=float, default=5.0)
+    args = parser.parse_args()
+
+    config = MockLLMConfig(latency_ms=args.latency_ms, slow_rate=args.slow_rate,
+                           slow_ms=args.slow_ms, error_rate=args.error_rate)
+    server = start_mock_server(config=config)
+    pool = ClientPool()
+    client = pool.get("hf_mock", server.base_url)
+    print(f"🧪 Mock LLM at {server.base_url}: base={args.latency_ms}ms, "
+          f"{args.slow_rate * 100:.0f}% +{args.slow_ms}ms, {args.error_rate * 100:.0f}% errors")
+
+    def create(i: int, timeout: Optional[float] = None):
+        return client.chat.completions.create(
+            model="mock", messages=[{"role": "user", "content": f"câu hỏi {i}"}],
+            max_tokens=16, timeout=timeout,
+        )
+
+    _run("raw", args.calls, args.concurrency, lambda i: create(i))
+
+    retry = _policy(hedge=False, deadline=args.deadline)
+    _run("retry", args.calls, args.concurrency, lambda i: retry.call(lambda t: create(i, t)))
+    print(f"         {retry.stats()}")
+
+    hedged = _policy(hedge=True, deadline=args.deadline)
+    # Warm the latency window so the hedge delay tracks the observed p95
+    _run("warmup", 50, args.concurrency, lambda i: hedged.call(lambda t: create(i, t)))
+    _run("hedge", args.calls, args.concurrency, lambda i: hedged.call(lambda t: create(i, t)))
+    print(f"         {hedged.stats()}")
+
+    # Provider outage: the breaker opens after a few failures and later calls fail fast
+    server.config.error_rate = 1.0
+    server.config.slow_rate = 0.0
+    outage = _policy(hedge=False, deadline=args.deadline)
+    timings, _ = _run("outage", 100, 1, lambda i: outage.call(lambda t: create(i, t)))
+    try:
+        outage.call(lambda t: create(0, t))
+    except LLMUnavailable as e:
+        print(f"         fail-fast: {type(e).__name__}; {outage.stats()}")
+
+    pool.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# File: bench_memory_store.py
+"""
+Soak test for ConversationMemoryStore: many synthetic users, flat RSS.
+
+Each request picks a user (a hot set plus a long tail of one-off users), loads
+its memory from the store (rebuilt from the chat store on a miss), appends a
+short exchange and records it. RSS is
+sampled every `--report-every` requests; with the cap in place it plateaus once
+the store is full, while the unbounded dict (--unbounded, the previous
+behaviour) keeps growing.
+
+Uses a langchain-free stand-in with the ConversationSummaryBufferMemory
+attributes the store serializes (moving_summary_buffer, chat_memory.messages).
+
+Run:
+    python bench_memory_store.py --users 100000 --max-sessions 2000
+    python bench_memory_store.py --users 100000 --unbounded
+"""
+
+import argparse
+import os
+import random
+import resource
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from chat_store import ChatStore
+from memory_store import ConversationMemoryStore
+
+
+@dataclass
+class _Message:
+    type: str
+    content: str
+
+
+@dataclass
+class _ChatHistory:
+    messages: List[_Message] = field(default_factory=list)
+
+    def add_user_message(self, content: str) -> None:
+        self.messages.append(_Message("human", content))
+
+    def add_ai_message(self, content: str) -> None:
+        self.messages.append(_Message("ai", content))
+
+
+@dataclass
+class FakeSummaryMemory:
+    chat_memory: _ChatHistory = field(default_factory=_ChatHistory)
+    moving_summary_buffer: str = ""
+
+
+def rss_mb() -> float:
+    """Current RSS (falls back to peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Soak test for the per-user memory store")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=0, help="defaults to 2 x users")
+    parser.add_argument("--hot-users", type=int, default=500)
+    parser.add_argument("--hot-share", type=float, default=0.5, help="fraction of requests from hot users")
+    parser.add_argument("--max-sessions", type=int, default=2000)
+    parser.add_argument("--idle-ttl", type=float, default=1800.0)
+    parser.add_argument("--report-every", type=int, default=20000)
+    parser.add_argument("--unbounded", action="store_true", help="plain dict, the previous behaviour")
+    args = parser.parse_args()
+    requests = args.requests or 2 * args.users
+    rng = random.Random(0)
+
+    path = os.path.join(tempfile.mkdtemp(prefix="memory_soak_"), "chat_store.sqlite")
+    chat_store = ChatStore(path)
+    store = ConversationMemoryStore(
+        factory=FakeSummaryMemory, chat_store=chat_store, max_sessions=args.max_sessions, idle_ttl=args.idle_ttl
+    )
+    plain: Dict[str, FakeSummaryMemory] = {}
+
+    start_rss = rss_mb()
+    t0 = time.perf_counter()
+    print(f"{'requests':>10}{'rss_mb':>10}{'resident':>10}{'evicted':>10}{'rehydrated':>12}")
+    for i in range(1, requests + 1):
+        if rng.random() < args.hot_share:
+            user_id = f"user_{rng.randrange(args.hot_users)}"
+        else:
+            user_id = f"user_{rng.randrange(args.users)}"
+        if args.unbounded:
+            memory = plain.setdefault(user_id, FakeSummaryMemory())
+        else:
+            memory = store.get(user_id)
+        question = f"Câu hỏi {i} về thuốc hạ sốt và liều dùng cho trẻ em?"
+        answer = f"Trả lời {i}: dùng theo chỉ định của bác sĩ. " * 4
+        memory.chat_memory.add_user_message(question)
+        memory.chat_memory.add_ai_message(answer)
+        if not args.unbounded:
+            store.record_turn(user_id, memory, question, answer)
+        # Stand-in for the summary worker folding the buffer into the moving summary
+        if len(memory.chat_memory.messages) > 6:
+            memory.moving_summary_buffer = ("Tóm tắt hội thoại. " * 10)[:400]
+            dropped = len(memory.chat_memory.messages) - 4
+            del memory.chat_memory.messages[:dropped]
+            if not args.unbounded:
+                store.summarized(user_id, memory, dropped)
+        if i % args.report_every == 0:
+            if args.unbounded:
+                st = {"resident": len(plain), "evicted_lru": 0, "rehydrated": 0}
+            else:
+                st = store.stats()
+            print(f"{i:>10}{rss_mb():>10.1f}{st['resident']:>10}{st['evicted_lru']:>10}{st['rehydrated']:>12}")
+
+    elapsed = time.perf_counter() - t0
+    print(f"\n{requests} requests in {elapsed:.1f}s ({requests / elapsed:.0f} req/s), "
+          f"RSS {start_rss:.1f} -> {rss_mb():.1f} MB")
+    if not args.unbounded:
+        print(f"store: {store.stats()}")
+        chat_store.close()
+        print(f"chat store file: {os.path.getsize(path) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
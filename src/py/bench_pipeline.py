@@ -0,0 +1,196 @@
+# File: bench_pipeline.py
+"""
+Full-pipeline latency benchmark without HF tokens, MongoDB Atlas or BGE-M3.
+
+Drives RAGMedicalChatbot.run (NeMo path) or run_stream (streaming path) with:
+- mock_llm_server started in-process (latency distribution + token rate),
+- local_backends.InMemoryVectorCollection as the Mongo stand-in,
+- local_backends.HashEncoder as the encoder (simulated CPU cost per call),
+and reports per-stage p50/p95/p99 and throughput at increasing concurrency.
+
+Run:
+    python bench_pipeline.py --concurrency 1,4,16,64 --requests 128 \\
+        --llm-latency-ms 300 --llm-dist lognormal --tokens-per-s 40 --encode-ms 15
+    python bench_pipeline.py --path stream
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from local_backends import HashEncoder, InMemoryVectorCollection, build_corpus
+from main import HuggingFaceAPILLM, RAGMedicalChatbot
+from mock_llm_server import LATENCY_DISTS, MockLLMConfig, start_mock_server
+from rag_system import RAGSystem
+
+QUERIES = [
+    "Giá Paracetamol 500mg là bao nhiêu?",
+    "Làm sao để đăng nhập vào trang web?",
+    "Tôi bị sốt và đau đầu hai ngày nay, nên làm gì?",
+    "Vitamin C 1000mg có công dụng gì?",
+    "Chính sách đổi trả sản phẩm như thế nào?",
+    "Triệu chứng của bệnh tiểu đường là gì?",
+    "Xin chào",
+    "Máy đo huyết áp Omron giá bao nhiêu?",
+]
+
+
+class StageTimer:
+    """Thread-safe collection of per-stage durations (ms)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def record(self, stage: str, ms: float) -> None:
+        with self._lock:
+            self.samples[stage].append(ms)
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - t0) * 1000)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.samples = defaultdict(list)
+
+
+TIMER = StageTimer()
+
+
+class TimedRAGSystem(RAGSystem):
+    def embed_query(self, text: str) -> List[float]:
+        with TIMER.timed("embed"):
+            return super().embed_query(text)
+
+    def _vector_search(self, query: str, k: int, query_vec: Optional[List[float]] = None) -> List[Dict]:
+        with TIMER.timed("vector_search"):
+            return super()._vector_search(query, k, query_vec)
+
+    def retrieve_and_build_context(self, input_dict: Dict[str, Any]) -> str:
+        with TIMER.timed("retrieval"):
+            return super().retrieve_and_build_context(input_dict)
+
+
+class TimedLLM(HuggingFaceAPILLM):
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        with TIMER.timed("llm"):
+            return super()._call(prompt, stop, run_manager, **kwargs)
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        with TIMER.timed("llm"):
+            return await super()._acall(prompt, stop, run_manager, **kwargs)
+
+
+def _timed_method(stage: str, fn):
+    def wrapper(*args, **kwargs):
+        with TIMER.timed(stage):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+async def _drive(chatbot: RAGMedicalChatbot, path: str, requests: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        query = QUERIES[i % len(QUERIES)]
+        async with sem:
+            t0 = time.perf_counter()
+            if path == "stream":
+                first = None
+                stats: Dict[str, Any] = {}
+                async for _ in chatbot.run_stream(query, user_id=f"bench_user_{i}", stats=stats):
+                    if first is None:
+                        first = time.perf_counter()
+                        TIMER.record("ttft", (first - t0) * 1000)
+                if "pre_llm_ms" in stats:
+                    TIMER.record("pre_llm", stats["pre_llm_ms"])
+                    TIMER.record("pre_llm_saved", stats["pre_llm_saved_ms"])
+            else:
+                await chatbot.run(query, user_id=f"bench_user_{i}")
+            TIMER.record("total", (time.perf_counter() - t0) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return time.perf_counter() - started
+
+
+def _report(concurrency: int, requests: int, elapsed: float) -> None:
+    print(f"\n== concurrency={concurrency} requests={requests} "
+          f"throughput={requests / elapsed:.2f} req/s wall={elapsed:.2f}s")
+    print(f"{'stage':<14}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}")
+    order = ["validate", "intent", "embed", "vector_search", "retrieval", "pre_llm", "pre_llm_saved",
+             "llm", "ttft", "total"]
+    for stage in order + sorted(set(TIMER.samples) - set(order)):
+        values = TIMER.samples.get(stage)
+        if not values:
+            continue
+        print(f"{stage:<14}{len(values):>6}{_percentile(values, 50):>9.1f}ms{_percentile(values, 95):>9.1f}ms"
+              f"{_percentile(values, 99):>9.1f}ms{statistics.mean(values):>9.1f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Full-pipeline latency benchmark with local stand-ins")
+    parser.add_argument("--path", choices=["run", "stream"], default="run")
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-dist", choices=LATENCY_DISTS, default="lognormal")
+    parser.add_argument("--llm-spread", type=float, default=0.5)
+    parser.add_argument("--tokens-per-s", type=float, default=40.0)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--encode-ms", type=float, default=15.0)
+    parser.add_argument("--mongo-ms", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-llm-cache", action="store_true", help="disable the completion cache")
+    args = parser.parse_args()
+    if args.no_llm_cache:
+        os.environ["LLM_CACHE_DISABLED"] = "1"
+
+    server = start_mock_server(config=MockLLMConfig(
+        latency_ms=args.llm_latency_ms, latency_dist=args.llm_dist, latency_spread=args.llm_spread,
+        tokens_per_s=args.tokens_per_s, answer_tokens=args.answer_tokens, seed=args.seed,
+    ))
+    encoder = HashEncoder(encode_ms=args.encode_ms)
+    collection = InMemoryVectorCollection(build_corpus(encoder), latency_ms=args.mongo_ms)
+    print(f"🧪 Mock LLM at {server.base_url}; {collection.estimated_document_count()} docs in the Mongo stand-in")
+
+    rag = TimedRAGSystem(collection=collection, model=encoder)
+    # Local base URL: the chatbot runs without a real HF token
+    chatbot = RAGMedicalChatbot(rag_system=rag, llm=TimedLLM(base_url=server.base_url))
+    chatbot.guardrails.validate_input = _timed_method("validate", chatbot.guardrails.validate_input)
+    chatbot.guardrails.detect_intent = _timed_method("intent", chatbot.guardrails.detect_intent)
+    if args.path == "run" and chatbot.rails is None:
+        print("⚠️ NeMo Guardrails unavailable; use --path stream")
+        return
+
+    loop = asyncio.new_event_loop()
+    try:
+        for level in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+            TIMER.reset()
+            elapsed = loop.run_until_complete(_drive(chatbot, args.path, args.requests, level))
+            _report(level, args.requests, elapsed)
+    finally:
+        loop.close()
+        print(f"\nmock LLM: {server.stats.snapshot()}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
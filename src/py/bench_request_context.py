@@ -0,0 +1,102 @@
+# File: bench_request_context.py
+"""
+Credential isolation and throughput of one shared LLM under concurrent users.
+
+RAGMedicalChatbot's rails hold a single HuggingFaceAPILLM. Three ways to issue
+each user's call with that user's token:
+1) serialized  old workaround: a process-wide lock around "set token + call"
+2) shared      old code without the lock: `llm.hf_token = token` then await
+               (another request can overwrite the token before the call goes out)
+3) context     request_context.request_scope: the token is resolved per call
+4) same_prompt  context, but every user sends the same prompt at once: the
+               in-flight LLM call is coalesced per token, never across users
+
+The mock server runs with echo_auth, so every answer carries the bearer token
+it was sent with; a request is "leaked" when it carries someone else's token.
+The completion cache is disabled: it is shared across users for rails tasks
+by design and would answer repeated prompts without a call.
+
+Run:
+    python bench_request_context.py --users 64 --concurrency 1,8,32,64 --llm-latency-ms 200
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, List, Tuple
+
+os.environ["LLM_CACHE_DISABLED"] = "1"
+
+from main import HuggingFaceAPILLM  # noqa: E402
+from mock_llm_server import MockLLMConfig, start_mock_server  # noqa: E402
+from request_context import request_scope  # noqa: E402
+
+MODES = ("serialized", "shared", "context", "same_prompt")
+
+
+async def _one(llm: HuggingFaceAPILLM, mode: str, lock: asyncio.Lock, token: str, prompt: str) -> str:
+    if mode == "serialized":
+        async with lock:
+            llm.hf_token = token
+            return await llm._acall(prompt)
+    if mode == "shared":
+        llm.hf_token = token
+        await asyncio.sleep(0)  # rails pre-processing before the LLM call
+        return await llm._acall(prompt)
+    with request_scope(hf_token=token, user_id=token):
+        await asyncio.sleep(0)
+        return await llm._acall(prompt)
+
+
+async def _drive(llm: HuggingFaceAPILLM, mode: str, users: int, requests: int, concurrency: int) -> Tuple[float, int]:
+    sem = asyncio.Semaphore(concurrency)
+    lock = asyncio.Lock()
+    leaked = 0
+
+    async def worker(i: int) -> None:
+        nonlocal leaked
+        token = f"hf_mock_user_{i % users:04d}"
+        async with sem:
+            prompt = "Câu hỏi chung cho mọi người dùng" if mode == "same_prompt" else f"Câu hỏi số {i} của {token}"
+            answer = await _one(llm, mode, lock, token, prompt)
+        if not answer.startswith(f"[auth:{token}]"):
+            leaked += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(requests)))
+    return time.perf_counter() - started, leaked
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-request credentials on a shared LLM")
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", default="1,8,32,64")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--modes", default=",".join(MODES))
+    args = parser.parse_args()
+
+    server = start_mock_server(config=MockLLMConfig(latency_ms=args.llm_latency_ms, echo_auth=True))
+    llm = HuggingFaceAPILLM(base_url=server.base_url, max_new_tokens=64)
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    results: Dict[str, List[Tuple[int, float, int]]] = {}
+
+    loop = asyncio.new_event_loop()
+    try:
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            for level in levels:
+                elapsed, leaked = loop.run_until_complete(_drive(llm, mode, args.users, args.requests, level))
+                results.setdefault(mode, []).append((level, elapsed, leaked))
+    finally:
+        loop.close()
+        server.shutdown()
+
+    print(f"{'mode':<12}{'concurrency':>12}{'req/s':>10}{'leaked':>10}")
+    for mode, rows in results.items():
+        for level, elapsed, leaked in rows:
+            print(f"{mode:<12}{level:>12}{args.requests / elapsed:>10.1f}{leaked:>7}/{args.requests}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# File: bench_serving.py
+"""
+Serving-layer load test: Flask (services/chat_runner.py) vs ASGI (src/main.py routes).
+
+Both servers run the same chatbot with the local stand-ins of bench_pipeline.py
+(mock LLM server, in-memory vector collection, hash encoder), each in its own
+subprocess so the load generator does not share their GIL:
+- flask  chat_runner.app on werkzeug's threaded server (what app.run does):
+         async views get a fresh event loop per request
+- asgi   FastAPI app with src/routes.py on uvicorn: one event loop per worker
+
+Run:
+    python bench_serving.py --concurrency 50,200 --requests 400 --llm-latency-ms 300
+    python bench_serving.py --endpoint stream      # /api-chat/stream (no NeMo needed)
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.abspath(os.path.join(HERE, "..", ".."))
+SERVICES = os.path.abspath(os.path.join(HERE, "..", "services"))
+SERVERS = ("flask", "asgi")
+QUERIES = [
+    "Giá Paracetamol 500mg là bao nhiêu?",
+    "Làm sao để đăng nhập vào trang web?",
+    "Tôi bị sốt và đau đầu hai ngày nay, nên làm gì?",
+    "Chính sách đổi trả sản phẩm như thế nào?",
+]
+
+
+# --- server side (child process) ------------------------------------------------
+
+def build_chatbot(args: argparse.Namespace) -> Any:
+    """RAGMedicalChatbot on local stand-ins (see bench_pipeline.py)."""
+    from local_backends import HashEncoder, InMemoryVectorCollection, build_corpus
+    from main import HuggingFaceAPILLM, RAGMedicalChatbot
+    from mock_llm_server import MockLLMConfig, start_mock_server
+    from rag_system import RAGSystem
+
+    server = start_mock_server(config=MockLLMConfig(
+        latency_ms=args.llm_latency_ms, latency_dist="lognormal", tokens_per_s=args.tokens_per_s,
+        answer_tokens=args.answer_tokens,
+    ))
+    encoder = HashEncoder(encode_ms=args.encode_ms)
+    collection = InMemoryVectorCollection(build_corpus(encoder), latency_ms=args.mongo_ms)
+    rag = RAGSystem(collection=collection, model=encoder)
+    return RAGMedicalChatbot(rag_system=rag, llm=HuggingFaceAPILLM(base_url=server.base_url))
+
+
+def serve_flask(port: int, factory: Callable[[], Any]) -> None:
+    from werkzeug.serving import make_server
+
+    import main
+    main.RAGMedicalChatbot = factory  # chat_runner builds its singleton at import
+    sys.path.insert(0, SERVICES)
+    import chat_runner
+
+    make_server("127.0.0.1", port, chat_runner.app, threaded=True).serve_forever()
+
+
+def serve_asgi(port: int, factory: Callable[[], Any]) -> None:
+    import uvicorn
+    from fastapi import FastAPI
+
+    sys.path.insert(0, REPO_ROOT)
+    from src.routes import lifespan, setup_routes
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.chatbot_factory = factory
+    setup_routes(app)
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+# --- load generator -------------------------------------------------------------
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))] if ordered else 0.0
+
+
+async def drive(base_url: str, endpoint: str, requests: int, concurrency: int) -> Dict[str, float]:
+    """`concurrency` connections, each a client of its own (httpx's shared pool degrades at ~200)."""
+    path = "/api-chat/stream" if endpoint == "stream" else "/api-chat"
+    latencies: List[float] = []
+    errors = 0
+    next_i = 0
+
+    async def lane() -> None:
+        nonlocal errors, next_i
+        async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+            while next_i < requests:
+                i = next_i
+                next_i += 1
+                body = {"message": QUERIES[i % len(QUERIES)], "user_id": f"bench_user_{i}", "hf_token": "hf_bench"}
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post(path, json=body)
+                    if r.status_code != 200 or "event: error" in r.text:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - t0) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(lane() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {"rps": requests / elapsed, "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95), "p99": _percentile(latencies, 99), "errors": errors}
+
+
+def wait_healthy(base_url: str, proc: subprocess.Popen, timeout: float = 300.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not become healthy")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Flask vs ASGI serving under concurrent connections")
+    parser.add_argument("--servers", default=",".join(SERVERS))
+    parser.add_argument("--endpoint", choices=["chat", "stream"], default="chat")
+    parser.add_argument("--concurrency", default="50,200")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-s", type=float, default=40.0)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--encode-ms", type=float, default=15.0)
+    parser.add_argument("--mongo-ms", type=float, default=5.0)
+    parser.add_argument("--admission-concurrency", type=int, default=256,
+                        help="ADMISSION_MAX_CONCURRENCY for the servers (the default 8 would cap both)")
+    parser.add_argument("--serve", choices=SERVERS, help=argparse.SUPPRESS)  # child process mode
+    args = parser.parse_args()
+
+    if args.serve:
+        if args.serve == "asgi":
+            os.environ["NEST_ASYNCIO"] = "0"
+        serve = serve_flask if args.serve == "flask" else serve_asgi
+        serve(args.port, lambda: build_chatbot(args))
+        return
+
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    rows = []
+    for kind in [s.strip() for s in args.servers.split(",") if s.strip()]:
+        base_url = f"http://127.0.0.1:{args.port}"
+        env = {**os.environ, "ADMISSION_MAX_CONCURRENCY": str(args.admission_concurrency),
+               "ADMISSION_MAX_QUEUE": str(max(levels) * 2)}
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--serve", kind],
+                                stdout=subprocess.DEVNULL, env=env)
+        try:
+            wait_healthy(base_url, proc)
+            for level in levels:
+                rows.append((kind, level, asyncio.run(drive(base_url, args.endpoint, args.requests, level))))
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    print(f"{'server':<8}{'conns':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for kind, level, r in rows:
+        print(f"{kind:<8}{level:>7}{r['rps']:>9.1f}{r['p50']:>10.0f}{r['p95']:>10.0f}{r['p99']:>10.0f}"
+              f"{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
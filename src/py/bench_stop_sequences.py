@@ -0,0 +1,97 @@
+# File: bench_stop_sequences.py
+"""
+Tokens and latency saved by cross-chunk stop detection with early stream close.
+
+The mock server streams one word per chunk, so the stop string "Người dùng:"
+always arrives split over two deltas. Two consumers read the same stream:
+1) per-delta  the previous stream_call check (stop searched inside each delta):
+              misses the split stop and reads until max_tokens
+2) detector   stop_sequences.stream_until_stop + closing the HTTP stream at the match
+
+Run:
+    python bench_stop_sequences.py --runs 20 --tokens-per-s 80 --answer-tokens 200
+"""
+
+import argparse
+import statistics
+import time
+from typing import Iterator, List, Tuple
+
+from llm_clients import ClientPool, stream_deltas
+from mock_llm_server import MockLLMConfig, start_mock_server
+from stop_sequences import stream_until_stop, trim_at_stop
+
+STOP = ["Người dùng:"]
+# mock answers echo the prompt tail, so the stop string shows up early in the answer
+PROMPT = "Trợ lý: Paracetamol giúp hạ sốt. Người dùng: còn ibuprofen thì sao"
+
+
+def per_delta(deltas: Iterator[str], stops: List[str]) -> Iterator[str]:
+    """Previous behaviour: a stop is only found when it sits inside a single delta."""
+    for content in deltas:
+        for stop_seq in stops:
+            if stop_seq in content:
+                yield content.split(stop_seq)[0]
+                return
+        yield content
+
+
+def _consume(client, consumer) -> Tuple[str, int, float]:
+    t0 = time.perf_counter()
+    stream = client.chat.completions.create(
+        model="mock", messages=[{"role": "user", "content": PROMPT}], max_tokens=512, stream=True
+    )
+    chunks = 0
+
+    def counted() -> Iterator[str]:
+        nonlocal chunks
+        for delta in stream_deltas(stream):
+            chunks += 1
+            yield delta
+
+    try:
+        text = "".join(consumer(counted(), STOP))
+    finally:
+        stream.close()
+    return text, chunks, (time.perf_counter() - t0) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark cross-chunk stop detection")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--tokens-per-s", type=float, default=80.0)
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    server = start_mock_server(config=MockLLMConfig(
+        latency_ms=args.latency_ms, tokens_per_s=args.tokens_per_s, answer_tokens=args.answer_tokens
+    ))
+    pool = ClientPool()
+    client = pool.get("hf_mock", server.base_url)
+
+    for label, consumer in (("per-delta", per_delta), ("detector", stream_until_stop)):
+        before = server.stats.snapshot()["tokens_sent"]
+        timings: List[float] = []
+        chunk_counts: List[int] = []
+        correct = 0
+        for _ in range(args.runs):
+            text, chunks, ms = _consume(client, consumer)
+            timings.append(ms)
+            chunk_counts.append(chunks)
+            correct += int(text == trim_at_stop(text, STOP))
+        time.sleep(0.2)  # let the server notice closed streams
+        sent = server.stats.snapshot()["tokens_sent"] - before
+        print(
+            f"{label:<10} latency mean={statistics.mean(timings):7.1f}ms "
+            f"chunks read={statistics.mean(chunk_counts):6.1f} "
+            f"server tokens={sent / args.runs:6.1f}/run stop trimmed={correct}/{args.runs}"
+        )
+
+    print(f"mock: {server.stats.snapshot()}")
+    pool.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
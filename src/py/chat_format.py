@@ -0,0 +1,97 @@
+# File: chat_format.py
+"""
+Response formatting shared by the HTTP front ends (Flask chat_runner.py,
+ASGI src/routes.py) and the Node worker mode.
+"""
+
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+# Paths like /login, /products
+PATH_REGEX = r"\/[a-zA-Z0-9-]+"
+
+# Largest accepted /api-chat/batch request
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+
+
+def format_links(text: str) -> str:
+    """Turn bare site paths in the answer into markdown links."""
+    found_paths = re.findall(PATH_REGEX, text)
+
+    if found_paths:
+        # Process longer paths first to avoid partial replacements
+        unique_paths = sorted(list(set(found_paths)), key=len, reverse=True)
+        for path in unique_paths:
+            # Create a user-friendly name from the path
+            link_name = path.lstrip('/').replace('-', ' ').title()
+            markdown_link = f"[{link_name}]({path})"
+
+            # More robust replacement that handles surrounding quotes or spaces
+            # This looks for the path not preceded or followed by other path-like characters
+            text = re.sub(r'(?<!\w)' + re.escape(path) + r'(?!\w)', markdown_link, text)
+
+    return text
+
+
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    """One Server-Sent Events frame with a JSON payload."""
+    payload = json.dumps(data, ensure_ascii=False)
+    return (f"event: {event}\n" if event else "") + f"data: {payload}\n\n"
+
+
+def ndjson(data: Any) -> str:
+    """One newline-delimited JSON record."""
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+def batch_items(raw: Any) -> List[Dict[str, Any]]:
+    """
+    Normalize the `items` of a batch request: strings or {"message", "user_id"}
+    objects. Raises ValueError for a malformed or oversized batch.
+    """
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("items must be a non-empty list")
+    if len(raw) > BATCH_MAX_ITEMS:
+        raise ValueError(f"at most {BATCH_MAX_ITEMS} items per batch")
+    items = []
+    for entry in raw:
+        if isinstance(entry, str):
+            entry = {"message": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("message"), str):
+            raise ValueError("each item must be a string or an object with a string 'message'")
+        items.append({"message": entry["message"], "user_id": entry.get("user_id")})
+    return items
+
+
+class BatchTally:
+    """Running totals of a /api-chat/batch response, for its final `done` record."""
+
+    def __init__(self, expected: int) -> None:
+        self.expected = expected
+        self.started = time.perf_counter()
+        self.failed = 0
+        self.total_ms: List[float] = []
+
+    def add(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Count `result` and return it with its reply link-formatted."""
+        if not result.get("ok"):
+            self.failed += 1
+        self.total_ms.append(result.get("total_ms", 0.0))
+        if result.get("reply"):
+            result["reply"] = format_links(result["reply"])
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        ordered = sorted(self.total_ms)
+        return {
+            "done": True,
+            "count": len(ordered),
+            "expected": self.expected,
+            "failed": self.failed,
+            "elapsed_ms": (time.perf_counter() - self.started) * 1000,
+            "p50_ms": ordered[len(ordered) // 2] if ordered else 0.0,
+            "p95_ms": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else 0.0,
+        }
@@ -0,0 +1,218 @@
+# File: chat_store.py
+"""
+Shared conversation store: chat turns and running summaries in SQLite (WAL).
+
+Conversation state used to live in three unconnected places (the chatbot's
+in-process memories, Streamlit session_state and per-user JSON files under
+user_data/chats), so a follow-up served by another worker process had no
+history. ChatStore is the single source of truth every process reads and
+writes; SQLite in WAL mode stands in for a shared database (readers never
+block the writer, several processes can open the same file).
+
+Tables:
+    turns      one compact row per message (user_id, ts, role, content),
+               indexed by (user_id, id) for cheap last-N reads
+    summaries  per-user running summary and how many messages it covers
+
+Writes are batched: append() queues rows and a writer thread commits every
+`flush_interval` seconds (or `max_batch` rows) in one transaction. Reads by
+the same process flush that user's pending rows first; other processes see a
+turn at most `flush_interval` later.
+
+Configuration (env):
+    CHAT_STORE_PATH       SQLite file (user_data/chat_store.sqlite)
+    CHAT_STORE_FLUSH_MS   batching window for writes (20)
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+USER = "user"
+ASSISTANT = "assistant"
+
+
+class ChatStore:
+    """Per-user turns and summaries in a WAL-mode SQLite file, with batched writes."""
+
+    def __init__(self, path: str, flush_interval: float = 0.02, max_batch: int = 256) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[str, float, str, str]] = []
+        self._pending_users: Set[str] = set()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._stats = {"appended": 0, "flushes": 0, "rows_written": 0, "reads": 0}
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        db = self._conn()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL,"
+            " ts REAL NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_turns_user ON turns(user_id, id)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_turns_ts ON turns(ts)")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " user_id TEXT PRIMARY KEY, summary TEXT NOT NULL,"
+            " covered INTEGER NOT NULL, updated REAL NOT NULL)"
+        )
+        self._writer = threading.Thread(target=self._write_loop, name="chat-store-writer", daemon=True)
+        self._writer.start()
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread (WAL readers run concurrently)."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10.0)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # --- writes -----------------------------------------------------------------
+
+    def append(self, user_id: str, messages: Sequence[Tuple[str, str]]) -> float:
+        """Queue (role, content) messages for `user_id`; returns their timestamp."""
+        ts = time.time()
+        with self._cond:
+            for role, content in messages:
+                self._pending.append((user_id, ts, role, content))
+            self._pending_users.add(user_id)
+            self._stats["appended"] += len(messages)
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        return ts
+
+    def _take_pending(self) -> List[Tuple[str, float, str, str]]:
+        with self._cond:
+            rows, self._pending = self._pending, []
+            self._pending_users = set()
+            return rows
+
+    def _flush_locked(self) -> None:
+        """Write every queued row in one transaction (caller holds _write_lock, so rows stay in order)."""
+        rows = self._take_pending()
+        if not rows:
+            return
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("INSERT INTO turns(user_id, ts, role, content) VALUES (?, ?, ?, ?)", rows)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        self._stats["flushes"] += 1
+        self._stats["rows_written"] += len(rows)
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                self._cond.wait(timeout=self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Chat store write failed: {e}")
+
+    def flush(self) -> None:
+        """Commit pending rows now."""
+        with self._write_lock:
+            self._flush_locked()
+
+    def _flush_for(self, user_id: str) -> None:
+        with self._cond:
+            pending = user_id in self._pending_users
+        if pending:
+            self.flush()
+
+    def put_summary(self, user_id: str, summary: str, covered: int) -> None:
+        """Running summary of the user's first `covered` messages."""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO summaries(user_id, summary, covered, updated) VALUES (?, ?, ?, ?)",
+            (user_id, summary, covered, time.time()),
+        )
+
+    def clear(self, user_id: str) -> None:
+        self._flush_for(user_id)
+        db = self._conn()
+        with self._write_lock:
+            db.execute("DELETE FROM turns WHERE user_id = ?", (user_id,))
+            db.execute("DELETE FROM summaries WHERE user_id = ?", (user_id,))
+
+    # --- reads --------------------------------------------------------------------
+
+    def last_messages(self, user_id: str, n: int = 50) -> List[Dict[str, Any]]:
+        """The user's last `n` messages, oldest first: [{"role", "content", "ts"}]."""
+        self._flush_for(user_id)
+        self._stats["reads"] += 1
+        rows = self._conn().execute(
+            "SELECT role, content, ts FROM turns WHERE user_id = ? ORDER BY id DESC LIMIT ?", (user_id, n)
+        ).fetchall()
+        return [{"role": r, "content": c, "ts": ts} for r, c, ts in reversed(rows)]
+
+    def messages_from(self, user_id: str, offset: int) -> List[Dict[str, Any]]:
+        """The user's messages after the first `offset` ones (those not yet summarized)."""
+        self._flush_for(user_id)
+        self._stats["reads"] += 1
+        rows = self._conn().execute(
+            "SELECT role, content, ts FROM turns WHERE user_id = ? ORDER BY id LIMIT -1 OFFSET ?",
+            (user_id, offset),
+        ).fetchall()
+        return [{"role": r, "content": c, "ts": ts} for r, c, ts in rows]
+
+    def last_ts(self, user_id: str) -> float:
+        """Timestamp of the user's latest stored message (0.0 if none)."""
+        self._flush_for(user_id)
+        row = self._conn().execute(
+            "SELECT ts FROM turns WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,)
+        ).fetchone()
+        return float(row[0]) if row else 0.0
+
+    def get_summary(self, user_id: str) -> Tuple[str, int]:
+        """(summary, number of messages it covers)."""
+        row = self._conn().execute(
+            "SELECT summary, covered FROM summaries WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return (row[0], int(row[1])) if row else ("", 0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = len(self._pending)
+        return {**self._stats, "pending": pending, "flush_interval_ms": self.flush_interval * 1000}
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._writer.join(timeout=5)
+        self.flush()
+
+
+_store: Optional[ChatStore] = None
+_store_lock = threading.Lock()
+
+
+def get_chat_store() -> ChatStore:
+    """Process-wide chat store configured from the environment."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChatStore(
+                    path=os.getenv(
+                        "CHAT_STORE_PATH", str(Path(__file__).parent / "user_data" / "chat_store.sqlite")
+                    ),
+                    flush_interval=float(os.getenv("CHAT_STORE_FLUSH_MS", "20")) / 1000.0,
+                )
+    return _store
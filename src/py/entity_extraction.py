@@ -0,0 +1,326 @@
+# File: entity_extraction.py
+"""
+Entity extraction service for MedicalGuardrails.extract_entities
+
+- Local fast path: gazetteer (symptoms, medications, conditions, product names)
+  compiled into one regex per category + the legacy symptom regexes.
+- Per-text LRU result cache.
+- Optional LLM path (intent_classifier.LangChainIntentClassifier): the backend is
+  resolved once per process (a failed import is remembered), the classifier is
+  built once, and calls run on a small thread pool. The request path never waits
+  longer than `llm_timeout` (default 0 → never blocks); late LLM results are
+  merged into the cache for subsequent calls.
+
+Build the gazetteer from the MongoDB corpus:
+    python entity_extraction.py --build
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+GAZETTEER_PATH = Path(os.getenv("ENTITY_GAZETTEER_PATH", str(Path(__file__).parent / "embedding_cache" / "entity_gazetteer.json")))
+
+_VI_WORD = r"[\wàáạãảăằắẳẵặâầấẩẫậèéẻẽẹêềếểễệìíỉĩịòóỏõọôồốổỗộơờớởỡợùúủũụưừứửữựỳýỷỹỵđ-]+"
+
+# Seed vocabulary; the corpus build adds product names (and anything else found)
+SEED_GAZETTEER: Dict[str, List[str]] = {
+    "symptoms": [
+        "đau đầu", "đau bụng", "đau họng", "đau lưng", "đau ngực", "đau răng", "đau khớp",
+        "sốt", "sốt cao", "ho", "ho khan", "ho có đờm", "sổ mũi", "nghẹt mũi", "hắt hơi",
+        "khó thở", "buồn nôn", "nôn", "tiêu chảy", "táo bón", "chóng mặt", "mệt mỏi",
+        "mất ngủ", "ngứa", "phát ban", "mẩn đỏ", "đầy hơi", "ợ chua",
+        "headache", "fever", "cough", "sore throat", "nausea", "diarrhea", "dizziness", "fatigue", "rash",
+    ],
+    "medications": [
+        "paracetamol", "acetaminophen", "ibuprofen", "aspirin", "amoxicillin", "cetirizine",
+        "loratadine", "omeprazole", "metformin", "vitamin c", "vitamin d", "vitamin b", "canxi",
+        "kháng sinh", "thuốc giảm đau", "thuốc hạ sốt", "thuốc ho", "thuốc cảm", "men vi sinh",
+    ],
+    "conditions": [
+        "tiểu đường", "huyết áp cao", "cao huyết áp", "hen suyễn", "viêm họng", "viêm xoang",
+        "viêm dạ dày", "trào ngược dạ dày", "cảm cúm", "cảm lạnh", "dị ứng", "mỡ máu",
+        "diabetes", "hypertension", "asthma", "allergy", "flu",
+    ],
+    "product_names": [],
+}
+
+_PRODUCT_NAME_RE = re.compile(r"Tên sản phẩm: (.*?)(?=\n|$|,)")
+
+
+def build_gazetteer(corpus_texts: Iterable[str], titles: Iterable[str] = ()) -> Dict[str, List[str]]:
+    """Seed vocabulary + product names mined from corpus documents."""
+    gaz = {k: set(v) for k, v in SEED_GAZETTEER.items()}
+    for text in corpus_texts:
+        for m in _PRODUCT_NAME_RE.finditer(text or ""):
+            name = m.group(1).strip()
+            if 2 < len(name) <= 120:
+                gaz["product_names"].add(name)
+    for title in titles:
+        if title and 2 < len(title) <= 120:
+            gaz["product_names"].add(title.strip())
+    return {k: sorted(v) for k, v in gaz.items()}
+
+
+def load_gazetteer(path: Path = GAZETTEER_PATH) -> Dict[str, List[str]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return {k: list(data.get(k, [])) or list(SEED_GAZETTEER[k]) for k in SEED_GAZETTEER}
+    except Exception:
+        return {k: list(v) for k, v in SEED_GAZETTEER.items()}
+
+
+def _compile_terms(terms: Iterable[str]) -> Optional[re.Pattern]:
+    uniq = sorted({t.strip().lower() for t in terms if t and t.strip()}, key=len, reverse=True)
+    if not uniq:
+        return None
+    return re.compile(r"(?<!\w)(" + "|".join(re.escape(t) for t in uniq) + r")(?!\w)")
+
+
+def _empty_entities() -> Dict[str, Any]:
+    return {"symptoms": [], "medications": [], "conditions": [], "product_name": ""}
+
+
+def normalize_entities(ent: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize LLM classifier output to the extract_entities schema."""
+    normalized = {
+        "symptoms": ent.get("symptom") or ent.get("symptoms") or [],
+        "medications": ent.get("medication") or ent.get("medications") or [],
+        "conditions": ent.get("condition") or ent.get("conditions") or [],
+        "product_name": ent.get("product_name") or ent.get("product") or "",
+    }
+    for k in ["symptoms", "medications", "conditions"]:
+        v = normalized.get(k)
+        if isinstance(v, str):
+            normalized[k] = [v]
+        elif not isinstance(v, list):
+            normalized[k] = []
+    if not isinstance(normalized.get("product_name"), str):
+        normalized["product_name"] = ""
+    return normalized
+
+
+def _public_copy(entities: Dict[str, Any]) -> Dict[str, Any]:
+    """Result for callers: fresh lists (never the cached ones) and no internal markers."""
+    return {k: list(v) if isinstance(v, list) else v for k, v in entities.items() if k != "_llm"}
+
+
+def _merge(local: Dict[str, Any], llm: Dict[str, Any]) -> Dict[str, Any]:
+    merged = _empty_entities()
+    for k in ["symptoms", "medications", "conditions"]:
+        merged[k] = list(dict.fromkeys([*local.get(k, []), *llm.get(k, [])]))
+    merged["product_name"] = llm.get("product_name") or local.get("product_name") or ""
+    return merged
+
+
+class EntityExtractor:
+    """Cached entity extraction with a gazetteer fast path and optional async LLM enrichment."""
+
+    # Backend resolution is process-wide: import attempted at most once
+    _backend_lock = threading.Lock()
+    _backend_resolved: bool = False
+    _backend_cls = None
+
+    def __init__(
+        self,
+        gazetteer: Optional[Dict[str, List[str]]] = None,
+        cache_size: int = 2048,
+        use_llm: Optional[bool] = None,
+        llm_timeout: float = 0.0,
+        llm_workers: int = 2,
+    ) -> None:
+        gaz = gazetteer if gazetteer is not None else load_gazetteer()
+        self._patterns = {k: _compile_terms(gaz.get(k, [])) for k in SEED_GAZETTEER}
+        self._symptom_patterns = [
+            re.compile(r"đau\s+(" + _VI_WORD + ")"),
+            re.compile(r"sốt\s+(" + _VI_WORD + ")"),
+            re.compile(r"ho\s+(" + _VI_WORD + ")"),
+        ]
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        if use_llm is None:
+            use_llm = os.getenv("ENTITY_LLM", "0") == "1"
+        self.use_llm = use_llm
+        self.llm_timeout = llm_timeout
+        self._llm_workers = llm_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._classifier = None
+        self._inflight: Dict[str, Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "llm_calls": 0, "llm_merged": 0, "llm_errors": 0}
+
+    # --- backend resolution ---
+    @classmethod
+    def _resolve_backend(cls):
+        if cls._backend_resolved:
+            return cls._backend_cls
+        with cls._backend_lock:
+            if not cls._backend_resolved:
+                try:
+                    from intent_classifier import LangChainIntentClassifier
+                    cls._backend_cls = LangChainIntentClassifier
+                except Exception:
+                    cls._backend_cls = None
+                cls._backend_resolved = True
+        return cls._backend_cls
+
+    def _get_classifier(self):
+        if self._classifier is None:
+            backend = self._resolve_backend()
+            if backend is None:
+                return None
+            self._classifier = backend()
+        return self._classifier
+
+    # --- local path ---
+    def extract_local(self, text: str) -> Dict[str, Any]:
+        entities = _empty_entities()
+        text_lower = (text or "").lower()
+        spans = []
+        for key in ["symptoms", "medications", "conditions"]:
+            pat = self._patterns.get(key)
+            if pat is not None:
+                matches = list(pat.finditer(text_lower))
+                spans.extend(m.span(1) for m in matches)
+                entities[key] = list(dict.fromkeys(m.group(1) for m in matches))
+        for pat in self._symptom_patterns:
+            for m in pat.finditer(text_lower):
+                start, end = m.span(1)
+                # "ngực" out of "đau ngực" is a fragment of a gazetteer term, not a symptom of its own
+                if any(s <= start and end <= e for s, e in spans):
+                    continue
+                if m.group(1) not in entities["symptoms"]:
+                    entities["symptoms"].append(m.group(1))
+        pat = self._patterns.get("product_names")
+        if pat is not None:
+            m = pat.search(text_lower)
+            if m:
+                entities["product_name"] = m.group(1)
+        return entities
+
+    # --- cache ---
+    def _cache_get(self, text: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            hit = self._cache.get(text)
+            if hit is not None:
+                self._cache.move_to_end(text)
+            return hit
+
+    def _cache_put(self, text: str, entities: Dict[str, Any]) -> None:
+        with self._lock:
+            self._cache[text] = entities
+            self._cache.move_to_end(text)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    # --- LLM path ---
+    def _llm_extract(self, text: str) -> Dict[str, Any]:
+        clf = self._get_classifier()
+        if clf is None:
+            return {}
+        self.stats["llm_calls"] += 1
+        result = clf.classify(text)
+        return normalize_entities(result.get("entities") or {})
+
+    def _submit_llm(self, text: str, local: Dict[str, Any]) -> Optional[Future]:
+        if not self.use_llm or self._resolve_backend() is None:
+            return None
+        with self._lock:
+            fut = self._inflight.get(text)
+            if fut is not None:
+                return fut
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._llm_workers, thread_name_prefix="entity-llm")
+            fut = self._executor.submit(self._llm_extract, text)
+            self._inflight[text] = fut
+
+        def _done(f: Future) -> None:
+            with self._lock:
+                self._inflight.pop(text, None)
+            try:
+                llm_entities = f.result()
+            except Exception:
+                self.stats["llm_errors"] += 1
+                return
+            # Mark the entry as LLM-checked even when nothing was found (no re-query)
+            merged = _merge(local, llm_entities) if llm_entities else _public_copy(local)
+            merged["_llm"] = True
+            self._cache_put(text, merged)
+            self.stats["llm_merged"] += 1
+
+        fut.add_done_callback(_done)
+        return fut
+
+    def extract(self, text: str) -> Dict[str, Any]:
+        cached = self._cache_get(text)
+        if cached is not None and (cached.get("_llm") or not self.use_llm or text in self._inflight):
+            self.stats["hits"] += 1
+            return _public_copy(cached)
+        self.stats["misses"] += 1
+        local = cached if cached is not None else self.extract_local(text)
+        if cached is None:
+            self._cache_put(text, local)
+        fut = self._submit_llm(text, local)
+        if fut is not None and self.llm_timeout > 0:
+            try:
+                llm_entities = fut.result(timeout=self.llm_timeout)
+                if llm_entities:
+                    return _merge(local, llm_entities)
+            except Exception:
+                pass
+        return _public_copy(local)
+
+
+_shared_extractor: Optional[EntityExtractor] = None
+_shared_lock = threading.Lock()
+
+
+def get_entity_extractor() -> EntityExtractor:
+    """Process-wide extractor (shared cache across guardrails instances)."""
+    global _shared_extractor
+    if _shared_extractor is None:
+        with _shared_lock:
+            if _shared_extractor is None:
+                _shared_extractor = EntityExtractor()
+    return _shared_extractor
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the entity gazetteer from the MongoDB corpus")
+    parser.add_argument("--build", action="store_true", help="Scan the embedding collection and save the gazetteer")
+    parser.add_argument("--out", default=str(GAZETTEER_PATH))
+    args = parser.parse_args()
+    if not args.build:
+        parser.print_help()
+        return
+
+    from embed_faq import load_mongo_collection
+
+    client, db_name, col_name = load_mongo_collection()
+    col = client[db_name][col_name]
+    print("📚 Scanning corpus...")
+    texts: List[str] = []
+    titles: List[str] = []
+    for doc in col.find({"type": {"$ne": "faq"}}, {"text": 1, "title": 1}):
+        texts.append(doc.get("text", ""))
+        if doc.get("title"):
+            titles.append(doc["title"])
+    gaz = build_gazetteer(texts, titles)
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(gaz, f, ensure_ascii=False, indent=2)
+    print(f"✅ Gazetteer saved: {out} ({', '.join(f'{k}={len(v)}' for k, v in gaz.items())})")
+
+
+if __name__ == "__main__":
+    main()
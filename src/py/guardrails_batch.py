@@ -0,0 +1,98 @@
+# File: guardrails_batch.py
+"""
+Stream a JSONL file through the UnifiedGuardrails batch APIs.
+
+Each input line is a JSON object; the text is read from --field (default
+"message"). For --mode validate_output the field holds the bot response and an
+optional "is_medical" key is honoured. Results are merged into each row and
+written as JSONL; a throughput report is printed to stderr.
+
+Run:
+    python guardrails_batch.py logs.jsonl --mode analyze --out labelled.jsonl
+    python guardrails_batch.py answers.jsonl --mode validate_output --field response --workers 4
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Any, Dict, Iterator, List
+
+from unified_guardrails import UnifiedGuardrails
+
+MODES = ("validate_input", "detect_intent", "analyze", "validate_output")
+
+
+def read_batches(path: str, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                batch.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def run_batch(guard: UnifiedGuardrails, mode: str, rows: List[Dict[str, Any]], field: str, workers: int):
+    texts = [str(r.get(field) or "") for r in rows]
+    if mode == "validate_output":
+        flags = [bool(r.get("is_medical", True)) for r in rows]
+        return guard.validate_output_batch(texts, is_medical=flags, workers=workers)
+    if mode == "validate_input":
+        return guard.validate_input_batch(texts, workers=workers)
+    if mode == "detect_intent":
+        return guard.detect_intent_batch(texts, workers=workers)
+    return guard.analyze_batch(texts, workers=workers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run guardrails over a JSONL file")
+    parser.add_argument("input", help="JSONL file ('-' for stdin)")
+    parser.add_argument("--mode", choices=MODES, default="analyze")
+    parser.add_argument("--field", default="message", help="JSON key holding the text")
+    parser.add_argument("--out", default="-", help="Output JSONL ('-' for stdout)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=0, help="Process pool size for large batches")
+    args = parser.parse_args()
+
+    guard = UnifiedGuardrails(enable_rails=False)
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    total = 0
+    started = time.perf_counter()
+    try:
+        for rows in read_batches(args.input, args.batch_size):
+            t0 = time.perf_counter()
+            columns = run_batch(guard, args.mode, rows, args.field, args.workers)
+            for i, row in enumerate(rows):
+                row.update({col: values[i] for col, values in columns.items()})
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            total += len(rows)
+            dt = time.perf_counter() - t0
+            print(f"… {total} rows ({len(rows) / dt if dt else 0:.0f} rows/s in last batch)", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed else 0.0
+    print(
+        f"✅ {args.mode}: {total} rows in {elapsed:.2f}s → {rate:.0f} rows/s "
+        f"({(elapsed / total * 1000) if total else 0:.3f} ms/row, workers={args.workers})",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
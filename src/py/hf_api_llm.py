@@ -1,9 +1,37 @@
 # File: hf_api_llm.py
 import os
-from typing import Optional, List, Dict, Any, Iterator
+from typing import Optional, List, Dict, Any, Iterator, AsyncIterator
 from langchain.llms.base import LLM
 from pydantic import Field
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+
+from llm_cache import current_llm_task
+from llm_clients import HF_BASE_URL, astream_deltas, get_async_client, get_client, stream_deltas
+from llm_policy import fallback_response, get_transport_policy
+from request_context import current_token
+from stop_sequences import astream_until_stop, stream_until_stop, trim_at_stop
+
+
+async def _aclose_stream(stream) -> None:
+    """Async counterpart of _close_stream for AsyncOpenAI streams."""
+    try:
+        close = getattr(stream, "close", None)
+        if close is None:
+            close = stream.response.aclose
+        await close()
+    except Exception:
+        pass
+
+
+def _close_stream(stream) -> None:
+    """Close an OpenAI streaming response so the upstream stops generating."""
+    try:
+        close = getattr(stream, "close", None)
+        if close is None:
+            close = stream.response.close
+        close()
+    except Exception:
+        pass
 
 
 class HuggingFaceAPILLM(LLM):
@@ -17,7 +45,7 @@ class HuggingFaceAPILLM(LLM):
     temperature: float = Field(default=0.7)
     top_p: float = Field(default=0.9)
     hf_token: str = Field(default="")
-    client: OpenAI = Field(default=None, exclude=True)  # Exclude from serialization
+    base_url: str = Field(default=HF_BASE_URL)
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -25,12 +53,16 @@ class HuggingFaceAPILLM(LLM):
             self.hf_token = os.getenv("HF_TOKEN", os.getenv("HUGGINGFACE_TOKEN", ""))
         if not self.hf_token:
             raise ValueError("HF_TOKEN or HUGGINGFACE_TOKEN environment variable is required")
-        
-        # Initialize OpenAI client
-        self.client = OpenAI(
-            base_url="https://router.huggingface.co/v1",
-            api_key=self.hf_token,
-        )
+    
+    @property
+    def client(self) -> OpenAI:
+        """Pooled client for the request's token, else this instance's (shared keep-alive connections)"""
+        return get_client(current_token(self.hf_token), self.base_url)
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """Pooled AsyncOpenAI client (must be used inside a running event loop)"""
+        return get_async_client(current_token(self.hf_token), self.base_url)
     
     def _call(
         self,
@@ -41,27 +73,30 @@ class HuggingFaceAPILLM(LLM):
     ) -> str:
         """Thực hiện API call không streaming"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=kwargs.get("max_tokens", self.max_tokens),
-                temperature=kwargs.get("temperature", self.temperature),
-                top_p=kwargs.get("top_p", self.top_p),
-                stream=False
+            client = self.client
+            response = get_transport_policy().call(
+                lambda timeout: client.chat.completions.create(
+                    model=self.model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=kwargs.get("max_tokens", self.max_tokens),
+                    temperature=kwargs.get("temperature", self.temperature),
+                    top_p=kwargs.get("top_p", self.top_p),
+                    stream=False,
+                    timeout=timeout,
+                )
             )
             
             content = response.choices[0].message.content
             
-            # Xử lý stop sequences nếu có
+            # Xử lý stop sequences nếu có (cắt tại vị trí khớp sớm nhất)
             if stop and content:
-                for stop_seq in stop:
-                    if stop_seq in content:
-                        content = content.split(stop_seq)[0]
+                content = trim_at_stop(content, stop)
             
             return content.strip() if content else "No response generated"
             
         except Exception as e:
-            return f"Error: {str(e)}"
+            # Provider degraded (policy exhausted / breaker open): templated answer, never raw error text
+            return fallback_response(current_llm_task())
     
     def stream_call(
         self,
@@ -70,32 +105,106 @@ class HuggingFaceAPILLM(LLM):
         **kwargs
     ) -> Iterator[str]:
         """Thực hiện API call với streaming"""
+        sent = False
         try:
-            stream = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=kwargs.get("max_tokens", self.max_tokens),
-                temperature=kwargs.get("temperature", self.temperature),
-                top_p=kwargs.get("top_p", self.top_p),
-                stream=True
+            client = self.client
+            stream = get_transport_policy().call(
+                lambda timeout: client.chat.completions.create(
+                    model=self.model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=kwargs.get("max_tokens", self.max_tokens),
+                    temperature=kwargs.get("temperature", self.temperature),
+                    top_p=kwargs.get("top_p", self.top_p),
+                    stream=True,
+                    timeout=timeout,
+                ),
+                hedge=False,
             )
             
-            for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    
-                    # Xử lý stop sequences nếu có
-                    if stop:
-                        for stop_seq in stop:
-                            if stop_seq in content:
-                                content = content.split(stop_seq)[0]
-                                yield content
-                                return
+            try:
+                # Stop sequences có thể bị tách qua nhiều chunk: detector giữ lại phần đuôi,
+                # cắt chính xác và dừng đọc ngay khi khớp (finally đóng HTTP stream)
+                for content in stream_until_stop(stream_deltas(stream), stop):
+                    sent = True
+                    yield content
+            finally:
+                # Đóng HTTP stream ngay khi consumer dừng (vd. StreamingOutputValidator đạt giới hạn)
+                _close_stream(stream)
                     
+        except Exception as e:
+            # Chỉ fallback trước token đầu tiên; sau đó để caller kết thúc stream bằng lỗi
+            if sent:
+                raise
+            yield fallback_response(None)
+    
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs
+    ) -> str:
+        """API call bất đồng bộ (không chặn event loop; dùng bởi NeMo generate_async)"""
+        try:
+            client = self.async_client
+            response = await get_transport_policy().acall(
+                lambda timeout: client.chat.completions.create(
+                    model=self.model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=kwargs.get("max_tokens", self.max_tokens),
+                    temperature=kwargs.get("temperature", self.temperature),
+                    top_p=kwargs.get("top_p", self.top_p),
+                    stream=False,
+                    timeout=timeout,
+                )
+            )
+            
+            content = response.choices[0].message.content
+            
+            if stop and content:
+                content = trim_at_stop(content, stop)
+            
+            return content.strip() if content else "No response generated"
+            
+        except Exception as e:
+            # Provider degraded (policy exhausted / breaker open): templated answer, never raw error text
+            return fallback_response(current_llm_task())
+    
+    async def astream_call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """Streaming bất đồng bộ qua AsyncOpenAI"""
+        sent = False
+        try:
+            client = self.async_client
+            stream = await get_transport_policy().acall(
+                lambda timeout: client.chat.completions.create(
+                    model=self.model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=kwargs.get("max_tokens", self.max_tokens),
+                    temperature=kwargs.get("temperature", self.temperature),
+                    top_p=kwargs.get("top_p", self.top_p),
+                    stream=True,
+                    timeout=timeout,
+                ),
+                hedge=False,
+            )
+            
+            try:
+                async for content in astream_until_stop(astream_deltas(stream), stop):
+                    sent = True
                     yield content
+            finally:
+                await _aclose_stream(stream)
                     
         except Exception as e:
-            yield f"Error: {str(e)}"
+            # Chỉ fallback trước token đầu tiên; sau đó để caller kết thúc stream bằng lỗi
+            if sent:
+                raise
+            yield fallback_response(None)
     
     @property
     def _identifying_params(self) -> Dict[str, Any]:
@@ -0,0 +1,317 @@
+# File: intent_model.py
+"""
+Lightweight intent classifier (linear head) over BGE-M3 embeddings.
+
+The head is a multinomial logistic regression trained with scikit-learn on the
+L2-normalized embeddings MedicalGuardrails already computes. At inference time
+only the exported weights are used (numpy), so scoring a query is a single
+dot product against the weight matrix and scoring a batch is one matmul.
+
+Training data:
+- MedicalGuardrails.intent_phrases (always included)
+- Optional labelled log data (JSONL, one object per line with "text"/"message"
+  and "intent"/"label" keys)
+
+Artifacts are versioned: embedding_cache/intent_head_v<N>.npz + .json (metadata
+with model name, phrase hash, metrics, acceptance threshold). The newest
+artifact matching the embedding model is loaded by MedicalGuardrails.
+
+The acceptance threshold is a softmax probability, not a cosine similarity, so
+the 0.45 used by the nearest-phrase path does not carry over: it is calibrated
+on the holdout split (lowest cut whose accepted predictions reach
+`target_precision`) and stored in the artifact.
+
+Run:
+    python intent_model.py --logs labelled_logs.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Bump when the on-disk layout changes (older artifacts are ignored).
+# 2: threshold is a calibrated head probability (v1 stored the cosine threshold)
+ARTIFACT_FORMAT = 2
+ARTIFACT_DIR = Path(os.getenv("INTENT_HEAD_DIR", str(Path(__file__).parent / "embedding_cache")))
+# Head probability accepted when the holdout is too small to calibrate
+DEFAULT_THRESHOLD = 0.5
+# Precision the calibrated threshold must reach on the holdout predictions
+TARGET_PRECISION = 0.9
+
+
+class IntentHead:
+    """Exported linear head: softmax(X @ W.T + b)."""
+
+    def __init__(
+        self,
+        labels: List[str],
+        weights: np.ndarray,
+        bias: np.ndarray,
+        threshold: float = DEFAULT_THRESHOLD,
+        metadata: Optional[Dict] = None,
+    ) -> None:
+        self.labels = list(labels)
+        self.weights = np.ascontiguousarray(weights, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.threshold = float(threshold)
+        self.metadata = metadata or {}
+
+    @property
+    def dim(self) -> int:
+        return int(self.weights.shape[1])
+
+    def predict_proba(self, vecs: np.ndarray) -> np.ndarray:
+        """Class probabilities for a (N, D) or (D,) batch of normalized embeddings."""
+        logits = np.atleast_2d(vecs) @ self.weights.T + self.bias
+        logits -= logits.max(axis=1, keepdims=True)
+        np.exp(logits, out=logits)
+        logits /= logits.sum(axis=1, keepdims=True)
+        return logits
+
+    def predict(self, vecs: np.ndarray) -> Tuple[List[str], np.ndarray]:
+        proba = self.predict_proba(vecs)
+        best = proba.argmax(axis=1)
+        return [self.labels[i] for i in best], proba[np.arange(len(best)), best]
+
+    def save(self, path: Path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp, weights=self.weights, bias=self.bias, labels=np.array(self.labels))
+        os.replace(tmp, path)
+        meta = dict(self.metadata, format=ARTIFACT_FORMAT, threshold=self.threshold, labels=self.labels)
+        with open(path.with_suffix(".json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> "IntentHead":
+        path = Path(path)
+        meta: Dict = {}
+        meta_path = path.with_suffix(".json")
+        if meta_path.exists():
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        with np.load(path, allow_pickle=False) as data:
+            labels = [str(x) for x in data["labels"]]
+            return cls(
+                labels=labels,
+                weights=data["weights"],
+                bias=data["bias"],
+                threshold=meta.get("threshold", DEFAULT_THRESHOLD),
+                metadata=meta,
+            )
+
+
+def _artifact_versions(directory: Path = ARTIFACT_DIR) -> List[Tuple[int, Path]]:
+    found = []
+    if not directory.exists():
+        return found
+    for p in directory.glob("intent_head_v*.npz"):
+        m = re.match(r"intent_head_v(\d+)\.npz$", p.name)
+        if m:
+            found.append((int(m.group(1)), p))
+    return sorted(found)
+
+
+def next_artifact_path(directory: Path = ARTIFACT_DIR) -> Path:
+    versions = _artifact_versions(directory)
+    nxt = (versions[-1][0] + 1) if versions else 1
+    return directory / f"intent_head_v{nxt}.npz"
+
+
+def load_latest_head(model_name: str, directory: Path = ARTIFACT_DIR) -> Optional[IntentHead]:
+    """Newest artifact trained on `model_name` embeddings, or None."""
+    explicit = os.getenv("INTENT_HEAD_PATH")
+    candidates = [Path(explicit)] if explicit else [p for _, p in reversed(_artifact_versions(directory))]
+    for path in candidates:
+        try:
+            head = IntentHead.load(path)
+        except Exception:
+            continue
+        meta = head.metadata
+        if meta.get("format") != ARTIFACT_FORMAT or meta.get("model") != model_name:
+            continue
+        return head
+    return None
+
+
+def load_labelled_logs(path: str) -> Tuple[List[str], List[str]]:
+    """Read labelled log data: JSONL lines with text/message and intent/label."""
+    texts: List[str] = []
+    labels: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            text = row.get("text") or row.get("message")
+            label = row.get("intent") or row.get("label")
+            if isinstance(text, str) and text.strip() and isinstance(label, str) and label:
+                texts.append(text.strip())
+                labels.append(label)
+    return texts, labels
+
+
+def _centroid_baseline_accuracy(
+    train_x: np.ndarray, train_y: List[str], test_x: np.ndarray, test_y: List[str]
+) -> float:
+    """Nearest-phrase (max cosine per intent) accuracy, i.e. the previous behaviour."""
+    sims = test_x @ train_x.T
+    best = sims.argmax(axis=1)
+    preds = [train_y[i] for i in best]
+    return float(np.mean([p == y for p, y in zip(preds, test_y)])) if test_y else 0.0
+
+
+def calibrate_threshold(
+    best_proba: np.ndarray, correct: np.ndarray, target_precision: float = TARGET_PRECISION
+) -> float:
+    """Lowest probability cut whose accepted holdout predictions reach `target_precision`.
+
+    Predictions are ranked by confidence; the cut keeps as many as possible while
+    the precision of everything above it stays at the target. If no cut reaches
+    it, only the single most confident prediction would pass.
+    """
+    order = np.argsort(-best_proba, kind="stable")
+    proba = best_proba[order]
+    precision = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+    ok = np.nonzero(precision >= target_precision)[0]
+    return float(proba[ok[-1]] if len(ok) else proba[0])
+
+
+def train_intent_head(
+    texts: List[str],
+    labels: List[str],
+    embed_fn: Callable[[List[str]], np.ndarray],
+    model_name: str,
+    phrase_hash: str = "",
+    c: float = 4.0,
+    holdout: float = 0.2,
+    threshold: Optional[float] = None,
+    target_precision: float = TARGET_PRECISION,
+    seed: int = 42,
+) -> IntentHead:
+    """Fit a logistic-regression head and export its weights.
+
+    `embed_fn` must return L2-normalized embeddings (N, D). A stratified holdout
+    split (when there is enough data) reports accuracy of the head vs. the
+    nearest-phrase baseline and calibrates the acceptance threshold (unless
+    `threshold` is given); the final head is refit on all data.
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import train_test_split
+
+    vecs = np.asarray(embed_fn(texts), dtype=np.float32)
+    y = np.array(labels)
+    metrics: Dict[str, float] = {}
+    threshold_source = "explicit" if threshold is not None else "default"
+
+    counts = {lbl: int((y == lbl).sum()) for lbl in set(labels)}
+    n_test = int(round(len(labels) * holdout))
+    if holdout > 0 and min(counts.values()) >= 2 and n_test >= len(counts):
+        tr_x, te_x, tr_y, te_y = train_test_split(
+            vecs, y, test_size=holdout, random_state=seed, stratify=y
+        )
+        clf = LogisticRegression(C=c, max_iter=2000)
+        clf.fit(tr_x, tr_y)
+        metrics["head_accuracy"] = float(clf.score(te_x, te_y))
+        metrics["baseline_accuracy"] = _centroid_baseline_accuracy(tr_x, list(tr_y), te_x, list(te_y))
+        metrics["holdout_size"] = int(len(te_y))
+        proba = clf.predict_proba(te_x)
+        best = proba.argmax(axis=1)
+        correct = (clf.classes_[best] == te_y).astype(np.float32)
+        calibrated = calibrate_threshold(proba[np.arange(len(best)), best], correct, target_precision)
+        metrics["calibrated_threshold"] = calibrated
+        if threshold is None:
+            threshold, threshold_source = calibrated, "calibrated"
+    if threshold is None:
+        threshold = DEFAULT_THRESHOLD
+
+    clf = LogisticRegression(C=c, max_iter=2000)
+    clf.fit(vecs, y)
+    classes = [str(cls) for cls in clf.classes_]
+    weights = clf.coef_
+    bias = clf.intercept_
+    if len(classes) == 2:
+        # Binary LR exports one row; expand to two so softmax matches predict_proba
+        weights = np.vstack([-weights[0] / 2, weights[0] / 2])
+        bias = np.array([-bias[0] / 2, bias[0] / 2])
+
+    metadata = {
+        "model": model_name,
+        "phrase_hash": phrase_hash,
+        "created_at": int(time.time()),
+        "n_samples": len(texts),
+        "class_counts": counts,
+        "C": c,
+        "metrics": metrics,
+        "threshold_source": threshold_source,
+        "target_precision": target_precision,
+    }
+    return IntentHead(classes, weights, bias, threshold=threshold, metadata=metadata)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train the intent head over BGE-M3 embeddings")
+    parser.add_argument("--logs", action="append", default=[], help="Labelled JSONL log file (repeatable)")
+    parser.add_argument("--C", type=float, default=4.0, help="Inverse regularization strength")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Holdout fraction for the accuracy report")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="Min head probability to accept (default: calibrated on the holdout)")
+    parser.add_argument("--target-precision", type=float, default=TARGET_PRECISION,
+                        help="Holdout precision the calibrated threshold must reach")
+    parser.add_argument("--out", default="", help="Artifact path (default: next versioned file)")
+    args = parser.parse_args()
+
+    from medical_guardrails import MedicalGuardrails
+
+    guard = MedicalGuardrails()
+    texts = [p for intent, phrases in guard.intent_phrases.items() for p in phrases]
+    labels = [intent for intent, phrases in guard.intent_phrases.items() for _ in phrases]
+    for path in args.logs:
+        log_texts, log_labels = load_labelled_logs(path)
+        print(f"📄 {path}: {len(log_texts)} labelled rows")
+        texts += log_texts
+        labels += log_labels
+
+    if guard._get_embed_model() is None:
+        print("❌ Embedding model unavailable; cannot train.")
+        return
+
+    print(f"🧠 Training on {len(texts)} samples / {len(set(labels))} intents...")
+    head = train_intent_head(
+        texts,
+        labels,
+        embed_fn=lambda xs: guard._l2_normalize(guard._embed_texts(xs)),
+        model_name=guard._embed_model_name,
+        phrase_hash=guard._intent_index_key(),
+        c=args.C,
+        holdout=args.holdout,
+        threshold=args.threshold,
+        target_precision=args.target_precision,
+    )
+    m = head.metadata.get("metrics", {})
+    if m:
+        print(
+            f"📊 Holdout ({m['holdout_size']}): head={m['head_accuracy']:.3f} "
+            f"vs nearest-phrase={m['baseline_accuracy']:.3f}"
+        )
+    print(f"🎯 Threshold: {head.threshold:.3f} ({head.metadata['threshold_source']})")
+    out = head.save(Path(args.out) if args.out else next_artifact_path())
+    print(f"✅ Saved intent head: {out}")
+
+
+if __name__ == "__main__":
+    main()
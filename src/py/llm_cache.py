@@ -0,0 +1,238 @@
+# File: llm_cache.py
+"""
+Completion cache for deterministic LLM prompts.
+
+NeMo rails issue canonical-form / self-check prompts that repeat heavily across
+users; at temperature 0.1 their completions are effectively deterministic, so
+they are served from a two-tier cache instead of the HF router:
+- memory tier: small LRU of recent completions,
+- disk tier: SQLite file with TTL and size-based eviction (least recently used).
+
+Keys are sha256 over (model_name, temperature, max_tokens, stop, prompt hash).
+Caching is enabled per task type. The task of the current call is taken from
+`llm_task_var` (set by our own code, e.g. "summary", "final_answer") or from
+NeMo's `llm_call_info_var` (e.g. "generate_user_intent", "self_check_input").
+
+Configuration (env):
+    LLM_CACHE_PATH        SQLite file (embedding_cache/llm_cache.sqlite)
+    LLM_CACHE_TASKS       comma-separated cacheable tasks
+    LLM_CACHE_MEM_ITEMS   memory tier size (1024)
+    LLM_CACHE_MAX_MB      disk tier size budget (64)
+    LLM_CACHE_TTL         seconds a completion stays valid (86400)
+    LLM_CACHE_DISABLED=1  turn the cache off
+"""
+
+from __future__ import annotations
+
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Task of the LLM call in progress (our own call sites set this)
+llm_task_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_task", default=None)
+
+DEFAULT_CACHE_TASKS = (
+    "generate_user_intent",
+    "generate_next_steps",
+    "generate_value",
+    "self_check_input",
+    "self_check_output",
+)
+
+
+def current_llm_task() -> Optional[str]:
+    """Task name for the current LLM call, if known."""
+    task = llm_task_var.get()
+    if task:
+        return task
+    try:
+        from nemoguardrails.context import llm_call_info_var
+        info = llm_call_info_var.get()
+        return getattr(info, "task", None) if info is not None else None
+    except Exception:
+        return None
+
+
+class CompletionCache:
+    """Memory LRU over a SQLite tier with TTL and size-based eviction."""
+
+    def __init__(
+        self,
+        path: str,
+        tasks: Tuple[str, ...] = DEFAULT_CACHE_TASKS,
+        mem_items: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 86400.0,
+    ) -> None:
+        self.path = path
+        self.tasks = frozenset(tasks)
+        self.mem_items = mem_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._mem: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits_mem": 0, "hits_disk": 0, "misses": 0, "puts": 0, "evictions": 0, "expired": 0}
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " task TEXT, created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_completions_access ON completions(last_access)")
+        row = self._db.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM completions").fetchone()
+        self._bytes = int(row[0])
+        self._entries = int(row[1])
+
+    @staticmethod
+    def make_key(model_name: str, temperature: float, max_tokens: int,
+                 stop: Optional[List[str]], prompt: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        raw = json.dumps([model_name, round(float(temperature), 4), int(max_tokens), list(stop or []), prompt_hash])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def enabled_for(self, task: Optional[str]) -> bool:
+        return bool(task) and task in self.tasks
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                value, created = item
+                if now - created <= self.ttl:
+                    self._mem.move_to_end(key)
+                    self._stats["hits_mem"] += 1
+                    return value
+                self._mem.pop(key, None)
+            row = self._db.execute(
+                "SELECT value, created, size FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            value, created, size = row[0].decode("utf-8"), float(row[1]), int(row[2])
+            if now - created > self.ttl:
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._bytes -= size
+                self._entries -= 1
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+            self._remember(key, value, created)
+            self._stats["hits_disk"] += 1
+            return value
+
+    def get_stale(self, key: str) -> Optional[str]:
+        """Completion for `key` ignoring the TTL (fallback while the provider is down)."""
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                return item[0]
+            row = self._db.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+            return row[0].decode("utf-8") if row is not None else None
+
+    def put(self, key: str, value: str, task: Optional[str] = None) -> None:
+        now = time.time()
+        blob = value.encode("utf-8")
+        with self._lock:
+            old = self._db.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions(key, value, size, task, created, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, blob, len(blob), task, now, now),
+            )
+            if old is not None:
+                self._bytes -= int(old[0])
+            else:
+                self._entries += 1
+            self._bytes += len(blob)
+            self._remember(key, value, now)
+            self._stats["puts"] += 1
+            if self._bytes > self.max_bytes:
+                self._evict_locked()
+
+    def _remember(self, key: str, value: str, created: float) -> None:
+        self._mem[key] = (value, created)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+
+    def _evict_locked(self) -> None:
+        """Drop expired rows, then least recently used rows until under 90% of the budget."""
+        cutoff = time.time() - self.ttl
+        self._db.execute("DELETE FROM completions WHERE created < ?", (cutoff,))
+        target = int(self.max_bytes * 0.9)
+        row = self._db.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM completions").fetchone()
+        self._bytes, self._entries = int(row[0]), int(row[1])
+        while self._bytes > target:
+            victims = self._db.execute(
+                "SELECT key, size FROM completions ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not victims:
+                break
+            freed = 0
+            keys = []
+            for k, size in victims:
+                keys.append((k,))
+                freed += int(size)
+                self._mem.pop(k, None)
+                if self._bytes - freed <= target:
+                    break
+            self._db.executemany("DELETE FROM completions WHERE key = ?", keys)
+            self._bytes -= freed
+            self._entries -= len(keys)
+            self._stats["evictions"] += len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._stats["hits_mem"] + self._stats["hits_disk"]
+            total = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_ratio": hits / total if total else 0.0,
+                "entries": self._entries,
+                "mem_entries": len(self._mem),
+                "bytes_stored": self._bytes,
+                "max_bytes": self.max_bytes,
+                "tasks": sorted(self.tasks),
+            }
+
+
+_cache: Optional[CompletionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """Process-wide completion cache (None when disabled or unavailable)."""
+    global _cache
+    if os.getenv("LLM_CACHE_DISABLED") == "1":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                tasks_env = os.getenv("LLM_CACHE_TASKS")
+                tasks = tuple(t.strip() for t in tasks_env.split(",") if t.strip()) if tasks_env else DEFAULT_CACHE_TASKS
+                try:
+                    _cache = CompletionCache(
+                        path=os.getenv(
+                            "LLM_CACHE_PATH", str(Path(__file__).parent / "embedding_cache" / "llm_cache.sqlite")
+                        ),
+                        tasks=tasks,
+                        mem_items=int(os.getenv("LLM_CACHE_MEM_ITEMS", "1024")),
+                        max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024),
+                        ttl=float(os.getenv("LLM_CACHE_TTL", "86400")),
+                    )
+                except Exception as e:
+                    print(f"⚠️ LLM completion cache disabled: {e}")
+                    return None
+    return _cache
@@ -0,0 +1,260 @@
+# File: llm_clients.py
+"""
+Pooled OpenAI-compatible clients for the HuggingFace router.
+
+Both HuggingFaceAPILLM implementations (main.py and hf_api_llm.py) resolve their
+client here instead of building a new `OpenAI(...)` per call:
+- one shared keep-alive httpx transport (TCP/TLS connections are reused),
+- one lightweight OpenAI client per (token, base_url), created on first use,
+- clients idle for longer than `idle_ttl` are evicted (counted in stats()).
+
+AsyncClientPool does the same for AsyncOpenAI (used by `_acall` / `astream_call`).
+httpx.AsyncClient connections are bound to an event loop, so the async pool keeps
+one shared transport per running loop; with one long-lived loop per worker that
+is a single pool for the whole process.
+
+Configuration (env):
+    HF_BASE_URL               default https://router.huggingface.co/v1 (a localhost URL,
+                              e.g. mock_llm_server, lets the chatbot run without a token)
+    LLM_MAX_CONNECTIONS       max open connections in the shared transport (100)
+    LLM_MAX_KEEPALIVE         max idle keep-alive connections (20)
+    LLM_KEEPALIVE_EXPIRY      seconds an idle connection is kept (30)
+    LLM_CLIENT_IDLE_TTL       seconds before an unused per-token client is evicted (600)
+    LLM_HTTP_TIMEOUT          request timeout in seconds (60)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+HF_BASE_URL = os.getenv("HF_BASE_URL", "https://router.huggingface.co/v1")
+# Placeholder token for local OpenAI-compatible stand-ins (mock_llm_server)
+MOCK_TOKEN = "hf_mock"
+
+
+def is_local_base_url(base_url: Optional[str]) -> bool:
+    """True when `base_url` points at a local stand-in that needs no real HF token."""
+    host = urlparse(base_url or HF_BASE_URL).hostname or ""
+    return host in ("127.0.0.1", "localhost", "::1", "0.0.0.0")
+
+
+def stream_deltas(stream) -> Iterator[str]:
+    """Text deltas of a chat completion stream."""
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def astream_deltas(stream) -> AsyncIterator[str]:
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def _token_key(token: str) -> str:
+    # Never keep raw tokens as dict keys / in stats
+    return hashlib.sha256((token or "").encode("utf-8")).hexdigest()[:16]
+
+
+class ClientPool:
+    """Per-token OpenAI clients sharing one keep-alive httpx transport."""
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        keepalive_expiry: float = 30.0,
+        idle_ttl: float = 600.0,
+        timeout: float = 60.0,
+    ) -> None:
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.idle_ttl = idle_ttl
+        self._http = httpx.Client(limits=self.limits, timeout=timeout)
+        self._clients: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "reused": 0, "evicted_idle": 0}
+
+    def get(self, token: str, base_url: Optional[str] = None) -> OpenAI:
+        """OpenAI client for `token`, reusing the shared connection pool."""
+        key = (_token_key(token), base_url or HF_BASE_URL)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry["last_used"] = now
+                self._clients.move_to_end(key)
+                self._stats["reused"] += 1
+                client = entry["client"]
+            else:
+                # Clients are cheap wrappers; the expensive part (connections) is shared
+                # Retries are owned by llm_policy.TransportPolicy (deadline-aware, jittered)
+                client = OpenAI(api_key=token, base_url=key[1], http_client=self._http, max_retries=0)
+                self._clients[key] = {"client": client, "last_used": now}
+                self._stats["created"] += 1
+            self._evict_idle_locked(now)
+        return client
+
+    def _evict_idle_locked(self, now: float) -> int:
+        evicted = 0
+        # OrderedDict is in last-used order: stop at the first fresh entry
+        while self._clients:
+            key, entry = next(iter(self._clients.items()))
+            if now - entry["last_used"] <= self.idle_ttl:
+                break
+            # Do not close the client: it would close the shared transport
+            self._clients.popitem(last=False)
+            evicted += 1
+        self._stats["evicted_idle"] += evicted
+        return evicted
+
+    def evict_idle(self) -> int:
+        with self._lock:
+            return self._evict_idle_locked(time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "max_connections": self.limits.max_connections,
+                "max_keepalive": self.limits.max_keepalive_connections,
+                "keepalive_expiry": self.limits.keepalive_expiry,
+                **self._stats,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._clients.clear()
+            self._http.close()
+
+
+class AsyncClientPool:
+    """Per-token AsyncOpenAI clients sharing one keep-alive httpx.AsyncClient per event loop."""
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        keepalive_expiry: float = 30.0,
+        idle_ttl: float = 600.0,
+        timeout: float = 60.0,
+    ) -> None:
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.idle_ttl = idle_ttl
+        # loop -> {"http": AsyncClient, "clients": OrderedDict}
+        self._per_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "reused": 0, "evicted_idle": 0, "transports": 0}
+
+    def get(self, token: str, base_url: Optional[str] = None) -> AsyncOpenAI:
+        """AsyncOpenAI client for `token` on the running event loop."""
+        loop = asyncio.get_running_loop()
+        key = (_token_key(token), base_url or HF_BASE_URL)
+        now = time.monotonic()
+        with self._lock:
+            slot = self._per_loop.get(loop)
+            if slot is None:
+                slot = {"http": httpx.AsyncClient(limits=self.limits, timeout=self.timeout),
+                        "clients": OrderedDict()}
+                self._per_loop[loop] = slot
+                self._stats["transports"] += 1
+            clients = slot["clients"]
+            entry = clients.get(key)
+            if entry is not None:
+                entry["last_used"] = now
+                clients.move_to_end(key)
+                self._stats["reused"] += 1
+                client = entry["client"]
+            else:
+                client = AsyncOpenAI(api_key=token, base_url=key[1], http_client=slot["http"], max_retries=0)
+                clients[key] = {"client": client, "last_used": now}
+                self._stats["created"] += 1
+            while clients:
+                old_key, old = next(iter(clients.items()))
+                if now - old["last_used"] <= self.idle_ttl:
+                    break
+                clients.popitem(last=False)
+                self._stats["evicted_idle"] += 1
+        return client
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loops": len(self._per_loop),
+                "clients": sum(len(s["clients"]) for s in self._per_loop.values()),
+                **self._stats,
+            }
+
+    async def aclose(self) -> None:
+        """Close the transport of the running loop (e.g. in an ASGI lifespan shutdown)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            slot = self._per_loop.pop(loop, None)
+        if slot is not None:
+            await slot["http"].aclose()
+
+
+def _pool_kwargs() -> Dict[str, Any]:
+    return dict(
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+        max_keepalive=int(os.getenv("LLM_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30")),
+        idle_ttl=float(os.getenv("LLM_CLIENT_IDLE_TTL", "600")),
+        timeout=float(os.getenv("LLM_HTTP_TIMEOUT", "60")),
+    )
+
+
+_pool: Optional[ClientPool] = None
+_async_pool: Optional[AsyncClientPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> ClientPool:
+    """Process-wide client pool configured from the environment."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ClientPool(**_pool_kwargs())
+    return _pool
+
+
+def get_async_client_pool() -> AsyncClientPool:
+    """Process-wide async client pool configured from the environment."""
+    global _async_pool
+    if _async_pool is None:
+        with _pool_lock:
+            if _async_pool is None:
+                _async_pool = AsyncClientPool(**_pool_kwargs())
+    return _async_pool
+
+
+def get_client(token: str, base_url: Optional[str] = None) -> OpenAI:
+    return get_client_pool().get(token, base_url)
+
+
+def get_async_client(token: str, base_url: Optional[str] = None) -> AsyncOpenAI:
+    """Must be called from inside a running event loop."""
+    return get_async_client_pool().get(token, base_url)
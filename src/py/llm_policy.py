@@ -0,0 +1,397 @@
+# File: llm_policy.py
+"""
+Transport policy for LLM calls: deadlines, retries, hedging and a circuit breaker.
+
+The HF router has a long latency tail and occasionally returns 429/5xx. Every
+completion goes through TransportPolicy.call / acall:
+- per-call deadline: each attempt gets the remaining budget as its timeout
+  (capped by the request deadline, see request_context),
+- retries with full-jitter exponential backoff, only on retryable errors
+  (timeouts, connection errors, 408/409/425/429, 5xx),
+- optional hedging: if the first attempt has not answered after the observed
+  p95 latency, a second identical request is sent and the first answer wins,
+- circuit breaker: after `failure_threshold` consecutive provider failures
+  (timeouts, connection errors, 5xx) calls fail fast with CircuitOpenError for
+  `reset_timeout` seconds, then a single probe decides whether to close it
+  again. 4xx answers (429 included: HF rate-limits per user token) say
+  nothing about the provider's health and neither open nor close it.
+
+Callers turn LLMUnavailable into a cached or templated answer (see
+fallback_response) instead of returning "Error: ..." text to NeMo.
+
+Configuration (env):
+    LLM_DEADLINE_S          total budget per call incl. retries (30)
+    LLM_MAX_RETRIES         retries after the first attempt (2)
+    LLM_BACKOFF_BASE_S      first backoff cap (0.2)
+    LLM_BACKOFF_MAX_S       max backoff cap (2)
+    LLM_HEDGE=1             enable hedged requests (off by default: costs extra calls)
+    LLM_HEDGE_MIN_DELAY_S   lower bound for the hedge delay (0.05)
+    LLM_BREAKER_FAILURES    consecutive failures that open the breaker (5)
+    LLM_BREAKER_RESET_S     seconds the breaker stays open (30)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import httpx
+import openai
+
+from request_context import deadline_end
+
+# Answers used when the provider is unavailable and nothing is cached.
+# Self-check prompts (config/prompts.yml) fail closed with their refusal text.
+DEGRADED_RESPONSE = (
+    "Xin lỗi, hệ thống tư vấn đang tạm thời quá tải. Vui lòng thử lại sau ít phút. "
+    "Nếu bạn gặp tình trạng khẩn cấp, hãy gọi ngay 115."
+)
+FALLBACK_RESPONSES = {
+    "self_check_input": "I'm sorry, I can't respond to that.",
+    "self_check_output": "I'm sorry, I can't respond to that.",
+}
+
+
+def fallback_response(task: Optional[str]) -> str:
+    """Templated answer for `task` when the LLM cannot be reached."""
+    return FALLBACK_RESPONSES.get(task or "", DEGRADED_RESPONSE)
+
+
+class LLMUnavailable(Exception):
+    """The provider could not produce an answer within the policy."""
+
+
+class CircuitOpenError(LLMUnavailable):
+    """The circuit breaker is open; the call was not attempted."""
+
+
+class DeadlineExceeded(LLMUnavailable):
+    """The per-call deadline elapsed."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in (408, 409, 425, 429) or exc.status_code >= 500
+    return isinstance(exc, (httpx.TransportError, TimeoutError, asyncio.TimeoutError, ConnectionError))
+
+
+def is_provider_failure(exc: BaseException) -> bool:
+    """Errors that count toward the circuit breaker: the provider itself is failing."""
+    if isinstance(exc, DeadlineExceeded):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500
+    return isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, httpx.TransportError,
+                            TimeoutError, asyncio.TimeoutError, ConnectionError))
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies (seconds)."""
+
+    def __init__(self, window: int = 512) -> None:
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < 20:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """closed → open after N consecutive failures → half-open probe after reset_timeout."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release(self) -> None:
+        """The call proved nothing about the provider (e.g. a 4xx): free the half-open probe slot."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.stats["opened"] += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+class TransportPolicy:
+    """Deadline + jittered retries + optional hedging + circuit breaker around one attempt function.
+
+    The attempt function receives the remaining budget in seconds and should pass
+    it on as the request timeout, e.g. `lambda t: client.chat.completions.create(..., timeout=t)`.
+    """
+
+    def __init__(
+        self,
+        deadline: float = 30.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_delay: float = 0.05,
+        hedge_default_delay: float = 2.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "ok": 0, "failed": 0, "retries": 0, "hedges": 0,
+                       "hedge_wins": 0, "deadline_exceeded": 0}
+
+    def _incr(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def hedge_delay(self) -> float:
+        p = self.latency.quantile(self.hedge_quantile)
+        return max(self.hedge_min_delay, p if p is not None else self.hedge_default_delay)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record_error(self, exc: BaseException) -> None:
+        if is_provider_failure(exc):
+            self.breaker.record_failure()
+        else:
+            # Client-side error (bad token, 429 quota, 400): no evidence either way
+            self.breaker.release()
+
+    def _pool(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+            return self._executor
+
+    # --- sync ---------------------------------------------------------------
+
+    def _attempt(self, fn: Callable[[float], Any], end: float, hedge: bool) -> Any:
+        remaining = end - time.monotonic()
+        if not hedge:
+            return fn(remaining)
+        pool = self._pool()
+        primary = pool.submit(fn, remaining)
+        futures = {primary}
+        done, _ = concurrent.futures.wait(futures, timeout=min(self.hedge_delay(), remaining))
+        if not done:
+            self._incr("hedges")
+            futures.add(pool.submit(fn, end - time.monotonic()))
+        last_exc: Optional[BaseException] = None
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, timeout=max(0.0, end - time.monotonic()), return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if not done:
+                raise DeadlineExceeded("LLM deadline exceeded")
+            for f in done:
+                if f.exception() is None:
+                    # The losing thread cannot be interrupted; its result is discarded
+                    if f is not primary:
+                        self._incr("hedge_wins")
+                    return f.result()
+                last_exc = f.exception()
+        raise last_exc  # type: ignore[misc]
+
+    def call(self, fn: Callable[[float], Any], hedge: Optional[bool] = None) -> Any:
+        """Run `fn(timeout)` under the policy (blocking)."""
+        hedge = self.hedge if hedge is None else hedge
+        self._incr("calls")
+        end = deadline_end(self.deadline)
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._incr("failed")
+                raise CircuitOpenError("LLM circuit breaker is open")
+            if end - time.monotonic() <= 0:
+                self._incr("deadline_exceeded")
+                self._incr("failed")
+                raise DeadlineExceeded("LLM deadline exceeded")
+            started = time.monotonic()
+            try:
+                result = self._attempt(fn, end, hedge)
+            except Exception as e:
+                self._record_error(e)
+                wait = self._backoff(attempt)
+                if not is_retryable(e) or attempt >= self.max_retries or time.monotonic() + wait >= end:
+                    self._incr("deadline_exceeded" if isinstance(e, DeadlineExceeded) else "failed")
+                    raise
+                self._incr("retries")
+                attempt += 1
+                time.sleep(wait)
+                continue
+            except BaseException:
+                # Cancelled (client disconnect, batch cancel): the half-open probe slot must not leak
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            self.latency.observe(time.monotonic() - started)
+            self._incr("ok")
+            return result
+
+    # --- async --------------------------------------------------------------
+
+    async def _aattempt(self, fn: Callable[[float], Awaitable[Any]], end: float, hedge: bool) -> Any:
+        remaining = end - time.monotonic()
+        if not hedge:
+            try:
+                return await asyncio.wait_for(fn(remaining), timeout=remaining)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("LLM deadline exceeded")
+        primary = asyncio.ensure_future(fn(remaining))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=min(self.hedge_delay(), remaining))
+            if not done:
+                self._incr("hedges")
+                tasks.add(asyncio.ensure_future(fn(end - time.monotonic())))
+            last_exc: Optional[BaseException] = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, end - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise DeadlineExceeded("LLM deadline exceeded")
+                for t in done:
+                    if t.exception() is None:
+                        if t is not primary:
+                            self._incr("hedge_wins")
+                        return t.result()
+                    last_exc = t.exception()
+            raise last_exc  # type: ignore[misc]
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    async def acall(self, fn: Callable[[float], Awaitable[Any]], hedge: Optional[bool] = None) -> Any:
+        """Await `fn(timeout)` under the policy; losing hedged requests are cancelled."""
+        hedge = self.hedge if hedge is None else hedge
+        self._incr("calls")
+        end = deadline_end(self.deadline)
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._incr("failed")
+                raise CircuitOpenError("LLM circuit breaker is open")
+            if end - time.monotonic() <= 0:
+                self._incr("deadline_exceeded")
+                self._incr("failed")
+                raise DeadlineExceeded("LLM deadline exceeded")
+            started = time.monotonic()
+            try:
+                result = await self._aattempt(fn, end, hedge)
+            except Exception as e:
+                self._record_error(e)
+                wait = self._backoff(attempt)
+                if not is_retryable(e) or attempt >= self.max_retries or time.monotonic() + wait >= end:
+                    self._incr("deadline_exceeded" if isinstance(e, DeadlineExceeded) else "failed")
+                    raise
+                self._incr("retries")
+                attempt += 1
+                await asyncio.sleep(wait)
+                continue
+            except BaseException:
+                # Cancelled (client disconnect, batch cancel): the half-open probe slot must not leak
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            self.latency.observe(time.monotonic() - started)
+            self._incr("ok")
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+        p95 = self.latency.quantile(0.95)
+        out.update(
+            breaker_state=self.breaker.state,
+            breaker_opened=self.breaker.stats["opened"],
+            breaker_rejected=self.breaker.stats["rejected"],
+            p95_ms=p95 * 1000 if p95 is not None else None,
+            hedge_delay_ms=self.hedge_delay() * 1000 if self.hedge else None,
+        )
+        return out
+
+
+_policy: Optional[TransportPolicy] = None
+_policy_lock = threading.Lock()
+
+
+def get_transport_policy() -> TransportPolicy:
+    """Process-wide policy (one breaker for the single upstream provider)."""
+    global _policy
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                _policy = TransportPolicy(
+                    deadline=float(os.getenv("LLM_DEADLINE_S", "30")),
+                    max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+                    backoff_base=float(os.getenv("LLM_BACKOFF_BASE_S", "0.2")),
+                    backoff_max=float(os.getenv("LLM_BACKOFF_MAX_S", "2")),
+                    hedge=os.getenv("LLM_HEDGE") == "1",
+                    hedge_min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY_S", "0.05")),
+                    breaker=CircuitBreaker(
+                        failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+                        reset_timeout=float(os.getenv("LLM_BREAKER_RESET_S", "30")),
+                    ),
+                )
+    return _policy
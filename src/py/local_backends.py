@@ -0,0 +1,172 @@
+# File: local_backends.py
+"""
+In-process stand-ins for the external backends used by RAGSystem.
+
+- HashEncoder: deterministic replacement for BGEM3FlagModel.encode (same call
+  signature and "dense_vecs" output; optional simulated CPU cost).
+- InMemoryVectorCollection: the subset of a pymongo Collection used by
+  RAGSystem ($vectorSearch aggregate, find with equality/$or/$in filters,
+  counts), with an optional simulated round-trip latency.
+- build_corpus: a synthetic product catalogue plus the FAQ_END_USER.md sections.
+
+Used by the benchmarks (bench_pipeline.py) to drive the full chatbot pipeline
+without MongoDB Atlas, the BGE-M3 weights or HF tokens:
+
+    encoder = HashEncoder(encode_ms=15)
+    rag = RAGSystem(collection=InMemoryVectorCollection(build_corpus(encoder)), model=encoder)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+FAQ_PATH = Path(__file__).parent / "FAQ_END_USER.md"
+
+
+class HashEncoder:
+    """Bag-of-words hashing encoder with the BGEM3FlagModel.encode interface."""
+
+    def __init__(self, dim: int = 1024, encode_ms: float = 0.0, per_text_ms: float = 0.0) -> None:
+        self.dim = dim
+        self.encode_ms = encode_ms        # fixed cost per encode() call
+        self.per_text_ms = per_text_ms    # extra cost per text in the batch
+        self._token_vecs: Dict[str, np.ndarray] = {}
+
+    def _token_vec(self, token: str) -> np.ndarray:
+        vec = self._token_vecs.get(token)
+        if vec is None:
+            seed = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vec = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            self._token_vecs[token] = vec
+        return vec
+
+    def _embed(self, text: str) -> np.ndarray:
+        tokens = re.findall(r"\w+", (text or "").lower()) or ["<empty>"]
+        vec = np.sum([self._token_vec(t) for t in tokens], axis=0)
+        return vec / (np.linalg.norm(vec) + 1e-8)
+
+    def encode(self, texts: List[str], batch_size: int = 12, max_length: int = 8192,
+               return_dense: bool = True, return_sparse: bool = False,
+               return_colbert_vecs: bool = False, **kwargs: Any) -> Dict[str, Any]:
+        cost_ms = self.encode_ms + self.per_text_ms * len(texts)
+        if cost_ms > 0:
+            time.sleep(cost_ms / 1000.0)
+        return {"dense_vecs": np.stack([self._embed(t) for t in texts]) if texts else np.zeros((0, self.dim))}
+
+
+def _matches(doc: Dict[str, Any], flt: Optional[Dict[str, Any]]) -> bool:
+    if not flt:
+        return True
+    for key, cond in flt.items():
+        if key == "$or":
+            if not any(_matches(doc, sub) for sub in cond):
+                return False
+        elif isinstance(cond, dict) and "$in" in cond:
+            if doc.get(key) not in cond["$in"]:
+                return False
+        elif doc.get(key) != cond:
+            return False
+    return True
+
+
+class InMemoryVectorCollection:
+    """Subset of pymongo.collection.Collection backed by a numpy matrix."""
+
+    def __init__(self, docs: List[Dict[str, Any]], latency_ms: float = 0.0) -> None:
+        self.latency_ms = latency_ms  # simulated round trip per query
+        self._docs: List[Dict[str, Any]] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self.insert_many(docs)
+
+    def insert_many(self, docs: List[Dict[str, Any]]) -> None:
+        self._docs.extend(dict(d) for d in docs)
+        vecs = [np.asarray(d["embedding"], dtype=np.float32) for d in self._docs if d.get("embedding") is not None]
+        if vecs:
+            mat = np.stack(vecs)
+            self._matrix = mat / (np.linalg.norm(mat, axis=1, keepdims=True) + 1e-8)
+
+    def _sleep(self) -> None:
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def aggregate(self, pipeline: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        self._sleep()
+        results = [dict(d) for d in self._docs]
+        for stage in pipeline:
+            if "$vectorSearch" in stage:
+                spec = stage["$vectorSearch"]
+                q = np.asarray(spec["queryVector"], dtype=np.float32)
+                q = q / (np.linalg.norm(q) + 1e-8)
+                # Atlas cosine score is normalised to [0, 1]
+                scores = (1.0 + self._matrix @ q) / 2.0 if len(self._docs) else np.zeros(0)
+                order = np.argsort(-scores)[: int(spec.get("limit", 10))]
+                results = [{**self._docs[i], "score": float(scores[i])} for i in order]
+            elif "$match" in stage:
+                results = [d for d in results if _matches(d, stage["$match"])]
+            elif "$limit" in stage:
+                results = results[: int(stage["$limit"])]
+            elif "$project" in stage:
+                keep = [k for k, v in stage["$project"].items() if v]
+                results = [{k: d.get(k) for k in keep if k in d or k == "score"} for d in results]
+        return iter(results)
+
+    def find(self, flt: Optional[Dict[str, Any]] = None,
+             projection: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        self._sleep()
+        keep = [k for k, v in (projection or {}).items() if v]
+        for d in self._docs:
+            if _matches(d, flt):
+                yield {k: d.get(k) for k in keep} if keep else dict(d)
+
+    def estimated_document_count(self) -> int:
+        return len(self._docs)
+
+    def count_documents(self, flt: Dict[str, Any]) -> int:
+        return sum(1 for d in self._docs if _matches(d, flt))
+
+
+PRODUCT_NAMES = [
+    "Paracetamol 500mg", "Vitamin C 1000mg", "Siro ho Prospan", "Men vi sinh Enterogermina",
+    "Dầu gió xanh", "Khẩu trang y tế", "Nhiệt kế điện tử", "Máy đo huyết áp Omron",
+    "Kem chống nắng", "Viên kẽm Zinc", "Omega 3 Fish Oil", "Dung dịch muối sinh lý",
+]
+CONDITIONS = ["cảm cúm", "đau đầu", "sốt", "tiêu chảy", "ho khan", "cao huyết áp", "tiểu đường", "mất ngủ"]
+
+
+def build_corpus(encoder: HashEncoder, n_products: int = 300, n_articles: int = 120,
+                 faq_path: Path = FAQ_PATH) -> List[Dict[str, Any]]:
+    """Synthetic catalogue + medical articles + FAQ sections, embedded with `encoder`."""
+    docs: List[Dict[str, Any]] = []
+    for i in range(n_products):
+        name = f"{PRODUCT_NAMES[i % len(PRODUCT_NAMES)]} (mã {i})"
+        price = 25000 + (i * 7919) % 900000
+        docs.append({
+            "productId": f"P{i:05d}", "type": "product", "source": "catalog", "title": name,
+            "text": f"Tên sản phẩm: {name}, giá: {price:,}₫. Công dụng: hỗ trợ điều trị "
+                    f"{CONDITIONS[i % len(CONDITIONS)]}. Thuốc dùng theo chỉ định của bác sĩ.",
+        })
+    for i in range(n_articles):
+        cond = CONDITIONS[i % len(CONDITIONS)]
+        docs.append({
+            "productId": None, "type": "article", "source": "health-news", "title": f"Bệnh {cond}",
+            "text": f"Triệu chứng của bệnh {cond} gồm mệt mỏi và khó chịu. Điều trị {cond} cần "
+                    f"nghỉ ngơi, uống đủ nước và đi khám khi triệu chứng kéo dài (bài {i}).",
+        })
+    if faq_path.exists():
+        sections = re.split(r"\n##\s+", faq_path.read_text(encoding="utf-8"))
+        for sec in sections:
+            if not sec.strip():
+                continue
+            title = sec.strip().splitlines()[0].lstrip("# ").strip()
+            docs.append({"productId": None, "type": "faq", "source": "FAQ_END_USER.md",
+                         "title": title, "text": sec.strip()[:1200]})
+    vecs = encoder.encode([d["text"] for d in docs])["dense_vecs"]
+    for d, v in zip(docs, vecs):
+        d["embedding"] = v.tolist()
+    return docs
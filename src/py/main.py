@@ -5,18 +5,21 @@ Tích hợp MongoDB + FAISS + NeMo Guardrails
 """
 
 import os
+import time
 import asyncio
-import nest_asyncio
+import contextvars
+import threading
+import uuid
 from dotenv import load_dotenv, find_dotenv
 from nemoguardrails import RailsConfig, LLMRails
 from langchain.schema import HumanMessage, SystemMessage
 from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
 from langchain.schema.runnable import RunnableLambda, RunnablePassthrough
 from langchain.schema.output_parser import StrOutputParser
-from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 import requests
 from langchain.llms.base import LLM
-from typing import Optional, List, Any
+from typing import Optional, List, Any, AsyncIterator, Dict, Iterator
 import sys
 from langchain.memory import ConversationSummaryBufferMemory
 
@@ -25,11 +28,96 @@ from langchain.memory import ConversationSummaryBufferMemory
 from hf_api_llm import HuggingFaceAPILLM
 from rag_system import RAGSystem
 from unified_guardrails import UnifiedGuardrails
+from llm_clients import (
+    HF_BASE_URL, MOCK_TOKEN, _token_key, astream_deltas, get_async_client, get_client, is_local_base_url,
+)
+from llm_policy import LLMUnavailable, fallback_response, get_transport_policy
+from admission import PRIORITY_LONG, AdmissionController, Overloaded, classify_priority
+from llm_cache import CompletionCache, current_llm_task, get_completion_cache
+from singleflight import get_flight
+from stop_sequences import astream_until_stop, trim_at_stop
+from chat_store import get_chat_store
+from memory_store import memory_store_from_env
+from summarizer import summary_worker_from_env
+from request_context import RequestContext, current_request, current_token, request_scope
+import metrics
+import tracing
 
 # Load environment variables
 load_dotenv()
 
-nest_asyncio.apply()
+# nest_asyncio lets sync callers (Streamlit, notebooks, the CLI) re-enter a running
+# loop. Servers that own one long-lived loop (the ASGI app sets NEST_ASYNCIO=0)
+# must not patch it: it cannot patch uvloop and hides blocking calls on the loop.
+if os.getenv("NEST_ASYNCIO", "1") == "1":
+    import nest_asyncio
+    nest_asyncio.apply()
+
+# Identical prompts in flight at the same time for the same token share one completion
+LLM_FLIGHT = get_flight("llm")
+
+# prepare_turn stage -> chat_stage_seconds label (recorded by RAGSystem / UnifiedGuardrails
+# themselves, so the NeMo path of run() is covered too; used here for span names)
+STAGE_METRIC = {"validate": "input_guardrails", "intent": "intent", "embed": "embed",
+                "vector_search": "vector_search", "context": "build_context"}
+
+# (user message, retrieval task) started by run() ahead of the rails, for the retrieve_rag_docs action
+_PREFETCH: contextvars.ContextVar[Optional[tuple]] = contextvars.ContextVar("rag_prefetch", default=None)
+
+
+def _discard_task(task: asyncio.Future) -> None:
+    """Cancel a speculative task, or consume its exception if it already failed (no "never retrieved" log)."""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+
+_SYNC_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_SYNC_LOOP_LOCK = threading.Lock()
+
+
+def _sync_bridge_loop() -> asyncio.AbstractEventLoop:
+    """
+    Long-lived loop in a daemon thread for sync callers (generate_response_stream).
+    A loop per message would build a new pooled AsyncClient each time (clients are
+    per loop) and never close it.
+    """
+    global _SYNC_LOOP
+    with _SYNC_LOOP_LOCK:
+        if _SYNC_LOOP is None:
+            _SYNC_LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_SYNC_LOOP.run_forever, name="sync-bridge-loop", daemon=True).start()
+        return _SYNC_LOOP
+
+
+# Budget for all LLM calls of one RAGMedicalChatbot.run request
+REQUEST_DEADLINE_S = float(os.getenv("CHAT_DEADLINE_S", "90"))
+
+# run_batch: default / maximum number of batch items answered at the same time
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "64"))
+# Items are embedded (one encode() per chunk) and started chunk by chunk
+BATCH_EMBED_CHUNK = int(os.getenv("BATCH_EMBED_CHUNK", "64"))
+# With admission control, a batch runs at most this share of ADMISSION_MAX_CONCURRENCY
+# items at once, and each item waits up to BATCH_QUEUE_TIMEOUT_S for its slot
+BATCH_ADMISSION_SHARE = float(os.getenv("BATCH_ADMISSION_SHARE", "0.5"))
+BATCH_QUEUE_TIMEOUT_S = float(os.getenv("BATCH_QUEUE_TIMEOUT_S", "300"))
+
+# Prompt used by the streaming path (run_stream), mirrors config/config.yml instructions
+STREAM_PROMPT_TEMPLATE = """Bạn là Chatbot Web của trang web HEALTH CARE. Trả lời câu hỏi của người dùng CHỈ DỰA TRÊN thông tin trong ngữ cảnh.
+- Không bịa đặt thông tin, đường dẫn hoặc chi tiết sản phẩm không có trong ngữ cảnh; giữ nguyên đường dẫn (ví dụ: /login).
+- Trả lời ngắn gọn, trực tiếp, luôn bằng tiếng Việt.
+- Nếu ngữ cảnh không có thông tin, hãy nói lịch sự rằng bạn không có thông tin đó.
+
+Lịch sử hội thoại:
+{history}
+
+Ngữ cảnh:
+{context}
+
+Người dùng: {question}
+Trợ lý:"""
 
 class HuggingFaceAPILLM(LLM):
     """Custom LLM to use the Hugging Face Inference API with OpenAI-compatible interface."""
@@ -37,11 +125,76 @@ class HuggingFaceAPILLM(LLM):
     temperature: float = 0.1
     max_new_tokens: int = 2048
     hf_token: Optional[str] = None
+    base_url: str = HF_BASE_URL
+    # Answer with a cached/templated fallback when the provider is down (the
+    # memory summarizer turns this off so fallbacks never end up in summaries)
+    degrade_on_failure: bool = True
 
     @property
     def _llm_type(self) -> str:
         return "huggingface_api"
 
+    def _request_key(self, prompt: str, stop: Optional[List[str]]) -> str:
+        return CompletionCache.make_key(self.model_name, self.temperature, self.max_new_tokens, stop, prompt)
+
+    def _cache_for_task(self):
+        """(cache, task): cache is None unless the current task is cacheable."""
+        cache = get_completion_cache()
+        task = current_llm_task()
+        if cache is None or not cache.enabled_for(task):
+            return None, task
+        return cache, task
+
+    def _complete(self, token: str, prompt: str) -> str:
+        # Pooled client: reuses keep-alive connections across calls and users
+        client = get_client(token, self.base_url)
+        completion = get_transport_policy().call(
+            lambda timeout: client.chat.completions.create(
+                model=self.model_name,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                temperature=self.temperature,
+                max_tokens=self.max_new_tokens,
+                timeout=timeout,
+            )
+        )
+        return completion.choices[0].message.content
+
+    async def _acomplete(self, token: str, prompt: str) -> str:
+        client = get_async_client(token, self.base_url)
+        completion = await get_transport_policy().acall(
+            lambda timeout: client.chat.completions.create(
+                model=self.model_name,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=self.temperature,
+                max_tokens=self.max_new_tokens,
+                timeout=timeout,
+            )
+        )
+        return completion.choices[0].message.content
+
+    @staticmethod
+    def _observe_call(started: float, task: Optional[str], source: str) -> None:
+        """chat_llm_call_seconds + an `llm` span in the request trace (if any)."""
+        metrics.LLM_CALL_SECONDS.observe(time.perf_counter() - started, task or "unknown", source)
+        tracing.record("llm", started, task=task or "unknown", source=source)
+
+    def _fallback(self, key: str, task: Optional[str], error: Exception, started: float) -> str:
+        """Last known completion for this prompt, else a templated answer for the task."""
+        print(f"⚠️ LLM unavailable ({type(error).__name__}: {error}); serving fallback", file=sys.stderr)
+        self._observe_call(started, task, "fallback")
+        if not self.degrade_on_failure:
+            metrics.FALLBACKS.inc("raised")
+            raise LLMUnavailable(str(error)) from error
+        cache = get_completion_cache()
+        stale = cache.get_stale(key) if cache is not None else None
+        metrics.FALLBACKS.inc("stale" if stale is not None else "template")
+        return stale if stale is not None else fallback_response(task)
+
     def _call(
         self,
         prompt: str,
@@ -49,54 +202,155 @@ class HuggingFaceAPILLM(LLM):
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> str:
-        token = kwargs.get("hf_token", self.hf_token)
+        token = kwargs.get("hf_token") or current_token(self.hf_token)
         if not token:
             raise ValueError("Hugging Face token must be provided either at initialization or at runtime.")
 
-        from openai import OpenAI
-        
-        client = OpenAI(
-            base_url="https://router.huggingface.co/v1",
-            api_key=token,
-        )
+        key = self._request_key(prompt, stop)
+        started = time.perf_counter()
+        # Rails classification prompts repeat across users: serve them from the completion cache
+        cache, task = self._cache_for_task()
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                self._observe_call(started, task, "cache")
+                return cached
 
         try:
-            completion = client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=self.temperature,
-                max_tokens=self.max_new_tokens,
+            # Flights are per token: a follower must not be billed to, or get the errors of, another user
+            content = LLM_FLIGHT.do((key, _token_key(token)), self._complete, token, prompt)
+        except Exception as e:
+            return self._fallback(key, task, e, started)
+        self._observe_call(started, task, "llm")
+        if stop and content:
+            content = trim_at_stop(content, stop)
+        if cache is not None and content:
+            cache.put(key, content, task)
+        return content
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        """Native async completion (used by NeMo generate_async and the memory summarizer)."""
+        token = kwargs.get("hf_token") or current_token(self.hf_token)
+        if not token:
+            raise ValueError("Hugging Face token must be provided either at initialization or at runtime.")
+
+        key = self._request_key(prompt, stop)
+        started = time.perf_counter()
+        cache, task = self._cache_for_task()
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                self._observe_call(started, task, "cache")
+                return cached
+
+        try:
+            content = await LLM_FLIGHT.ado((key, _token_key(token)), self._acomplete, token, prompt)
+        except Exception as e:
+            return self._fallback(key, task, e, started)
+        self._observe_call(started, task, "llm")
+        if stop and content:
+            content = trim_at_stop(content, stop)
+        if cache is not None and content:
+            cache.put(key, content, task)
+        return content
+
+    async def astream_call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> AsyncIterator[str]:
+        """Async token stream over the pooled AsyncOpenAI client."""
+        token = kwargs.get("hf_token") or current_token(self.hf_token)
+        if not token:
+            raise ValueError("Hugging Face token must be provided either at initialization or at runtime.")
+
+        client = get_async_client(token, self.base_url)
+        try:
+            # Deadline/retries/breaker cover opening the stream (no hedging: it would double the tokens)
+            stream = await get_transport_policy().acall(
+                lambda timeout: client.chat.completions.create(
+                    model=self.model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=self.temperature,
+                    max_tokens=kwargs.get("max_tokens", self.max_new_tokens),
+                    stream=True,
+                    timeout=timeout,
+                ),
+                hedge=False,
             )
-            
-            return completion.choices[0].message.content
         except Exception as e:
-            return f"Error: API request failed: {e}"
+            if not self.degrade_on_failure:
+                raise
+            print(f"⚠️ LLM stream unavailable ({type(e).__name__}: {e}); serving fallback", file=sys.stderr)
+            metrics.FALLBACKS.inc("stream")
+            yield fallback_response(None)
+            return
+        sent = False
+        try:
+            # Stop strings split across chunks are caught; the stream is closed right at the match
+            async for content in astream_until_stop(astream_deltas(stream), stop):
+                sent = True
+                yield content
+        except Exception as e:
+            # Past the first token a fallback would be glued onto a partial answer: let the caller end the stream
+            if sent or not self.degrade_on_failure:
+                raise
+            print(f"⚠️ LLM stream failed before the first token ({type(e).__name__}: {e}); serving fallback",
+                  file=sys.stderr)
+            metrics.FALLBACKS.inc("stream")
+            yield fallback_response(None)
+        finally:
+            await stream.response.aclose()
 
 class RAGMedicalChatbot:
     """Main RAG Medical Chatbot class, now simplified to work with NeMo Guardrails."""
     
-    def __init__(self):
+    def __init__(self, hf_token: Optional[str] = None, rag_system: Optional[RAGSystem] = None,
+                 llm: Optional[HuggingFaceAPILLM] = None):
         """
         Initializes the RAG Medical Chatbot.
-        The LLM is initialized without a token; it must be provided at runtime.
+        The LLM is initialized without a token; it must be provided at runtime
+        (or once here as a default, e.g. by the Streamlit UI).
+        `rag_system` / `llm` inject local stand-ins (see bench_pipeline.py).
         """
         load_dotenv(find_dotenv())
         # LLM is now initialized without a token.
-        self.llm = HuggingFaceAPILLM()
+        self.llm = llm if llm is not None else HuggingFaceAPILLM()
+        # A local OpenAI-compatible stand-in (mock_llm_server) needs no real token
+        self.default_hf_token = hf_token or (MOCK_TOKEN if is_local_base_url(self.llm.base_url) else None)
         
         # Initialize other components
-        self.rag_system = RAGSystem()
+        self.rag_system = rag_system if rag_system is not None else RAGSystem()
+
+        # Rule-based guardrails for the streaming path (rails are owned by this class);
+        # share the already loaded BGE-M3 model for semantic intent detection
+        self.guardrails = UnifiedGuardrails(enable_rails=False)
+        self.guardrails.medical.set_embed_model(self.rag_system.model)
+        # Intent index + intent head now, not on the first request of the process
+        try:
+            if not self.guardrails.medical.warmup():
+                print("⚠️ Semantic intent detection not ready; keyword rules only until it loads", file=sys.stderr)
+        except Exception as e:
+            print(f"⚠️ Guardrails warmup failed: {e}", file=sys.stderr)
+
+        # Legacy UI attribute (Streamlit shows the last turns)
+        self.conversation_history: List[dict] = []
         
         # Setup NeMo Guardrails, passing the LLM instance to it
         self._setup_guardrails()
 
-        # Store user-specific conversation memories
-        self.user_memories = {} # Key: user_id, Value: ConversationSummaryBufferMemory
+        # User-specific conversation memories: a bounded cache over the shared chat store
+        # (any worker process can serve any user)
+        self.chat_store = get_chat_store()
+        self.user_memories = memory_store_from_env(self._new_memory, self.chat_store)
+        # One summarizer LLM for every session; the token comes from the request context
+        self.memory_llm = HuggingFaceAPILLM(
+            hf_token=self.default_hf_token, base_url=self.llm.base_url, degrade_on_failure=False
+        )
+        # Summaries are produced off the request path; finished ones are persisted to the store
+        self.summaries = summary_worker_from_env(on_summarized=self.user_memories.summarized)
 
         print("✅ RAG Medical Chatbot initialized successfully!")
 
@@ -110,34 +364,57 @@ class RAGMedicalChatbot:
             # A fallback token can be set for internal Guardrails actions if needed
             config.models[0].parameters['hf_token_fallback'] = os.environ.get('HUGGINGFACE_TOKEN')
             self.rails = LLMRails(config=config, llm=self.llm)
+            # `$context = execute retrieve_rag_docs(query=$last_user_message)` in config/rails.co
+            self.rails.register_action(self._retrieve_rag_docs, name="retrieve_rag_docs")
             print("✅ NeMo Guardrails initialized successfully.")
         except Exception as e:
             print(f"⚠️ Guardrails setup failed: {e}", file=sys.stderr)
             self.rails = None
 
-    def get_or_create_memory(self, user_id: str, hf_token: str):
+    def _new_memory(self) -> ConversationSummaryBufferMemory:
+        return ConversationSummaryBufferMemory(
+            llm=self.memory_llm,
+            max_token_limit=1024, # Limit the size of the summary
+            memory_key="chat_history",
+            input_key="question",
+            return_messages=True
+        )
+
+    def get_or_create_memory(self, user_id: str, hf_token: Optional[str] = None):
         """
         Retrieves or creates a conversation memory for a specific user.
-        Each user gets their own memory instance.
+        Each user gets their own memory; evicted ones are rebuilt here from the
+        chat store on their next message. `hf_token` is kept for callers of the
+        old signature: summaries use the token of the request that queued them.
         """
-        if user_id not in self.user_memories:
-            # Create a new LLM instance for the memory summary, configured with the user's token
-            memory_llm = HuggingFaceAPILLM(hf_token=hf_token)
-            self.user_memories[user_id] = ConversationSummaryBufferMemory(
-                llm=memory_llm,
-                max_token_limit=1024, # Limit the size of the summary
-                memory_key="chat_history",
-                input_key="question",
-                return_messages=True
-            )
-            print(f"Created new memory for user: {user_id}")
-        return self.user_memories[user_id]
+        return self.user_memories.get(user_id)
+
+    def record_turn(self, user_id: str, memory, user_message: str, response: str,
+                    hf_token: Optional[str] = None) -> None:
+        """Add the exchange to the memory buffer (queued for summary) and to the chat store."""
+        started = time.perf_counter()
+        ctx = current_request() or RequestContext(hf_token=hf_token, user_id=user_id)
+        self.summaries.append_turn(user_id, memory, user_message, response, ctx=ctx.detached())
+        self.user_memories.record_turn(user_id, memory, user_message, response)
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, "memory_save")
+        tracing.record("chat.memory_save", started)
+
+    def clear_history(self, user_id: str) -> None:
+        """Forget the user's conversation in memory and in the chat store."""
+        self.user_memories.forget(user_id)
+
+    def admission_priority(self, user_message: str) -> int:
+        """Scheduling class for the admission controller (cheap: cached rules + keywords only)."""
+        validation = self.guardrails.validate_input(user_message)
+        intent = self.guardrails.medical.keyword_intent(user_message)
+        return classify_priority(validation, intent, user_message)
 
     async def run(self, user_message: str, user_id: str = "default_user", hf_token: Optional[str] = None):
         """
         Main entry point for generating a response.
         Requires user_id for session management and hf_token for authentication.
         """
+        hf_token = hf_token or self.default_hf_token
         if not hf_token:
             return "Lỗi: Hugging Face token is required to use the chatbot."
 
@@ -145,17 +422,28 @@ class RAGMedicalChatbot:
             return "Lỗi: Guardrails is not initialized. Cannot process request."
 
         try:
-            # Get user-specific memory
-            memory = self.get_or_create_memory(user_id, hf_token)
+            # Get user-specific memory (chat store I/O: off the event loop)
+            memory = await asyncio.to_thread(self.get_or_create_memory, user_id, hf_token)
 
-            # Update the LLM's token for this request
-            self.llm.hf_token = hf_token
+            # The rails share self.llm between requests: the token travels in the request
+            # context instead of being set on the instance (safe under concurrency)
+            # The request id is the trace id when the request is traced
+            with request_scope(hf_token=hf_token, user_id=user_id, timeout=REQUEST_DEADLINE_S,
+                               request_id=tracing.current_trace_id()), tracing.span("chat.run", user_id=user_id):
+                # Retrieval overlaps the rails' LLM calls (self-check, intent); the
+                # retrieve_rag_docs action picks up its result
+                prefetch = self._prefetch_retrieval(user_message)
+                reset = _PREFETCH.set((user_message, prefetch)) if prefetch is not None else None
+                try:
+                    # Let NeMo Guardrails handle the flow
+                    response = await self.rails.generate_async(prompt=user_message)
+                finally:
+                    if prefetch is not None:
+                        _PREFETCH.reset(reset)
+                        _discard_task(prefetch)
 
-            # Let NeMo Guardrails handle the flow
-            response = await self.rails.generate_async(prompt=user_message)
-            
-            # Manually save context to memory after the interaction
-            memory.save_context({"question": user_message}, {"output": response})
+                # Record the turn; summarization runs in the background worker
+                await asyncio.to_thread(self.record_turn, user_id, memory, user_message, response)
 
             return response
 
@@ -165,6 +453,300 @@ class RAGMedicalChatbot:
             traceback.print_exc()
             return "Đã xảy ra lỗi trong quá trình xử lý. Vui lòng thử lại."
 
+    def _prefetch_retrieval(self, user_message: str) -> Optional[asyncio.Future]:
+        """Start the vector search for `user_message` unless the input guardrails answer it without RAG."""
+        validation = self.guardrails.validate_input(user_message)  # cached since admission_priority
+        if not validation.get("is_valid", False) or validation.get("is_emergency") or validation.get("override_response"):
+            return None
+        return asyncio.ensure_future(asyncio.to_thread(self.rag_system.retrieve_documents, user_message, 5))
+
+    async def _retrieve_rag_docs(self, query: str = "") -> str:
+        """NeMo action retrieve_rag_docs: RAG context for the user message (prefetched by run() when possible)."""
+        prefetched = _PREFETCH.get()
+        if prefetched is not None and prefetched[0] == query:
+            try:
+                docs = await asyncio.shield(prefetched[1])
+                return await asyncio.to_thread(self.rag_system.context_from_docs, docs, query)
+            except Exception as e:
+                print(f"⚠️ Prefetched retrieval failed ({e}); retrying", file=sys.stderr)
+        return await self.rag_system.aretrieve_and_build_context({"question": query})
+
+    def _format_history(self, memory) -> str:
+        try:
+            messages = self.summaries.history(memory).get("chat_history") or []
+        except Exception:
+            return ""
+        lines = []
+        for m in messages[-8:]:
+            role = "Người dùng" if getattr(m, "type", "") == "human" else "Trợ lý"
+            lines.append(f"{role}: {getattr(m, 'content', m)}")
+        return "\n".join(lines)
+
+    async def prepare_turn(self, user_message: str, stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Pre-LLM stages, overlapped: the query embedding and a speculative vector
+        search start at once, concurrently with input validation and intent
+        detection (whose semantic fallback reuses the same embedding). The
+        speculative retrieval is cancelled when the input is blocked or answered
+        by an override. Returns {"early", "validation", "intent", "context"}.
+
+        stats["stages"] gets each stage's duration (ms), stats["pre_llm_ms"] the
+        wall-clock time and stats["pre_llm_saved_ms"] the sum of the stages minus
+        the wall-clock time, i.e. what running them in sequence would have added.
+        """
+        started = time.perf_counter()
+        stats = stats if stats is not None else {}
+        stages: Dict[str, float] = {}
+
+        async def timed(stage: str, fn, *args):
+            t0 = time.perf_counter()
+            try:
+                with tracing.span(f"stage.{STAGE_METRIC[stage]}"):
+                    return await asyncio.to_thread(fn, *args)
+            finally:
+                stages[stage] = (time.perf_counter() - t0) * 1000
+
+        embed_task = asyncio.ensure_future(timed("embed", self.rag_system.embed_query, user_message))
+
+        async def speculative_retrieval():
+            query_vec = await asyncio.shield(embed_task)
+            return await timed("vector_search", self.rag_system.retrieve_documents, user_message, 5, query_vec)
+
+        retrieval_task = asyncio.ensure_future(speculative_retrieval())
+        turn: Dict[str, Any] = {"early": None, "validation": None, "intent": None, "context": None}
+        try:
+            validation = await timed("validate", self.guardrails.validate_input, user_message)
+            turn["validation"] = validation
+            if not validation.get("is_valid", False) or validation.get("is_emergency"):
+                turn["early"] = validation.get("response")
+                reason = "emergency" if validation.get("is_emergency") else "invalid"
+            elif validation.get("override_response"):
+                turn["early"] = validation["override_response"]
+                reason = "override"
+            if turn["early"]:
+                metrics.BLOCKED.inc(reason)
+                stats["speculation_cancelled"] = not retrieval_task.done()
+                return turn
+
+            if self.guardrails.medical.keyword_intent(user_message) is None:
+                # Semantic fallback: share the retrieval embedding instead of encoding twice
+                query_vec = await asyncio.shield(embed_task)
+                intent = await timed("intent", self.guardrails.detect_intent, user_message, query_vec)
+            else:
+                intent = await timed("intent", self.guardrails.detect_intent, user_message)
+            metrics.INTENTS.inc(str(intent))
+            docs = await retrieval_task
+            turn["intent"] = intent
+            turn["context"] = await timed("context", self.rag_system.context_from_docs, docs, user_message, intent)
+            return turn
+        finally:
+            for task in (retrieval_task, embed_task):
+                _discard_task(task)
+            wall = (time.perf_counter() - started) * 1000
+            stats.update(stages=stages, pre_llm_ms=wall, pre_llm_saved_ms=max(0.0, sum(stages.values()) - wall))
+
+    async def run_stream(
+        self,
+        user_message: str,
+        user_id: str = "default_user",
+        hf_token: Optional[str] = None,
+        stats: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Streaming entry point: input guardrails, intent and retrieval (overlapped,
+        see prepare_turn), then yields answer tokens as the LLM produces them
+        (validated incrementally).
+        If `stats` is given it is filled with ttft_ms / total_ms / chunks / intent.
+        """
+        started = time.perf_counter()
+        stats = stats if stats is not None else {}
+        hf_token = hf_token or self.default_hf_token
+        if not hf_token:
+            yield "Lỗi: Hugging Face token is required to use the chatbot."
+            return
+
+        try:
+            turn = await self.prepare_turn(user_message, stats)
+        except Exception as e:
+            print(f"Error during pre-LLM stages for user {user_id}: {e}", file=sys.stderr)
+            yield "Đã xảy ra lỗi trong quá trình xử lý. Vui lòng thử lại."
+            stats["total_ms"] = (time.perf_counter() - started) * 1000
+            return
+        if turn["early"]:
+            stats.update(ttft_ms=(time.perf_counter() - started) * 1000, blocked=True)
+            yield turn["early"]
+            memory = await asyncio.to_thread(self.get_or_create_memory, user_id, hf_token)
+            await asyncio.to_thread(self.record_turn, user_id, memory, user_message, turn["early"], hf_token)
+            stats["total_ms"] = (time.perf_counter() - started) * 1000
+            return
+
+        parts: List[str] = []
+        try:
+            memory = await asyncio.to_thread(self.get_or_create_memory, user_id, hf_token)
+            intent, context = turn["intent"], turn["context"]
+            stats.update(intent=intent, retrieval_ms=(time.perf_counter() - started) * 1000)
+            prompt = STREAM_PROMPT_TEMPLATE.format(
+                history=self._format_history(memory) or "(trống)", context=context, question=user_message
+            )
+
+            is_medical = intent == "medical" or self.guardrails.medical.is_medical_question(user_message)
+            validator = self.guardrails.medical.stream_validator(is_medical=is_medical)
+            llm_started = time.perf_counter()
+            async for piece in validator.awrap(self.llm.astream_call(prompt, hf_token=hf_token)):
+                if not parts:
+                    stats["ttft_ms"] = (time.perf_counter() - started) * 1000
+                parts.append(piece)
+                yield piece
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - llm_started - validator.busy_s, "llm")
+            metrics.STAGE_SECONDS.observe(validator.busy_s, "output_validation")
+            # Spans cannot stay open across the yields: recorded once the stream is done
+            tracing.record("stage.llm", llm_started, chunks=len(parts),
+                           output_validation_ms=round(validator.busy_s * 1000, 3))
+
+            response = "".join(parts)
+            stats.update(chunks=len(parts), truncated=validator.truncated)
+            await asyncio.to_thread(self.record_turn, user_id, memory, user_message, response, hf_token)
+        except Exception as e:
+            print(f"Error during streaming for user {user_id}: {e}", file=sys.stderr)
+            if parts:
+                # Partial answer already sent: the route ends the stream with an error event
+                raise
+            yield "Đã xảy ra lỗi trong quá trình xử lý. Vui lòng thử lại."
+        finally:
+            stats["total_ms"] = (time.perf_counter() - started) * 1000
+            tracing.record("chat.run_stream", started, user_id=user_id, intent=stats.get("intent"),
+                           ttft_ms=stats.get("ttft_ms"))
+
+    async def run_batch(
+        self,
+        items: List[Dict[str, Any]],
+        hf_token: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        path: str = "run",
+        admission: Optional[AdmissionController] = None,
+        admission_user: str = "batch",
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Answer many messages (`items`: {"message", optional "user_id"}), yielding
+        one result per item as it completes (not in input order):
+        {"index", "user_id", "message", "reply", "ok", "queued_ms", "total_ms", ...}.
+
+        Queries are embedded up front in batches (RAGSystem.embed_queries) so the
+        per-item retrieval only runs the vector search; identical questions share
+        retrieval and LLM completions through the existing flights/cache. At most
+        `concurrency` items run at once. `path` is "run" (NeMo, as /api-chat) or
+        "stream" (run_stream collected, adds its per-stage timings).
+        Items without a user_id get a throwaway session each (no history bleeding
+        between questions), forgotten when the batch ends.
+
+        With `admission`, every item holds its own PRIORITY_LONG slot (tickets of
+        `admission_user`, outside its rate bucket) while it runs, so a batch
+        counts against ADMISSION_MAX_CONCURRENCY like interactive chats and
+        yields to shorter queries; its concurrency is capped at
+        BATCH_ADMISSION_SHARE of the pool.
+        """
+        hf_token = hf_token or self.default_hf_token
+        limit = max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+        if admission is not None:
+            limit = min(limit, max(1, int(admission.max_concurrency * BATCH_ADMISSION_SHARE)))
+        sem = asyncio.Semaphore(limit)
+        results: asyncio.Queue = asyncio.Queue()
+        batch_id = uuid.uuid4().hex[:8]
+        throwaway: List[str] = []
+
+        async def answer(index: int, item: Dict[str, Any], enqueued: float) -> None:
+            message = item.get("message") or ""
+            user_id = item.get("user_id")
+            if not user_id:
+                user_id = f"batch:{batch_id}:{index}"
+                throwaway.append(user_id)
+            result: Dict[str, Any] = {"index": index, "user_id": user_id, "message": message}
+            async with sem:
+                ticket = None
+                started = time.perf_counter()
+                try:
+                    if not message.strip():
+                        raise ValueError("message is required")
+                    if admission is not None:
+                        ticket = await self._batch_ticket(admission, admission_user)
+                        started = time.perf_counter()
+                    result["queued_ms"] = (started - enqueued) * 1000
+                    if path == "stream":
+                        stats: Dict[str, Any] = {}
+                        parts = [chunk async for chunk in self.run_stream(
+                            message, user_id=user_id, hf_token=hf_token, stats=stats)]
+                        result.update(reply="".join(parts), ok=True, stats=stats)
+                    else:
+                        result.update(reply=await self.run(message, user_id=user_id, hf_token=hf_token), ok=True)
+                except Overloaded as e:
+                    result.update(reply=None, ok=False, error=f"overloaded: {e.reason}")
+                except Exception as e:
+                    result.update(reply=None, ok=False, error=str(e))
+                finally:
+                    if ticket is not None:
+                        admission.release(ticket)
+                result.setdefault("queued_ms", (started - enqueued) * 1000)
+                result["total_ms"] = (time.perf_counter() - started) * 1000
+            await results.put(result)
+
+        tasks: List[asyncio.Future] = []
+
+        async def schedule() -> None:
+            for start in range(0, len(items), BATCH_EMBED_CHUNK):
+                chunk = items[start:start + BATCH_EMBED_CHUNK]
+                texts = [m for m in ((it.get("message") or "") for it in chunk) if m.strip()]
+                try:
+                    await asyncio.to_thread(self.rag_system.embed_queries, texts)
+                except Exception as e:
+                    # Items fall back to embedding one by one
+                    print(f"⚠️ Batch embedding failed: {e}", file=sys.stderr)
+                enqueued = time.perf_counter()
+                tasks.extend(asyncio.ensure_future(answer(start + i, it, enqueued)) for i, it in enumerate(chunk))
+            await asyncio.gather(*tasks)
+
+        scheduler = asyncio.ensure_future(schedule())
+        try:
+            for _ in range(len(items)):
+                yield await results.get()
+            await scheduler
+        finally:
+            # Client went away: stop the remaining items
+            for task in [scheduler, *tasks]:
+                if not task.done():
+                    task.cancel()
+            for user_id in throwaway:
+                self.clear_history(user_id)
+
+    @staticmethod
+    async def _batch_ticket(admission: AdmissionController, user_id: str):
+        """Admission slot for one batch item: waits for room (up to BATCH_QUEUE_TIMEOUT_S) instead of failing fast."""
+        end = time.monotonic() + BATCH_QUEUE_TIMEOUT_S
+        while True:
+            try:
+                return await admission.aacquire(
+                    PRIORITY_LONG, user_id, timeout=max(0.0, end - time.monotonic()), rate_limited=False
+                )
+            except Overloaded as e:
+                if e.reason == "timeout" or time.monotonic() + e.retry_after >= end:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    def generate_response_stream(
+        self, user_message: str, user_id: str = "streamlit_user", hf_token: Optional[str] = None
+    ) -> Iterator[str]:
+        """Synchronous bridge over run_stream (for Streamlit and other sync callers)."""
+        loop = _sync_bridge_loop()
+        agen = self.run_stream(user_message, user_id=user_id, hf_token=hf_token)
+        try:
+            while True:
+                try:
+                    chunk = asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        finally:
+            asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
+
 async def main():
     """Main function for local testing"""
     
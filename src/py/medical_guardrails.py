@@ -3,11 +3,28 @@
 Medical Guardrails cho input/output validation và intent detection
 """
 
+import os
 import re
-from typing import Dict, Any, List
-from typing import Tuple
+import json
+import hashlib
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, List, Iterable, Iterator, AsyncIterator
+from typing import Optional, Tuple
 import numpy as np
 
+# Embedding model used for semantic intent matching (same as RAGSystem)
+EMBED_MODEL_NAME = "BAAI/bge-m3"
+# Where the precomputed intent index is persisted (shared with RAG embedding cache)
+INTENT_INDEX_DIR = Path(os.getenv("INTENT_INDEX_DIR", str(Path(__file__).parent / "embedding_cache")))
+
+# Output post-processing
+MAX_OUTPUT_CHARS = 2000
+TRUNCATION_SUFFIX = "...\n\n[Phản hồi đã được rút gọn]"
+CONSULT_DOCTOR_NOTE = "\n\n⚠️ Lưu ý: Luôn tham khảo ý kiến bác sĩ trước khi quyết định điều trị."
+EMPTY_OUTPUT_RESPONSE = "Xin lỗi, mình chưa có câu trả lời phù hợp. Bạn thử hỏi cách khác giúp mình nhé."
+
 class MedicalGuardrails:
     """Medical Guardrails System"""
     
@@ -210,6 +227,14 @@ class MedicalGuardrails:
             "Hãy tham khảo ý kiến bác sĩ khi cần."
         )
 
+        # Output patterns that require a "consult a doctor" note
+        self.harmful_output_patterns = [
+            re.compile(r"tự\s+chẩn\s+đoán"),
+            re.compile(r"không\s+cần\s+bác\s+sĩ"),
+            re.compile(r"tự\s+điều\s+trị"),
+            re.compile(r"bỏ\s+qua\s+bác\s+sĩ"),
+        ]
+
         # Semantic representative phrases per intent (can be expanded)
         self.intent_phrases: Dict[str, List[str]] = {
             "greeting": [
@@ -249,24 +274,39 @@ class MedicalGuardrails:
 
         # Lazy embedding model reference (reuse from RAG if available)
         self._embed_model = None
-        # Precomputed representative embeddings and index
+        self._embed_model_name: str = EMBED_MODEL_NAME
+        # Precomputed representative embeddings (L2-normalized) and index
         self._rep_texts: List[str] = []
         self._rep_vecs: np.ndarray | None = None
         self._rep_intents: List[str] = []
-        # Small LRU cache for query embeddings
-        self._q_cache: Dict[str, np.ndarray] = {}
-        self._q_cache_order: List[str] = []
+        # Unique intents in index order + start offset of each intent's rows
+        # (rows are grouped per intent so np.maximum.reduceat gives the group max)
+        self._intent_labels: List[str] = []
+        self._intent_offsets: np.ndarray | None = None
+        # Small LRU cache for (normalized) query embeddings
+        self._q_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
         self._q_cache_limit: int = 64
+        # Trained linear intent head (intent_model.py); loaded lazily, None if no artifact
+        self._intent_head = None
+        self._intent_head_checked: bool = False
+        # Min cosine similarity to accept a semantic intent when no trained head is available
+        # (the head carries its own probability threshold, calibrated at training time)
+        self.semantic_threshold: float = 0.45
 
     def _get_embed_model(self):
         if self._embed_model is None:
             try:
                 from FlagEmbedding import BGEM3FlagModel
-                self._embed_model = BGEM3FlagModel("BAAI/bge-m3")
+                self._embed_model = BGEM3FlagModel(self._embed_model_name)
             except Exception:
                 self._embed_model = None
         return self._embed_model
 
+    def set_embed_model(self, model, model_name: str = EMBED_MODEL_NAME) -> None:
+        """Reuse an already loaded embedding model (e.g. RAGSystem.model)."""
+        self._embed_model = model
+        self._embed_model_name = model_name
+
     def _embed_texts(self, texts: List[str]) -> np.ndarray:
         model = self._get_embed_model()
         if model is None:
@@ -275,17 +315,75 @@ class MedicalGuardrails:
         arr = np.array(out["dense_vecs"], dtype=np.float32)
         return arr
 
+    @staticmethod
+    def _l2_normalize(vecs: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vecs, axis=-1, keepdims=True)
+        return (vecs / (norms + 1e-8)).astype(np.float32)
+
     def _embed_query_cached(self, text: str) -> np.ndarray:
-        if text in self._q_cache:
-            return self._q_cache[text]
-        vec = self._embed_texts([text])[0]
-        self._q_cache[text] = vec
-        self._q_cache_order.append(text)
-        if len(self._q_cache_order) > self._q_cache_limit:
-            oldest = self._q_cache_order.pop(0)
-            self._q_cache.pop(oldest, None)
+        """Return the L2-normalized embedding of `text` (O(1) LRU cache)."""
+        vec = self._q_cache.get(text)
+        if vec is not None:
+            self._q_cache.move_to_end(text)
+            return vec
+        vec = self._l2_normalize(self._embed_texts([text])[0])
+        self._cache_query_vec(text, vec)
         return vec
 
+    def _cache_query_vec(self, text: str, vec: np.ndarray) -> None:
+        self._q_cache[text] = vec
+        if len(self._q_cache) > self._q_cache_limit:
+            self._q_cache.popitem(last=False)
+
+    def _intent_index_key(self) -> str:
+        """Hash of the phrase set + embedding model; any edit yields a new index file."""
+        payload = json.dumps(
+            {"model": self._embed_model_name, "phrases": self.intent_phrases},
+            ensure_ascii=False,
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def _intent_index_path(self) -> Path:
+        return INTENT_INDEX_DIR / f"intent_index_{self._intent_index_key()[:16]}.npz"
+
+    def _set_rep_index(self, rep_texts: List[str], rep_intents: List[str], rep_vecs: np.ndarray) -> None:
+        self._rep_texts = rep_texts
+        self._rep_intents = rep_intents
+        self._rep_vecs = rep_vecs
+        labels: List[str] = []
+        offsets: List[int] = []
+        for idx, intent in enumerate(rep_intents):
+            if not labels or labels[-1] != intent:
+                labels.append(intent)
+                offsets.append(idx)
+        self._intent_labels = labels
+        self._intent_offsets = np.array(offsets, dtype=np.intp)
+
+    def _load_intent_index(self, rep_texts: List[str], rep_intents: List[str]) -> bool:
+        path = self._intent_index_path()
+        if not path.exists():
+            return False
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                vecs = np.asarray(data["vecs"], dtype=np.float32)
+                texts = [str(t) for t in data["texts"]]
+            if texts != rep_texts or vecs.shape[0] != len(rep_texts):
+                return False
+            self._set_rep_index(rep_texts, rep_intents, vecs)
+            return True
+        except Exception:
+            return False
+
+    def _save_intent_index(self) -> None:
+        try:
+            INTENT_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+            path = self._intent_index_path()
+            tmp = path.with_name(path.name + ".tmp.npz")
+            np.savez(tmp, vecs=self._rep_vecs, texts=np.array(self._rep_texts))
+            os.replace(tmp, path)
+        except Exception:
+            pass
+
     def _ensure_rep_embeddings(self) -> bool:
         if self._rep_vecs is not None and len(self._rep_texts) > 0:
             return True
@@ -294,54 +392,86 @@ class MedicalGuardrails:
             rep_texts = [p for intent in intents for p in self.intent_phrases[intent]]
             if not rep_texts:
                 return False
-            rep_vecs = self._embed_texts(rep_texts)
-            self._rep_texts = rep_texts
-            self._rep_vecs = rep_vecs
-            self._rep_intents = [intent for intent in intents for _ in self.intent_phrases[intent]]
+            rep_intents = [intent for intent in intents for _ in self.intent_phrases[intent]]
+            # Fast path: precomputed, pre-normalized index persisted on disk
+            if self._load_intent_index(rep_texts, rep_intents):
+                return True
+            # Without the model we would only get zero vectors; never persist those
+            if self._get_embed_model() is None:
+                return False
+            rep_vecs = self._l2_normalize(self._embed_texts(rep_texts))
+            self._set_rep_index(rep_texts, rep_intents, rep_vecs)
+            self._save_intent_index()
             return True
         except Exception:
             return False
 
+    def _get_intent_head(self):
+        """Newest trained intent head for the current embedding model (loaded once)."""
+        if not self._intent_head_checked:
+            self._intent_head_checked = True
+            try:
+                from intent_model import load_latest_head
+                self._intent_head = load_latest_head(self._embed_model_name)
+            except Exception:
+                self._intent_head = None
+        return self._intent_head
+
+    def warmup(self) -> bool:
+        """Load the intent index, intent head and embedding model ahead of the first request."""
+        ready = self._ensure_rep_embeddings()
+        self._get_intent_head()
+        return ready and self._get_embed_model() is not None
+
+    @staticmethod
+    def _needs_semantic(query_lower: str) -> bool:
+        """Cheap short-circuit: trivial greetings/thanks/bye or <= 2 words skip embedding."""
+        trivial_markers = ["xin chào", "chào", "hello", "hi", "cảm ơn", "thank you", "thanks", "tạm biệt", "bye"]
+        if any(m in query_lower for m in trivial_markers):
+            return False
+        return len([w for w in query_lower.split() if w.strip()]) > 2
+
+    def _score_semantic(self, q_norms: np.ndarray) -> Tuple[List[str], np.ndarray, float]:
+        """Score a (N, D) batch of normalized query embeddings.
+
+        Uses the trained intent head when available (one matmul against its weights),
+        otherwise the nearest-phrase index (one matmul + per-intent group max).
+        Returns (intents, scores, acceptance threshold).
+        """
+        head = self._get_intent_head()
+        if head is not None and head.dim == q_norms.shape[1]:
+            intents, scores = head.predict(q_norms)
+            return intents, scores, head.threshold
+        if not self._ensure_rep_embeddings():
+            return ["general"] * len(q_norms), np.zeros(len(q_norms), dtype=np.float32), self.semantic_threshold
+        sims = q_norms @ self._rep_vecs.T
+        group_max = np.maximum.reduceat(sims, self._intent_offsets, axis=1)
+        best = group_max.argmax(axis=1)
+        intents = [self._intent_labels[i] for i in best]
+        return intents, group_max[np.arange(len(best)), best], self.semantic_threshold
+
     def _semantic_intent(self, query: str) -> Tuple[str, float]:
         """Compute semantic similarity to representative phrases and return best intent and score.
 
         Optimizations:
         - Skip entirely for trivial greetings or very short queries (< 3 words) to avoid unnecessary embedding.
-        - Precompute representative phrase embeddings once and cache query embeddings.
+        - Representative embeddings are loaded pre-normalized from a persisted index;
+          scoring is one matrix-vector product plus a per-intent group max.
         """
+        intent, score, _ = self._semantic_intent_scored(query)
+        return (intent, score)
+
+    def _semantic_intent_scored(self, query: str) -> Tuple[str, float, float]:
         try:
-            ql = query.strip().lower()
-            # Cheap short-circuit: trivial greeting/thanks/bye → no semantic
-            trivial_markers = ["xin chào", "chào", "hello", "hi", "cảm ơn", "thank you", "thanks", "tạm biệt", "bye"]
-            if any(m in ql for m in trivial_markers):
-                return ("general", 0.0)
-            # Skip extremely short inputs (<= 2 words) to save compute
-            if len([w for w in ql.split() if w.strip()]) <= 2:
-                return ("general", 0.0)
-
-            if not self._ensure_rep_embeddings():
-                return ("general", 0.0)
-            q_vec = self._embed_query_cached(query)
-            rep_vecs = self._rep_vecs
-            if rep_vecs is None or rep_vecs.size == 0:
-                return ("general", 0.0)
-
-            # cosine similarity
-            q_norm = q_vec / (np.linalg.norm(q_vec) + 1e-8)
-            rep_norm = rep_vecs / (np.linalg.norm(rep_vecs, axis=1, keepdims=True) + 1e-8)
-            sims = rep_norm @ q_norm
-
-            # Find best by grouping using precomputed intent index
-            best_intent = "general"
-            best_score = -1.0
-            for idx, intent in enumerate(self._rep_intents):
-                score = float(sims[idx])
-                if score > best_score:
-                    best_score = score
-                    best_intent = intent
-            return (best_intent, best_score)
+            if not self._needs_semantic(query.strip().lower()):
+                return ("general", 0.0, self.semantic_threshold)
+            if self._get_intent_head() is None and not self._ensure_rep_embeddings():
+                return ("general", 0.0, self.semantic_threshold)
+            q_norm = self._embed_query_cached(query)
+            intents, scores, threshold = self._score_semantic(q_norm[None, :])
+            return (intents[0], float(scores[0]), threshold)
         except Exception:
-            return ("general", 0.0)
+            return ("general", 0.0, self.semantic_threshold)
     
     def validate_input(self, user_input: str) -> Dict[str, Any]:
         """Validate user input for security and safety"""
@@ -351,9 +481,18 @@ class MedicalGuardrails:
                 "reason": "empty_input",
                 "response": "Bạn vui lòng nhập câu hỏi để mình hỗ trợ nhé."
             }
-        
-        user_input_lower = user_input.lower()
-        
+        return self._validate_lowered(user_input, user_input.lower())
+
+    def validate_input_batch(self, inputs: List[str], lowered: List[str] | None = None) -> List[Dict[str, Any]]:
+        """validate_input over many messages; `lowered` reuses an existing normalization pass."""
+        if lowered is None:
+            lowered = [(t or "").lower() for t in inputs]
+        return [
+            self.validate_input(text) if not text or not text.strip() else self._validate_lowered(text, low)
+            for text, low in zip(inputs, lowered)
+        ]
+
+    def _validate_lowered(self, user_input: str, user_input_lower: str) -> Dict[str, Any]:
         # Check for prompt injection
         for pattern in self.blocked_patterns:
             if re.search(pattern, user_input_lower):
@@ -486,14 +625,53 @@ class MedicalGuardrails:
         keywords = self.medical_keywords + self.web_keywords
         return any(keyword in query for keyword in keywords)
     
-    def detect_intent(self, query: str) -> str:
-        """Keyword-only intent detection (expanded vocabulary)."""
+    def detect_intent(self, query: str, query_vec: Optional[np.ndarray] = None) -> str:
+        """Keyword intent detection, then the semantic fallback.
+
+        `query_vec` is an already computed embedding of `query` from the same model
+        (e.g. RAGSystem.embed_query); it is reused instead of encoding again.
+        """
+        if query_vec is not None and query not in self._q_cache:
+            self._cache_query_vec(query, self._l2_normalize(np.asarray(query_vec, dtype=np.float32)))
         return self._fallback_intent_detection(query)
-    
-    def _fallback_intent_detection(self, query: str) -> str:
-        """Fallback intent detection using keywords only"""
-        query_lower = query.lower()
 
+    def detect_intent_batch(self, queries: List[str], lowered: List[str] | None = None) -> List[str]:
+        """Vectorized detect_intent: keyword cascade per query, then one batched
+        embedding call and one matmul for every query that needs the semantic fallback."""
+        if lowered is None:
+            lowered = [(q or "").lower() for q in queries]
+        results: List[str] = []
+        pending: List[int] = []
+        for idx, ql in enumerate(lowered):
+            intent = self._keyword_intent(ql)
+            if intent is None and self._needs_semantic(ql.strip()):
+                pending.append(idx)
+            results.append(intent or "general")
+        if not pending:
+            return results
+        try:
+            if self._get_intent_head() is None and not self._ensure_rep_embeddings():
+                return results
+            texts = [queries[i] for i in pending]
+            missing = [t for t in dict.fromkeys(texts) if t not in self._q_cache]
+            fresh = dict(zip(missing, self._l2_normalize(self._embed_texts(missing)))) if missing else {}
+            for text, vec in fresh.items():
+                self._cache_query_vec(text, vec)
+            q_norms = np.stack([fresh[t] if t in fresh else self._embed_query_cached(t) for t in texts])
+            intents, scores, threshold = self._score_semantic(q_norms)
+            for idx, intent, score in zip(pending, intents, scores):
+                if float(score) >= threshold:
+                    results[idx] = intent
+        except Exception:
+            pass
+        return results
+
+    def keyword_intent(self, query: str) -> str | None:
+        """Keyword-only intent (no embedding); None when only the semantic fallback could tell."""
+        return self._keyword_intent(query.lower())
+
+    def _keyword_intent(self, query_lower: str) -> str | None:
+        """Keyword cascade; returns None when the semantic fallback should decide."""
         # First: domain keywords take precedence
         has_price = any(keyword in query_lower for keyword in self.price_keywords)
         has_product = any(keyword in query_lower for keyword in self.product_keywords)
@@ -531,10 +709,17 @@ class MedicalGuardrails:
             has_question = any(m in query_lower for m in ask_markers)
             if is_short and not has_question:
                 return "greeting"
+        return None
+    
+    def _fallback_intent_detection(self, query: str) -> str:
+        """Fallback intent detection using keywords, then the semantic fallback"""
+        intent = self._keyword_intent(query.lower())
+        if intent is not None:
+            return intent
 
-        # Semantic fallback: use embeddings to choose best intent if keywords fail
-        best_intent, score = self._semantic_intent(query)
-        if score >= 0.45:
+        # Semantic fallback: trained intent head (or nearest phrase) if keywords fail
+        best_intent, score, threshold = self._semantic_intent_scored(query)
+        if score >= threshold:
             return best_intent
 
         return "general"
@@ -542,80 +727,191 @@ class MedicalGuardrails:
     def validate_output(self, response: str, is_medical: bool = True) -> str:
         """Validate and enhance output"""
         if not response or not response.strip():
-            return "Xin lỗi, mình chưa có câu trả lời phù hợp. Bạn thử hỏi cách khác giúp mình nhé."
+            return EMPTY_OUTPUT_RESPONSE
         
         # Check for harmful content
-        harmful_patterns = [
-            r"tự\s+chẩn\s+đoán",
-            r"không\s+cần\s+bác\s+sĩ",
-            r"tự\s+điều\s+trị",
-            r"bỏ\s+qua\s+bác\s+sĩ"
-        ]
-        
-        for pattern in harmful_patterns:
-            if re.search(pattern, response.lower()):
-                if "tham khảo ý kiến bác sĩ" not in response.lower():
-                    response += "\n\n⚠️ Lưu ý: Luôn tham khảo ý kiến bác sĩ trước khi quyết định điều trị."
+        response_lower = response.lower()
+        for pattern in self.harmful_output_patterns:
+            if pattern.search(response_lower):
+                if "tham khảo ý kiến bác sĩ" not in response_lower:
+                    response += CONSULT_DOCTOR_NOTE
+                    response_lower = response.lower()
         
         # Add medical disclaimer
-        if is_medical and ("disclaimer" not in response.lower() and "tuyên bố" not in response.lower()):
+        if is_medical and ("disclaimer" not in response_lower and "tuyên bố" not in response_lower):
             # Ensure newline separation
             if not response.endswith("\n"):
                 response += "\n"
             response += self.medical_disclaimer
         
         # Limit response length
-        if len(response) > 2000:
-            response = response[:2000].rstrip() + "...\n\n[Phản hồi đã được rút gọn]"
+        if len(response) > MAX_OUTPUT_CHARS:
+            response = response[:MAX_OUTPUT_CHARS].rstrip() + TRUNCATION_SUFFIX
         
         return response
+
+    def stream_validator(self, is_medical: bool = True) -> "StreamingOutputValidator":
+        """Incremental validate_output for token streams (see StreamingOutputValidator)."""
+        return StreamingOutputValidator(self, is_medical=is_medical)
     
+    def validate_output_batch(self, responses: List[str], is_medical: List[bool] | bool = True) -> List[str]:
+        """validate_output over many responses (per-item or shared is_medical flag)."""
+        flags = is_medical if isinstance(is_medical, list) else [is_medical] * len(responses)
+        return [self.validate_output(r, is_medical=m) for r, m in zip(responses, flags)]
+
     def is_medical_question(self, user_message: str) -> bool:
         """Check if the question is medical-related"""
         message_lower = user_message.lower()
         return any(keyword in message_lower for keyword in self.medical_keywords)
     
     def extract_entities(self, text: str) -> Dict[str, List[str]]:
-        """Extract medical entities from text using LLM when available, fallback to regex."""
-        # Try LLM-based extraction via LangChainIntentClassifier
+        """Extract medical entities (gazetteer/regex fast path, cached; optional async LLM enrichment)."""
+        from entity_extraction import get_entity_extractor
+        return get_entity_extractor().extract(text)
+
+
+class StreamingOutputValidator:
+    """Stateful, incremental version of MedicalGuardrails.validate_output.
+
+    Feed token chunks as they arrive (e.g. from HuggingFaceAPILLM.stream_call):
+    - harmful patterns are matched on a rolling lower-cased window, so a phrase
+      split across chunk boundaries is still detected;
+    - text is released as soon as it falls out of the hold-back window;
+    - the consult note / disclaimer are injected once at the end (finish());
+    - when the MAX_OUTPUT_CHARS cap is reached, the truncation marker is emitted
+      and `should_stop` is set so the caller can cancel the upstream LLM stream.
+
+    Unlike validate_output, the cap applies to the model text only; the note and
+    disclaimer are always appended in full after it. `busy_s` accumulates the
+    time wrap()/awrap() spent validating (excluding the wait for the LLM).
+    """
+
+    def __init__(self, guard: MedicalGuardrails, is_medical: bool = True, window: int = 64,
+                 max_chars: int = MAX_OUTPUT_CHARS) -> None:
+        self.guard = guard
+        self.is_medical = is_medical
+        self.window = window
+        self.max_chars = max_chars
+        self.should_stop = False
+        self.truncated = False
+        self._pending = ""
+        self._scan_tail = ""
+        self._released = 0
+        self._last_char = ""
+        self._seen_content = False
+        self._harmful = False
+        self._has_consult = False
+        self._has_disclaimer = False
+        self._finished = False
+        self.busy_s = 0.0
+
+    def _scan(self, chunk: str) -> None:
+        scan = self._scan_tail + chunk.lower()
+        if not self._harmful and any(p.search(scan) for p in self.guard.harmful_output_patterns):
+            self._harmful = True
+        if not self._has_consult and "tham khảo ý kiến bác sĩ" in scan:
+            self._has_consult = True
+        if not self._has_disclaimer and ("disclaimer" in scan or "tuyên bố" in scan):
+            self._has_disclaimer = True
+        self._scan_tail = scan[-self.window:]
+
+    def _emit(self, text: str) -> str:
+        if text:
+            self._released += len(text)
+            self._last_char = text[-1]
+        return text
+
+    def feed(self, chunk: str) -> str:
+        """Consume one chunk; return the text that is safe to release now."""
+        if self.should_stop or self._finished or not chunk:
+            return ""
+        self._scan(chunk)
+        self._pending += chunk
+        if not self._seen_content:
+            if not self._pending.strip():
+                return ""
+            self._seen_content = True
+
+        budget = self.max_chars - self._released
+        if len(self._pending) > budget:
+            # Cap reached: release up to the limit and ask the caller to stop the LLM
+            head = (self._pending[:budget]).rstrip() + TRUNCATION_SUFFIX
+            self._pending = ""
+            self.truncated = True
+            self.should_stop = True
+            return self._emit(head)
+
+        cut = len(self._pending) - self.window
+        if cut <= 0:
+            return ""
+        out, self._pending = self._pending[:cut], self._pending[cut:]
+        return self._emit(out)
+
+    def finish(self) -> str:
+        """Flush the held-back tail and append the note/disclaimer (call once)."""
+        if self._finished:
+            return ""
+        self._finished = True
+        if not self._seen_content:
+            return self._emit(EMPTY_OUTPUT_RESPONSE)
+        out = self._pending
+        self._pending = ""
+        if self._harmful and not self._has_consult:
+            out += CONSULT_DOCTOR_NOTE
+        if self.is_medical and not self._has_disclaimer:
+            last = out[-1] if out else self._last_char
+            if last != "\n":
+                out += "\n"
+            out += self.guard.medical_disclaimer
+        return self._emit(out)
+
+    def wrap(self, chunks: Iterable[str]) -> Iterator[str]:
+        """Validate a sync chunk iterator; closes it as soon as the cap is reached."""
         try:
-            from intent_classifier import LangChainIntentClassifier
-            clf = LangChainIntentClassifier()
-            result = clf.classify(text)
-            ent = result.get("entities") or {}
-            # Normalize structure
-            normalized = {
-                "symptoms": ent.get("symptom") or ent.get("symptoms") or [],
-                "medications": ent.get("medication") or ent.get("medications") or [],
-                "conditions": ent.get("condition") or ent.get("conditions") or [],
-                "product_name": ent.get("product_name") or ent.get("product") or "",
-            }
-            # Ensure lists
-            for k in ["symptoms", "medications", "conditions"]:
-                v = normalized.get(k)
-                if isinstance(v, str):
-                    normalized[k] = [v]
-                elif not isinstance(v, list):
-                    normalized[k] = []
-            if not isinstance(normalized.get("product_name"), str):
-                normalized["product_name"] = ""
-            return normalized
-        except Exception:
-            pass
+            for chunk in chunks:
+                t0 = time.perf_counter()
+                out = self.feed(chunk)
+                self.busy_s += time.perf_counter() - t0
+                if out:
+                    yield out
+                if self.should_stop:
+                    break
+            t0 = time.perf_counter()
+            tail = self.finish()
+            self.busy_s += time.perf_counter() - t0
+            if tail:
+                yield tail
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
 
-        # Regex fallback
-        entities = {
-            "symptoms": [],
-            "medications": [],
-            "conditions": [],
-            "product_name": ""
-        }
-        text_lower = text.lower()
-        symptom_patterns = [
-            r"đau\s+([\wàáạãảăằắẳẵặâầấẩẫậèéẻẽẹêềếểễệìíỉĩịòóỏõọôồốổỗộơờớởỡợùúủũụưừứửữựỳýỷỹỵđ-]+)",
-            r"sốt\s+([\wàáạãảăằắẳẵặâầấẩẫậèéẻẽẹêềếểễệìíỉĩịòóỏõọôồốổỗộơờớởỡợùúủũụưừứửữựỳýỷỹỵđ-]+)",
-            r"ho\s+([\wàáạãảăằắẳẵặâầấẩẫậèéẻẽẹêềếểễệìíỉĩịòóỏõọôồốổỗộơờớởỡợùúủũụưừứửữựỳýỷỹỵđ-]+)",
-        ]
-        for pattern in symptom_patterns:
-            entities["symptoms"].extend(re.findall(pattern, text_lower))
-        return entities
+    async def awrap(self, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Async counterpart of wrap() for async token generators."""
+        try:
+            async for chunk in chunks:
+                t0 = time.perf_counter()
+                out = self.feed(chunk)
+                self.busy_s += time.perf_counter() - t0
+                if out:
+                    yield out
+                if self.should_stop:
+                    break
+            t0 = time.perf_counter()
+            tail = self.finish()
+            self.busy_s += time.perf_counter() - t0
+            if tail:
+                yield tail
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+if __name__ == "__main__":
+    # Precompute and persist the intent index (e.g. at build/deploy time)
+    guard = MedicalGuardrails()
+    if guard.warmup():
+        print(f"✅ Intent index ready: {guard._intent_index_path()}")
+    else:
+        print("⚠️ Embedding model unavailable; intent index not built.")
@@ -0,0 +1,207 @@
+# File: memory_store.py
+"""
+Bounded per-user conversation memory over the shared chat store.
+
+RAGMedicalChatbot used to keep one ConversationSummaryBufferMemory per user_id
+ever seen, forever. ConversationMemoryStore keeps at most `max_sessions`
+memories resident, ordered by recency:
+- LRU eviction once the cap is reached,
+- idle eviction after `idle_ttl` seconds without a request.
+
+Every turn and every completed summary is written to chat_store.ChatStore, so
+eviction never loses history: an evicted (or never seen) user's memory is
+rebuilt lazily from the stored summary plus the messages it does not cover.
+Because the store is shared between worker processes, a resident memory is
+also rebuilt when another process stored a newer turn for the same user.
+
+    memory = store.get(user_id)
+    summaries.append_turn(user_id, memory, question, answer)
+    store.record_turn(user_id, memory, question, answer)
+
+Configuration (env):
+    MEMORY_MAX_SESSIONS       resident memories (2000)
+    MEMORY_IDLE_TTL_S         idle seconds before a memory is dropped (1800)
+    MEMORY_MAX_REHYDRATE      unsummarized messages loaded on a rebuild (200)
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from chat_store import ASSISTANT, USER, ChatStore
+
+
+def message_size(memory: Any) -> int:
+    """Approximate resident bytes of a memory (text payload only)."""
+    messages = getattr(getattr(memory, "chat_memory", None), "messages", None) or []
+    summary = getattr(memory, "moving_summary_buffer", "") or ""
+    return len(summary) + sum(len(getattr(m, "content", "")) for m in messages)
+
+
+@dataclass
+class _Session:
+    memory: Any
+    last_used: float
+    seen_ts: float   # timestamp of the latest stored message reflected in `memory`
+    covered: int     # stored messages folded into memory.moving_summary_buffer
+
+
+class ConversationMemoryStore:
+    """LRU + idle-TTL cache of per-user memories, rebuilt from a ChatStore on a miss."""
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        chat_store: Optional[ChatStore] = None,
+        max_sessions: int = 2000,
+        idle_ttl: float = 1800.0,
+        max_rehydrate: int = 200,
+    ) -> None:
+        self.factory = factory
+        self.chat_store = chat_store
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_rehydrate = max_rehydrate
+        # least recently used first
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = {"created": 0, "rehydrated": 0, "refreshed": 0, "evicted_lru": 0,
+                       "evicted_idle": 0, "hits": 0, "turns_recorded": 0, "summaries_stored": 0}
+
+    # --- persistence --------------------------------------------------------------
+
+    def _build_locked(self, user_id: str, factory: Callable[[], Any]) -> _Session:
+        memory = factory()
+        if self.chat_store is None:
+            self._stats["created"] += 1
+            return _Session(memory, time.monotonic(), 0.0, 0)
+        summary, covered = self.chat_store.get_summary(user_id)
+        messages = self.chat_store.messages_from(user_id, covered)
+        if not summary and not messages:
+            self._stats["created"] += 1
+            return _Session(memory, time.monotonic(), 0.0, 0)
+        if len(messages) > self.max_rehydrate:
+            # Only when summaries kept failing; the oldest unsummarized turns are left out
+            covered += len(messages) - self.max_rehydrate
+            messages = messages[-self.max_rehydrate:]
+        memory.moving_summary_buffer = summary
+        for m in messages:
+            if m["role"] == USER:
+                memory.chat_memory.add_user_message(m["content"])
+            else:
+                memory.chat_memory.add_ai_message(m["content"])
+        self._stats["rehydrated"] += 1
+        return _Session(memory, time.monotonic(), messages[-1]["ts"] if messages else 0.0, covered)
+
+    # --- eviction ---------------------------------------------------------------
+
+    def _evict_locked(self, now: float) -> None:
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions:
+                self._stats["evicted_lru"] += 1
+            elif now - session.last_used > self.idle_ttl:
+                self._stats["evicted_idle"] += 1
+            else:
+                break
+            self._sessions.popitem(last=False)
+
+    def sweep(self) -> None:
+        """Drop idle sessions now (also done on every get)."""
+        with self._lock:
+            self._evict_locked(time.monotonic())
+
+    # --- public API ---------------------------------------------------------------
+
+    def get(self, user_id: str, factory: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Memory for `user_id`: resident, or rebuilt from the chat store.
+        `factory` overrides the store's factory when a memory has to be built.
+        """
+        factory = factory or self.factory
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.pop(user_id, None)
+            if session is not None and self.chat_store is not None:
+                if self.chat_store.last_ts(user_id) > session.seen_ts:
+                    # Another worker process served this user since
+                    session = None
+                    self._stats["refreshed"] += 1
+            if session is not None:
+                self._stats["hits"] += 1
+            else:
+                session = self._build_locked(user_id, factory)
+            session.last_used = now
+            self._sessions[user_id] = session
+            self._evict_locked(now)
+            return session.memory
+
+    def record_turn(self, user_id: str, memory: Any, question: str, answer: str) -> None:
+        """Persist one exchange (the caller adds it to the memory buffer)."""
+        if self.chat_store is None:
+            return
+        ts = self.chat_store.append(user_id, [(USER, question), (ASSISTANT, answer)])
+        with self._lock:
+            self._stats["turns_recorded"] += 1
+            session = self._sessions.get(user_id)
+            if session is not None and session.memory is memory:
+                session.seen_ts = ts
+                session.last_used = time.monotonic()
+                self._sessions.move_to_end(user_id)
+
+    def summarized(self, user_id: str, memory: Any, dropped: int) -> None:
+        """A summary folded `dropped` more messages of `memory`; persist it."""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None or session.memory is not memory:
+                # Evicted or rebuilt meanwhile: the next rebuild summarizes again
+                return
+            session.covered += dropped
+            covered = session.covered
+            self._stats["summaries_stored"] += 1
+        if self.chat_store is not None:
+            self.chat_store.put_summary(user_id, memory.moving_summary_buffer, covered)
+
+    def forget(self, user_id: str) -> None:
+        """Drop the user's resident memory and stored history."""
+        with self._lock:
+            self._sessions.pop(user_id, None)
+        if self.chat_store is not None:
+            self.chat_store.clear(user_id)
+
+    def __contains__(self, user_id: str) -> bool:
+        with self._lock:
+            return user_id in self._sessions
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sizes: List[int] = [message_size(s.memory) for s in self._sessions.values()]
+            return {
+                **self._stats,
+                "resident": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "idle_ttl_s": self.idle_ttl,
+                "resident_bytes": sum(sizes),
+                "bytes_per_session": sum(sizes) / len(sizes) if sizes else 0.0,
+                "chat_store": self.chat_store.stats() if self.chat_store is not None else None,
+            }
+
+
+def memory_store_from_env(factory: Callable[[], Any], chat_store: Optional[ChatStore] = None) -> ConversationMemoryStore:
+    """ConversationMemoryStore configured from the environment."""
+    return ConversationMemoryStore(
+        factory=factory,
+        chat_store=chat_store,
+        max_sessions=int(os.getenv("MEMORY_MAX_SESSIONS", "2000")),
+        idle_ttl=float(os.getenv("MEMORY_IDLE_TTL_S", "1800")),
+        max_rehydrate=int(os.getenv("MEMORY_MAX_REHYDRATE", "200")),
+    )
@@ -0,0 +1,195 @@
+# File: metrics.py
+"""
+Chat pipeline metrics in the Prometheus text exposition format.
+
+A minimal in-process registry (no prometheus_client dependency): counters,
+gauges and fixed-bucket histograms keyed by label values. Recording is a lock,
+a dict lookup and (histograms) a bisect, so it stays on the hot path; the text
+is only built when /metrics is scraped.
+
+    STAGE_SECONDS.observe(0.012, "embed")
+    with INFLIGHT.track("api_chat"):
+        ...
+    render()  # -> text/plain; version=0.0.4
+
+Each process (Flask server, uvicorn worker, Node pool worker) exposes its own
+values; Prometheus aggregates across instances.
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans cache hits (sub-ms) to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric") -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.lines())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Registry = REGISTRY) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+        registry.register(self)
+
+    def _snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def lines(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+                for key, value in sorted(self._snapshot().items())]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    @contextmanager
+    def track(self, *labels: str) -> Iterator[None]:
+        """+1 for the duration of the block (in-flight requests)."""
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY) -> None:
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labels)
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        out: List[str] = []
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else _number(bound))
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return out
+
+
+def render() -> str:
+    """All metrics of this process in the Prometheus text format."""
+    return REGISTRY.render()
+
+
+# --- chat pipeline metrics ----------------------------------------------------------
+
+# input_guardrails, intent, embed, vector_search, build_context, output_validation
+# (timed where they run: RAGSystem / UnifiedGuardrails, for run() and run_stream()
+# alike), llm (streamed final answer), memory_save
+STAGE_SECONDS = Histogram(
+    "chat_stage_seconds", "Duration of one chat pipeline stage.", ["stage"])
+# Every completion through HuggingFaceAPILLM: NeMo rails tasks (self_check_input,
+# generate_user_intent, ...), "summary", ...; source is cache, llm or fallback
+LLM_CALL_SECONDS = Histogram(
+    "chat_llm_call_seconds", "Duration of one LLM completion by task.", ["task", "source"])
+EMBED_CACHE = Counter(
+    "chat_embed_cache_total", "Query embeddings served from the embedding cache (hit) or encoded (miss).",
+    ["result"])
+INTENTS = Counter("chat_intent_total", "Detected intents.", ["intent"])
+BLOCKED = Counter(
+    "chat_blocked_total", "Turns answered by the input guardrails without the LLM.", ["reason"])
+FALLBACKS = Counter(
+    "chat_llm_fallback_total", "LLM calls answered with a fallback (provider unavailable).", ["kind"])
+REQUESTS = Counter("chat_requests_total", "Chat requests by endpoint and HTTP status.", ["endpoint", "status"])
+REQUEST_SECONDS = Histogram("chat_request_seconds", "End-to-end chat request duration.", ["endpoint"])
+INFLIGHT = Gauge("chat_inflight_requests", "Chat requests being processed.", ["endpoint"])
+
+# HTTP paths tracked by the chat_requests_* / chat_inflight_requests metrics
+CHAT_ENDPOINTS = {"/api-chat": "api_chat", "/api-chat/stream": "api_chat_stream", "/api-chat/batch": "api_chat_batch"}
@@ -0,0 +1,301 @@
+# File: mock_llm_server.py
+"""
+Local OpenAI-compatible stand-in for the HuggingFace router.
+
+Serves POST /v1/chat/completions (plain and `stream: true` SSE) with
+deterministic answers so the LLM wrappers can be exercised and benchmarked
+without HF tokens or network access.
+
+Run:
+    python mock_llm_server.py --port 8009 --latency-ms 150 --latency-dist lognormal --tokens-per-s 40
+Then point the LLM wrappers at it (no HF token is needed for a local base URL):
+    HF_BASE_URL=http://127.0.0.1:8009/v1
+
+Timing model: time to first token is drawn from the latency distribution
+(fixed | uniform | lognormal | exponential, median `latency_ms`), then tokens
+are produced at `tokens_per_s` (0 = instantly). Draws use a seeded RNG, so a
+run with the same seed and request order is reproducible.
+
+GET /stats returns request and TCP connection counters (useful to verify that
+keep-alive connections are being reused).
+
+Fault injection (for the transport policy in llm_policy.py):
+    --slow-rate 0.05 --slow-ms 2000   5% of completions take an extra 2s (long tail)
+    --error-rate 0.05 --error-status 503
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+
+LATENCY_DISTS = ("fixed", "uniform", "lognormal", "exponential")
+
+
+@dataclass
+class MockLLMConfig:
+    latency_ms: float = 0.0          # median time to first token
+    answer_prefix: str = "Mock answer"
+    latency_dist: str = "fixed"      # one of LATENCY_DISTS
+    latency_spread: float = 0.5      # uniform: ±fraction of latency_ms; lognormal: sigma
+    tokens_per_s: float = 0.0        # generation rate after the first token (0 = instant)
+    answer_tokens: int = 0           # pad answers to this many tokens (0 = echo-based answer)
+    seed: Optional[int] = 0
+    slow_rate: float = 0.0           # fraction of completions that also wait slow_ms
+    slow_ms: float = 0.0
+    error_rate: float = 0.0          # fraction of completions answered with error_status
+    error_status: int = 503
+    echo_auth: bool = False          # prefix answers with "[auth:<bearer token>]" (credential isolation checks)
+
+
+class MockStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.data: Dict[str, Any] = {"requests": 0, "connections": 0, "errors": 0, "slow": 0,
+                                     "streams": 0, "streams_aborted": 0, "tokens_sent": 0}
+
+    def incr(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.data[key] = self.data.get(key, 0) + n
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.data)
+
+
+def mock_answer(prompt: str, config: MockLLMConfig) -> str:
+    """Deterministic answer for a prompt (same prompt → same text)."""
+    words = prompt.split()
+    text = f"{config.answer_prefix}: " + " ".join(words[-12:])
+    if config.answer_tokens > 0:
+        tokens = text.split()
+        filler = [f"nội_dung_{i}" for i in range(max(0, config.answer_tokens - len(tokens)))]
+        text = " ".join((tokens + filler)[:config.answer_tokens])
+    return text
+
+
+def sample_latency_ms(config: MockLLMConfig, rng: random.Random) -> float:
+    """Draw a time-to-first-token from the configured distribution (median = latency_ms)."""
+    base = config.latency_ms
+    if base <= 0 or config.latency_dist == "fixed":
+        return max(0.0, base)
+    if config.latency_dist == "uniform":
+        return max(0.0, rng.uniform(base * (1 - config.latency_spread), base * (1 + config.latency_spread)))
+    if config.latency_dist == "lognormal":
+        return base * math.exp(rng.gauss(0.0, config.latency_spread))
+    if config.latency_dist == "exponential":
+        return rng.expovariate(math.log(2) / base)  # median = base
+    raise ValueError(f"unknown latency distribution: {config.latency_dist}")
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    # Buffer headers+body into one write and disable Nagle (avoids 40ms delayed-ACK stalls)
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+    server: "MockLLMServer"
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.stats.incr("connections")
+
+    def log_message(self, format: str, *args: Any) -> None:  # quiet by default
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b"{}"
+        try:
+            return json.loads(raw.decode("utf-8") or "{}")
+        except json.JSONDecodeError:
+            return {}
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") in ("/health", "/v1/health"):
+            self._send_json(200, {"status": "ok"})
+        elif self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": "not found"})
+            return
+        req = self._read_json()
+        self.server.stats.incr("requests")
+        cfg = self.server.config
+        messages = req.get("messages") or []
+        prompt = str(messages[-1].get("content", "")) if messages else ""
+        rng = self.server.rng
+        if cfg.error_rate > 0 and rng.random() < cfg.error_rate:
+            self.server.stats.incr("errors")
+            self._send_json(cfg.error_status, {"error": {"message": "injected failure", "code": cfg.error_status}})
+            return
+        delay_ms = rng.latency(cfg)
+        if cfg.slow_rate > 0 and rng.random() < cfg.slow_rate:
+            self.server.stats.incr("slow")
+            delay_ms += cfg.slow_ms
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000.0)
+        text = mock_answer(prompt, cfg)
+        max_tokens = req.get("max_tokens")
+        if max_tokens:
+            text = " ".join(text.split()[:int(max_tokens)])
+        if cfg.echo_auth:
+            bearer = (self.headers.get("Authorization") or "").removeprefix("Bearer ").strip()
+            text = f"[auth:{bearer}] {text}"
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        if req.get("stream"):
+            self._stream(completion_id, req.get("model", "mock"), text, cfg)
+            return
+        if cfg.tokens_per_s > 0:
+            time.sleep(len(text.split()) / cfg.tokens_per_s)
+        self.server.stats.incr("tokens_sent", len(text.split()))
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": req.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt.split()),
+                "completion_tokens": len(text.split()),
+                "total_tokens": len(prompt.split()) + len(text.split()),
+            },
+        })
+
+    def _write_chunk(self, payload: Dict[str, Any] | str) -> None:
+        data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        body = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(body):X}\r\n".encode("ascii") + body + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, completion_id: str, model: str, text: str, cfg: MockLLMConfig) -> None:
+        """OpenAI-style SSE stream, one word per chunk at cfg.tokens_per_s."""
+        self.server.stats.incr("streams")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        words = text.split()
+        try:
+            for i, word in enumerate(words):
+                if i and cfg.tokens_per_s > 0:
+                    time.sleep(1.0 / cfg.tokens_per_s)
+                delta = {"content": word + (" " if i < len(words) - 1 else "")}
+                if i == 0:
+                    delta["role"] = "assistant"
+                self._write_chunk({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                self.server.stats.incr("tokens_sent")
+            self._write_chunk({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            self._write_chunk("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client stopped reading (e.g. stop sequence or output validator cut the answer)
+            self.server.stats.incr("streams_aborted")
+            self.close_connection = True
+
+
+class SeededRandom:
+    """Thread-safe seeded RNG shared by handler threads."""
+
+    def __init__(self, seed: Optional[int]) -> None:
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def latency(self, config: MockLLMConfig) -> float:
+        with self._lock:
+            return sample_latency_ms(config, self._rng)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # many concurrent clients in load tests
+
+    def __init__(self, addr: Tuple[str, int], config: Optional[MockLLMConfig] = None) -> None:
+        super().__init__(addr, MockLLMHandler)
+        self.config = config or MockLLMConfig()
+        self.stats = MockStats()
+        self.rng = SeededRandom(self.config.seed)
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # Clients dropping keep-alive / cancelled hedged requests is expected noise
+        import sys
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_mock_server(port: int = 0, config: Optional[MockLLMConfig] = None,
+                      host: str = "127.0.0.1") -> MockLLMServer:
+    """Start the mock server in a daemon thread (port 0 → random free port)."""
+    server = MockLLMServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8009)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTS, default="fixed")
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--tokens-per-s", type=float, default=0.0)
+    parser.add_argument("--answer-tokens", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--echo-auth", action="store_true", help="prefix answers with the bearer token")
+    args = parser.parse_args()
+    config = MockLLMConfig(
+        latency_ms=args.latency_ms, latency_dist=args.latency_dist, latency_spread=args.latency_spread,
+        tokens_per_s=args.tokens_per_s, answer_tokens=args.answer_tokens, seed=args.seed,
+        slow_rate=args.slow_rate, slow_ms=args.slow_ms,
+        error_rate=args.error_rate, error_status=args.error_status, echo_auth=args.echo_auth,
+    )
+    server = MockLLMServer((args.host, args.port), config)
+    print(f"🧪 Mock LLM listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
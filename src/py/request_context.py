@@ -0,0 +1,87 @@
+# File: request_context.py
+"""
+Request-scoped execution context (contextvars).
+
+The NeMo rails hold a single shared LLM instance, and RAGMedicalChatbot.run
+used to set `self.llm.hf_token` on it per request, so concurrent users could
+have their calls issued with each other's tokens. Instead, each request runs
+inside request_scope(); the LLM wrappers resolve the token per call from the
+current context and fetch the matching pooled client:
+
+    with request_scope(hf_token=token, user_id=user_id, timeout=60):
+        response = await rails.generate_async(prompt=message)
+
+Context variables follow asyncio tasks and asyncio.to_thread, so every LLM call
+made on behalf of the request (NeMo actions, self-checks) sees the same values.
+The deadline also caps the per-call budget of the LLM transport policy.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import Iterator, Optional
+
+
+@dataclass(frozen=True)
+class RequestContext:
+    hf_token: Optional[str] = None
+    user_id: Optional[str] = None
+    deadline: Optional[float] = None  # time.monotonic() value
+    request_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline (None if unbounded)."""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def detached(self) -> "RequestContext":
+        """Same identity and credentials without the deadline (background work for the request)."""
+        return replace(self, deadline=None)
+
+
+request_context_var: contextvars.ContextVar[Optional[RequestContext]] = contextvars.ContextVar(
+    "request_context", default=None
+)
+
+
+def current_request() -> Optional[RequestContext]:
+    return request_context_var.get()
+
+
+def current_token(default: Optional[str] = None) -> Optional[str]:
+    """Token of the current request, else `default` (e.g. the LLM's own token)."""
+    ctx = request_context_var.get()
+    return ctx.hf_token if ctx is not None and ctx.hf_token else default
+
+
+def deadline_end(budget: float) -> float:
+    """monotonic end time for a call: now + budget, capped by the request deadline."""
+    end = time.monotonic() + budget
+    ctx = request_context_var.get()
+    if ctx is not None and ctx.deadline is not None:
+        end = min(end, ctx.deadline)
+    return end
+
+
+@contextmanager
+def request_scope(
+    hf_token: Optional[str] = None,
+    user_id: Optional[str] = None,
+    timeout: Optional[float] = None,
+    request_id: Optional[str] = None,
+) -> Iterator[RequestContext]:
+    """Run the block with a fresh RequestContext (must exit in the context it entered)."""
+    ctx = RequestContext(
+        hf_token=hf_token,
+        user_id=user_id,
+        deadline=time.monotonic() + timeout if timeout is not None else None,
+        **({"request_id": request_id} if request_id else {}),
+    )
+    reset = request_context_var.set(ctx)
+    try:
+        yield ctx
+    finally:
+        request_context_var.reset(reset)
@@ -0,0 +1,148 @@
+# File: singleflight.py
+"""
+Request coalescing ("single-flight") for identical in-flight calls.
+
+When many users send the same question within seconds, only the first caller
+(the leader) runs embed / $vectorSearch / the LLM completion; concurrent callers
+with the same key (followers) wait for the leader's result.
+
+The shared result lives in a concurrent.futures.Future, so one flight can be
+joined from threads (`do`) and from any event loop (`ado`) at the same time.
+Nothing is cached after the flight completes: the next caller starts a new one.
+
+    EMBED_FLIGHT = get_flight("embed")
+    vec = EMBED_FLIGHT.do(key, model_encode, text)
+    ctx = await RETRIEVAL_FLIGHT.ado(key, asyncio.to_thread, build, query)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+MAX_TRACKED_KEYS = 256
+
+
+def _key_label(key: Hashable) -> str:
+    """Stable digest of a flight key: keys hold user questions, and stats are public (/health)."""
+    return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:16]
+
+
+class LeaderCancelled(Exception):
+    """The leader of a flight was cancelled before producing a result."""
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls sharing the same key."""
+
+    def __init__(self, name: str, max_tracked_keys: int = MAX_TRACKED_KEYS) -> None:
+        self.name = name
+        self.max_tracked_keys = max_tracked_keys
+        self._inflight: Dict[Hashable, Tuple[concurrent.futures.Future, Dict[str, int]]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"flights": 0, "followers": 0, "max_fanout": 0}
+        # key digest -> {"flights", "followers", "max_fanout"} for the most recently active keys
+        self._per_key: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+
+    def _join(self, key: Hashable) -> Tuple[concurrent.futures.Future, bool]:
+        """Return (future, is_leader) for `key`."""
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is not None:
+                entry[1]["followers"] += 1
+                self._stats["followers"] += 1
+                return entry[0], False
+            fut: concurrent.futures.Future = concurrent.futures.Future()
+            self._inflight[key] = (fut, {"followers": 0})
+            self._stats["flights"] += 1
+            return fut, True
+
+    def _finish(self, key: Hashable) -> None:
+        with self._lock:
+            _, counters = self._inflight.pop(key)
+            fanout = counters["followers"]
+            self._stats["max_fanout"] = max(self._stats["max_fanout"], fanout)
+            label = _key_label(key)
+            rec = self._per_key.pop(label, None) or {"flights": 0, "followers": 0, "max_fanout": 0}
+            rec["flights"] += 1
+            rec["followers"] += fanout
+            rec["max_fanout"] = max(rec["max_fanout"], fanout)
+            self._per_key[label] = rec
+            while len(self._per_key) > self.max_tracked_keys:
+                self._per_key.popitem(last=False)
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run `fn(*args, **kwargs)` once per concurrent `key` (blocking callers)."""
+        fut, leader = self._join(key)
+        if not leader:
+            try:
+                return fut.result()
+            except LeaderCancelled:
+                return self.do(key, fn, *args, **kwargs)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e if isinstance(e, Exception) else LeaderCancelled())
+            self._finish(key)
+            raise
+        fut.set_result(result)
+        self._finish(key)
+        return result
+
+    async def ado(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """Await `fn(*args, **kwargs)` once per concurrent `key` (any event loop)."""
+        fut, leader = self._join(key)
+        if not leader:
+            try:
+                # shield: a cancelled follower must not cancel the shared future
+                return await asyncio.shield(asyncio.wrap_future(fut))
+            except LeaderCancelled:
+                return await self.ado(key, fn, *args, **kwargs)
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            fut.set_exception(LeaderCancelled())
+            self._finish(key)
+            raise
+        except BaseException as e:
+            fut.set_exception(e if isinstance(e, Exception) else LeaderCancelled())
+            self._finish(key)
+            raise
+        fut.set_result(result)
+        self._finish(key)
+        return result
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        with self._lock:
+            calls = self._stats["flights"] + self._stats["followers"]
+            hot = sorted(self._per_key.items(), key=lambda kv: kv[1]["followers"], reverse=True)[:top]
+            return {
+                **self._stats,
+                "in_flight": len(self._inflight),
+                "dedup_ratio": self._stats["followers"] / calls if calls else 0.0,
+                "top_keys": [{"key": k, **v} for k, v in hot if v["followers"]],
+            }
+
+
+_flights: Dict[str, SingleFlight] = {}
+_flights_lock = threading.Lock()
+
+
+def get_flight(name: str) -> SingleFlight:
+    """Process-wide named SingleFlight group."""
+    with _flights_lock:
+        flight = _flights.get(name)
+        if flight is None:
+            flight = _flights[name] = SingleFlight(name)
+        return flight
+
+
+def flight_stats(top: int = 10) -> Dict[str, Any]:
+    """Stats of every named group (exported by chat_runner /health)."""
+    with _flights_lock:
+        flights = list(_flights.values())
+    return {f.name: f.stats(top) for f in flights}
@@ -0,0 +1,107 @@
+# File: stop_sequences.py
+"""
+Stop-sequence detection across streamed chunks.
+
+A stop string can be split over two or more deltas ("Người " + "dùng:"), so
+checking each delta on its own misses it and the model keeps generating up to
+max_tokens. StopSequenceDetector keeps a rolling suffix buffer: text is
+released only once it can no longer be the start of a stop string, and the
+output is cut exactly before the earliest match.
+
+    for text in stream_until_stop(deltas, stop):   # stops consuming at the match
+        yield text
+
+Callers close the upstream HTTP stream as soon as the generator returns
+(see HuggingFaceAPILLM.stream_call / astream_call).
+"""
+
+from __future__ import annotations
+
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional, Sequence
+
+
+def trim_at_stop(text: str, stops: Optional[Sequence[str]]) -> str:
+    """Cut `text` before the earliest occurrence of any stop string."""
+    cut = len(text)
+    for s in stops or ():
+        if s:
+            idx = text.find(s)
+            if 0 <= idx < cut:
+                cut = idx
+    return text[:cut]
+
+
+class StopSequenceDetector:
+    """Incremental stop-string matcher with exact trimming."""
+
+    def __init__(self, stops: Optional[Sequence[str]]) -> None:
+        self.stops: List[str] = [s for s in (stops or ()) if s]
+        self._max_hold = max((len(s) for s in self.stops), default=1) - 1
+        self._buf = ""
+        self.stopped = False
+        self.matched: Optional[str] = None
+        self.chunks = 0
+
+    def _held_suffix(self) -> int:
+        """Length of the longest buffer suffix that is a proper prefix of some stop."""
+        buf = self._buf
+        for k in range(min(self._max_hold, len(buf)), 0, -1):
+            tail = buf[-k:]
+            if any(s.startswith(tail) for s in self.stops):
+                return k
+        return 0
+
+    def feed(self, chunk: str) -> str:
+        """Add a delta; returns text safe to emit (empty after a stop matched)."""
+        if self.stopped or not chunk:
+            return ""
+        self.chunks += 1
+        if not self.stops:
+            return chunk
+        self._buf += chunk
+        cut, hit = len(self._buf), None
+        for s in self.stops:
+            idx = self._buf.find(s)
+            if 0 <= idx < cut:
+                cut, hit = idx, s
+        if hit is not None:
+            out, self._buf = self._buf[:cut], ""
+            self.stopped, self.matched = True, hit
+            return out
+        hold = self._held_suffix()
+        out = self._buf[:len(self._buf) - hold]
+        self._buf = self._buf[len(self._buf) - hold:]
+        return out
+
+    def finish(self) -> str:
+        """End of stream without a match: release the held-back suffix."""
+        out, self._buf = ("" if self.stopped else self._buf), ""
+        return out
+
+
+def stream_until_stop(deltas: Iterable[str], stops: Optional[Sequence[str]]) -> Iterator[str]:
+    """Yield trimmed text from `deltas`, returning as soon as a stop string matches."""
+    detector = StopSequenceDetector(stops)
+    for delta in deltas:
+        out = detector.feed(delta)
+        if out:
+            yield out
+        if detector.stopped:
+            return
+    tail = detector.finish()
+    if tail:
+        yield tail
+
+
+async def astream_until_stop(deltas: AsyncIterable[str], stops: Optional[Sequence[str]]) -> AsyncIterator[str]:
+    """Async stream_until_stop."""
+    detector = StopSequenceDetector(stops)
+    async for delta in deltas:
+        out = detector.feed(delta)
+        if out:
+            yield out
+        if detector.stopped:
+            return
+    tail = detector.finish()
+    if tail:
+        yield tail
@@ -14,6 +14,7 @@ from dotenv import load_dotenv
 
 # Import chatbot components
 from main import RAGMedicalChatbot
+from chat_store import get_chat_store
 from unified_guardrails import UnifiedGuardrails
 
 # Load environment variables
@@ -168,7 +169,7 @@ if "is_authenticated" not in st.session_state:
 if "profile" not in st.session_state:
     st.session_state.profile = {"name": ""}
 
-# --- File-based User & Chat Persistence ---
+# --- User Persistence (files) & Chat History (shared chat store) ---
 DATA_DIR = Path(__file__).parent / "user_data"
 USERS_FILE = DATA_DIR / "users.json"
 CHATS_DIR = DATA_DIR / "chats"
@@ -217,6 +218,22 @@ def load_from_json(path: Path, default_value):
     except (json.JSONDecodeError, IOError):
         return default_value
 
+# Messages shown after login
+HISTORY_MESSAGES = 200
+
+def load_chat_history(username: str) -> list:
+    """Last messages from the chat store; imports a legacy <user>_chat.json once."""
+    store = get_chat_store()
+    messages = store.last_messages(username, HISTORY_MESSAGES)
+    if not messages:
+        legacy = get_user_data_path(username, "chat")
+        old = load_from_json(legacy, [])
+        if old:
+            store.append(username, [(m["role"], m["content"]) for m in old if m.get("role") and m.get("content")])
+            legacy.rename(legacy.with_suffix(".json.imported"))
+            messages = store.last_messages(username, HISTORY_MESSAGES)
+    return [{"role": m["role"], "content": m["content"]} for m in messages]
+
 def save_to_json(path: Path, data):
     try:
         with open(path, "w", encoding="utf-8") as f:
@@ -284,7 +301,7 @@ def display_message(msg):
 def handle_logout():
     """Save data and reset session state on logout."""
     if st.session_state.auth_user:
-        save_to_json(get_user_data_path(st.session_state.auth_user, "chat"), st.session_state.messages)
+        # Chat turns are already in the chat store (written by the chatbot)
         save_to_json(get_user_data_path(st.session_state.auth_user, "profile"), st.session_state.profile)
 
     st.session_state.is_authenticated = False
@@ -309,9 +326,7 @@ def draw_sidebar():
                     if authenticate_user(username, password):
                         st.session_state.is_authenticated = True
                         st.session_state.auth_user = username.strip().lower()
-                        st.session_state.messages = load_from_json(
-                            get_user_data_path(st.session_state.auth_user, "chat"), []
-                        )
+                        st.session_state.messages = load_chat_history(st.session_state.auth_user)
                         st.session_state.profile = load_from_json(
                             get_user_data_path(st.session_state.auth_user, "profile"), {"name": ""}
                         )
@@ -341,6 +356,11 @@ def draw_sidebar():
                 st.session_state.messages = []
                 if st.session_state.chatbot:
                     st.session_state.chatbot.conversation_history = []
+                if st.session_state.auth_user:
+                    if st.session_state.chatbot:
+                        st.session_state.chatbot.clear_history(st.session_state.auth_user)
+                    else:
+                        get_chat_store().clear(st.session_state.auth_user)
                 st.toast("Đã xóa lịch sử!", icon="🗑️")
                 st.rerun()
 
@@ -425,7 +445,11 @@ def main():
                 placeholder = st.empty()
                 
                 try:
-                    for chunk in st.session_state.chatbot.generate_response_stream(prompt):
+                    for chunk in st.session_state.chatbot.generate_response_stream(
+                        prompt,
+                        user_id=st.session_state.auth_user or "streamlit_user",
+                        hf_token=st.session_state.hf_token,
+                    ):
                         response_text += chunk
                         placeholder.markdown(response_text)
                         time.sleep(0.01)
@@ -433,15 +457,8 @@ def main():
                     response_text = f"Xin lỗi, đã có lỗi xảy ra: {e}"
                     placeholder.markdown(response_text)
 
-            # Update chat with final response
+            # Update chat with final response (the chatbot stored the turn in the chat store)
             st.session_state.messages.append({"role": "assistant", "content": response_text})
-            
-            # Save history and rerun to display final message correctly
-            if st.session_state.auth_user:
-                save_to_json(
-                    get_user_data_path(st.session_state.auth_user, "chat"),
-                    st.session_state.messages
-                )
             st.rerun()
 
     with col2:
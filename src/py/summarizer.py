@@ -0,0 +1,209 @@
+# File: summarizer.py
+"""
+Conversation summarization off the request path.
+
+ConversationSummaryBufferMemory.asave_context appends the turn and, once the
+buffer exceeds max_token_limit, summarizes the oldest messages with an LLM call
+before returning, so the user waited for a summary they never see.
+
+SummaryWorker splits the two:
+- append_turn() adds the exchange to the buffer (no LLM call) and marks the
+  user as pending,
+- a bounded pool of workers on a dedicated event loop summarizes pending users
+  with the async LLM client. Turns queued for a user while it is pending or
+  being summarized coalesce into a single summarization pass. The summary runs
+  in the request context (token, user) of the latest queued turn.
+
+The summary and the removal of the summarized messages are applied together
+under `lock` (history readers take the same lock), so a turn never sees the
+messages dropped without the summary that replaced them: it sees either the
+previous state or the latest completed summary.
+
+Configuration (env):
+    SUMMARY_WORKERS       concurrent summarizations (2)
+    SUMMARY_MAX_BACKLOG   pending users before new ones are skipped (10000)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from request_context import RequestContext, request_context_var
+
+
+def _num_tokens(memory: Any, messages: List[Any]) -> int:
+    return memory.llm.get_num_tokens_from_messages(messages) if messages else 0
+
+
+async def summarize_overflow(memory: Any, lock: threading.Lock) -> int:
+    """
+    Fold the oldest messages over `max_token_limit` into the moving summary
+    (ConversationSummaryBufferMemory.aprune, without exposing a half-pruned buffer).
+    Returns how many messages were folded.
+    """
+    with lock:
+        buffer = list(memory.chat_memory.messages)
+        previous = memory.moving_summary_buffer
+    length = _num_tokens(memory, buffer)
+    if length <= memory.max_token_limit:
+        return 0
+    n = 0
+    while length > memory.max_token_limit and n < len(buffer):
+        n += 1
+        length = _num_tokens(memory, buffer[n:])
+    summary = await memory.apredict_new_summary(buffer[:n], previous)
+    with lock:
+        # Turns appended meanwhile stay; only the summarized prefix is dropped
+        messages = memory.chat_memory.messages
+        if messages[:n] == buffer[:n]:
+            del messages[:n]
+            memory.moving_summary_buffer = summary
+            return n
+    return 0
+
+
+class SummaryWorker:
+    """Per-user coalescing queue drained by a bounded pool on a background loop."""
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_backlog: int = 10000,
+        on_summarized: Optional[Callable[[str, Any, int], None]] = None,
+    ) -> None:
+        self.workers = workers
+        self.max_backlog = max_backlog
+        self.on_summarized = on_summarized
+        self.lock = threading.Lock()  # guards memory buffers/summaries
+        self._state_lock = threading.Lock()
+        # user_id -> (memory, request context of the latest turn)
+        self._pending: "OrderedDict[str, Tuple[Any, Optional[RequestContext]]]" = OrderedDict()
+        self._running: Set[str] = set()
+        self._stats = {"queued": 0, "coalesced": 0, "summarized": 0, "skipped": 0, "failed": 0,
+                       "dropped_backlog_full": 0}
+        self._latency_ms: List[float] = []
+        self._loop = asyncio.new_event_loop()
+        self._wakeup: Optional[asyncio.Semaphore] = None
+        self._started = threading.Event()
+        threading.Thread(target=self._run_loop, name="summary-loop", daemon=True).start()
+        self._started.wait()
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Semaphore(0)
+        for i in range(self.workers):
+            self._loop.create_task(self._worker(i))
+        self._started.set()
+        self._loop.run_forever()
+
+    # --- request path -----------------------------------------------------------
+
+    def append_turn(self, user_id: str, memory: Any, question: str, answer: str,
+                    ctx: Optional[RequestContext] = None) -> None:
+        """Record the exchange and queue the user for summarization; never calls the LLM."""
+        with self.lock:
+            memory.chat_memory.add_user_message(question)
+            memory.chat_memory.add_ai_message(answer)
+        self.submit(user_id, memory, ctx)
+
+    def submit(self, user_id: str, memory: Any, ctx: Optional[RequestContext] = None) -> None:
+        with self._state_lock:
+            if user_id in self._pending:
+                self._pending[user_id] = (memory, ctx)
+                self._stats["coalesced"] += 1
+                return
+            if len(self._pending) >= self.max_backlog:
+                # The buffer keeps growing until a later turn finds room in the queue
+                self._stats["dropped_backlog_full"] += 1
+                return
+            self._pending[user_id] = (memory, ctx)
+            self._stats["queued"] += 1
+        self._loop.call_soon_threadsafe(self._wakeup.release)
+
+    def history(self, memory: Any) -> Dict[str, Any]:
+        """memory.load_memory_variables under the summary lock."""
+        with self.lock:
+            return memory.load_memory_variables({})
+
+    # --- worker pool ------------------------------------------------------------
+
+    def _next_locked(self) -> Optional[tuple]:
+        # Skip users whose summarization is still running; they are picked up afterwards
+        for user_id in self._pending:
+            if user_id not in self._running:
+                self._running.add(user_id)
+                return (user_id, *self._pending.pop(user_id))
+        return None
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            await self._wakeup.acquire()
+            with self._state_lock:
+                item = self._next_locked()
+            if item is None:
+                continue
+            user_id, memory, ctx = item
+            t0 = time.perf_counter()
+            # Each worker task has its own context: the summary LLM call sees this user's token
+            reset = request_context_var.set(ctx)
+            try:
+                dropped = await summarize_overflow(memory, self.lock)
+                with self._state_lock:
+                    self._stats["summarized" if dropped else "skipped"] += 1
+                    self._latency_ms = (self._latency_ms + [(time.perf_counter() - t0) * 1000])[-512:]
+                if dropped and self.on_summarized is not None:
+                    self.on_summarized(user_id, memory, dropped)
+            except Exception as e:
+                with self._state_lock:
+                    self._stats["failed"] += 1
+                print(f"⚠️ Background summary failed for user {user_id}: {e}")
+            finally:
+                request_context_var.reset(reset)
+                with self._state_lock:
+                    self._running.discard(user_id)
+                    requeue = user_id in self._pending
+                if requeue:
+                    self._wakeup.release()
+
+    # --- introspection ------------------------------------------------------------
+
+    def backlog(self) -> int:
+        """Users waiting for or undergoing summarization."""
+        with self._state_lock:
+            return len(self._pending) + len(self._running)
+
+    def drain(self, timeout: float = 30.0) -> bool:
+        """Wait until the backlog is empty (shutdown/tests)."""
+        deadline = time.monotonic() + timeout
+        while self.backlog():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._state_lock:
+            ordered = sorted(self._latency_ms)
+            return {
+                **self._stats,
+                "backlog": len(self._pending) + len(self._running),
+                "pending": len(self._pending),
+                "running": len(self._running),
+                "workers": self.workers,
+                "p50_ms": ordered[len(ordered) // 2] if ordered else 0.0,
+                "p95_ms": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else 0.0,
+            }
+
+
+def summary_worker_from_env(on_summarized: Optional[Callable[[str, Any, int], None]] = None) -> SummaryWorker:
+    """SummaryWorker configured from the environment."""
+    return SummaryWorker(
+        workers=int(os.getenv("SUMMARY_WORKERS", "2")),
+        max_backlog=int(os.getenv("SUMMARY_MAX_BACKLOG", "10000")),
+        on_summarized=on_summarized,
+    )
@@ -0,0 +1,67 @@
+"""CircuitBreaker / TransportPolicy behaviour around the half-open probe."""
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_policy import CircuitBreaker, CircuitOpenError, TransportPolicy  # noqa: E402
+
+
+def half_open_policy() -> TransportPolicy:
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    return TransportPolicy(deadline=5.0, max_retries=0, breaker=breaker)
+
+
+class HalfOpenProbeTest(unittest.TestCase):
+    def test_cancelled_probe_frees_the_slot(self):
+        policy = half_open_policy()
+
+        async def scenario():
+            started = asyncio.Event()
+
+            async def hang(timeout):
+                started.set()
+                await asyncio.sleep(60)
+
+            probe = asyncio.ensure_future(policy.acall(hang))
+            await started.wait()
+            self.assertTrue(policy.breaker._probe_in_flight)
+            probe.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await probe
+
+            self.assertEqual(policy.breaker.state, "half_open")
+            self.assertFalse(policy.breaker._probe_in_flight)
+
+            async def ok(timeout):
+                return "ok"
+
+            self.assertEqual(await policy.acall(ok), "ok")
+            self.assertEqual(policy.breaker.state, "closed")
+
+        asyncio.run(scenario())
+
+    def test_interrupted_sync_probe_frees_the_slot(self):
+        policy = half_open_policy()
+
+        def interrupted(timeout):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            policy.call(interrupted)
+        self.assertFalse(policy.breaker._probe_in_flight)
+        self.assertEqual(policy.call(lambda timeout: "ok"), "ok")
+
+    def test_second_caller_rejected_while_probe_in_flight(self):
+        policy = half_open_policy()
+        self.assertTrue(policy.breaker.allow())
+        with self.assertRaises(CircuitOpenError):
+            policy.call(lambda timeout: "ok")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,467 @@
+# File: tracing.py
+"""
+Request tracing spans and on-demand profiling for chat turns.
+
+A trace is one HTTP request (or pool-worker request); spans inside it time the
+pipeline pieces that can make a turn slow: RAGMedicalChatbot.run / run_stream,
+each LLM completion (with its NeMo task and whether the cache answered),
+RAGSystem embedding / vector search / context building and the guardrails.
+
+    with tracing.start_trace("api_chat", trace_header=headers.get("X-Trace")) as trace:
+        ...                                   # trace is None when not sampled
+            with tracing.span("rag.vector_search", k=5):
+                ...
+            tracing.record("llm", started, task="self_check_input", source="cache")
+
+    @tracing.traced("guardrails.validate_input")
+    def validate_input(...): ...
+
+Spans live in context variables, so they follow asyncio tasks and
+asyncio.to_thread into the worker threads. Off by default: when no trace is
+active, span() / traced() / record() cost one ContextVar lookup.
+
+Finished traces go to a ring buffer (GET /traces) and, if TRACE_EXPORT_PATH is
+set, are appended to that file as JSON lines for offline analysis. The trace
+id is the RequestContext.request_id of the turn and is returned to the client
+in the X-Request-Id response header.
+
+A trace can also carry a profile of the request:
+    sample    stack sampler over every thread (catches to_thread work such as
+              torch encodes and Mongo calls); writes <id>.collapsed, the folded
+              stack format of flamegraph.pl, speedscope and inferno
+    cprofile  cProfile of the thread that started the trace; writes <id>.prof
+              (snakeviz, flameprof). On a shared event loop it also sees the
+              other requests served meanwhile.
+Only one profile runs at a time per process; others are skipped.
+
+Environment:
+    TRACE_SAMPLE_RATE      fraction of requests traced (0 = off)
+    TRACE_HEADERS          1 = honour the X-Trace / X-Profile request headers
+    TRACE_EXPORT_PATH      JSONL file finished traces are appended to (unset = memory only)
+    TRACE_KEEP             finished traces kept for GET /traces (200)
+    PROFILE_SAMPLE_RATE    fraction of requests profiled (0 = off)
+    PROFILE_MODE           sample | cprofile, for sampled profiles (sample)
+    PROFILE_DIR            profile output directory (user_data/profiles)
+    PROFILE_INTERVAL_MS    stack sampling interval (5)
+"""
+
+from __future__ import annotations
+
+import contextvars
+import functools
+import inspect
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+PROFILE_MODES = ("sample", "cprofile")
+# Client-supplied ids (X-Request-Id) also name profile files
+_TRACE_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def _rate(name: str) -> float:
+    try:
+        return min(1.0, max(0.0, float(os.getenv(name, "0"))))
+    except ValueError:
+        return 0.0
+
+
+TRACE_SAMPLE_RATE = _rate("TRACE_SAMPLE_RATE")
+PROFILE_SAMPLE_RATE = _rate("PROFILE_SAMPLE_RATE")
+TRACE_HEADERS = os.getenv("TRACE_HEADERS", "0") == "1"
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH") or None
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", "200"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(Path(__file__).parent / "user_data" / "profiles")))
+PROFILE_INTERVAL_S = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+
+
+@dataclass
+class Span:
+    name: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float  # time.perf_counter()
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    end: Optional[float] = None
+    error: Optional[str] = None
+    thread: str = ""
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "thread": self.thread,
+            "attrs": self.attrs,
+            **({"error": self.error} if self.error else {}),
+        }
+
+
+class Trace:
+    """Spans of one request; shared (under a lock) by the threads working on it."""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, **attrs: Any) -> None:
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.started_at = time.time()
+        self.root = Span(name, self._next_id(), None, time.perf_counter(), dict(attrs),
+                         thread=threading.current_thread().name)
+        self.spans: List[Span] = []
+        self.profiler: Optional["_Profiler"] = None
+        self._lock = threading.Lock()
+        self._finished = False
+
+    @staticmethod
+    def _next_id() -> str:
+        return uuid.uuid4().hex[:8]
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        origin = self.root.start
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        root = self.root.to_dict(origin)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "started_at": self.started_at,
+            "duration_ms": root["duration_ms"],
+            "attrs": self.root.attrs,
+            **({"error": self.root.error} if self.root.error else {}),
+            "spans": [root] + [s.to_dict(origin) for s in spans],
+        }
+
+
+_trace_var: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_span_var: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace_var.get()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _trace_var.get()
+    return trace.trace_id if trace is not None else None
+
+
+# --- Spans ----------------------------------------------------------------------------
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Optional[Span]]:
+    """Time the block as a child of the current span (yields None when not tracing)."""
+    trace = _trace_var.get()
+    if trace is None:
+        yield None
+        return
+    parent = _span_var.get() or trace.root
+    current = Span(name, Trace._next_id(), parent.span_id, time.perf_counter(), attrs,
+                   thread=threading.current_thread().name)
+    reset = _span_var.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _span_var.reset(reset)
+        trace.add(current)
+
+
+def record(name: str, started: float, **attrs: Any) -> None:
+    """
+    Add an already finished span (perf_counter `started` .. now). For code that
+    cannot hold a span open, e.g. across the yields of an async generator.
+    """
+    trace = _trace_var.get()
+    if trace is None:
+        return
+    parent = _span_var.get() or trace.root
+    trace.add(Span(name, Trace._next_id(), parent.span_id, started, attrs, end=time.perf_counter(),
+                   thread=threading.current_thread().name))
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    """Decorator: run each call of a function or coroutine function in span(name)."""
+    def decorate(fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if _trace_var.get() is None:
+                    return await fn(*args, **kwargs)
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _trace_var.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# --- Traces ---------------------------------------------------------------------------
+
+def _header_flag(value: Optional[str]) -> bool:
+    return TRACE_HEADERS and (value or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _header_profile(value: Optional[str]) -> Optional[str]:
+    if not TRACE_HEADERS or not value:
+        return None
+    value = value.strip().lower()
+    if value in PROFILE_MODES:
+        return value
+    return PROFILE_MODE if value in ("1", "true", "yes", "on") else None
+
+
+def begin(
+    name: str,
+    trace_id: Optional[str] = None,
+    trace_header: Optional[str] = None,
+    profile_header: Optional[str] = None,
+    **attrs: Any,
+) -> Optional[Trace]:
+    """
+    Sampling decision for one request: a Trace when it is traced, else None.
+    `trace_header` / `profile_header` are the raw X-Trace / X-Profile values
+    (ignored unless TRACE_HEADERS=1); a profiled request is always traced.
+    """
+    profile = _header_profile(profile_header)
+    if profile is None and PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        profile = PROFILE_MODE if PROFILE_MODE in PROFILE_MODES else "sample"
+    if profile is None and not _header_flag(trace_header) and not (
+        TRACE_SAMPLE_RATE and random.random() < TRACE_SAMPLE_RATE
+    ):
+        return None
+    if trace_id and (not _TRACE_ID.match(trace_id) or trace_id.startswith(".")):
+        trace_id = None
+    trace = Trace(name, trace_id, **attrs)
+    if profile is not None:
+        trace.profiler = _Profiler.start(profile, trace.trace_id)
+    return trace
+
+
+def attach(trace: Trace) -> contextvars.Token:
+    """Make `trace` current; pass the token to detach() in the same context."""
+    return _trace_var.set(trace)
+
+
+def detach(token: contextvars.Token) -> None:
+    _trace_var.reset(token)
+
+
+def finish(trace: Optional[Trace], error: Optional[BaseException] = None) -> None:
+    """Close the root span, stop the profiler and export (idempotent)."""
+    if trace is None:
+        return
+    with trace._lock:
+        if trace._finished:
+            return
+        trace._finished = True
+    trace.root.end = time.perf_counter()
+    if error is not None:
+        trace.root.error = f"{type(error).__name__}: {error}"
+    if trace.profiler is not None:
+        path = trace.profiler.stop()
+        if path is not None:
+            trace.root.attrs["profile"] = str(path)
+    TRACES.add(trace.to_dict())
+
+
+@contextmanager
+def start_trace(name: str, **kwargs: Any) -> Iterator[Optional[Trace]]:
+    """begin() + attach() for the block + finish(); yields None when not sampled."""
+    trace = begin(name, **kwargs)
+    if trace is None:
+        yield None
+        return
+    token = attach(trace)
+    error = None
+    try:
+        yield trace
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        detach(token)
+        finish(trace, error)
+
+
+async def bind(agen: AsyncIterator[Any], trace: Optional[Trace]) -> AsyncIterator[Any]:
+    """
+    Iterate `agen` with `trace` current. For async generators driven from another
+    context (chat_runner's background stream loop runs each step as a new task
+    that does not inherit the request's context variables).
+    """
+    if trace is None:
+        async for item in agen:
+            yield item
+        return
+    try:
+        while True:
+            # Each step may run in a fresh task context: set the trace again
+            _trace_var.set(trace)
+            try:
+                item = await agen.__anext__()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        aclose = getattr(agen, "aclose", None)
+        if aclose is not None:
+            _trace_var.set(trace)
+            await aclose()
+
+
+# --- Export ---------------------------------------------------------------------------
+
+class TraceExporter:
+    """Ring buffer of finished traces, optionally appended to a JSONL file."""
+
+    def __init__(self, keep: int = TRACE_KEEP, path: Optional[str] = TRACE_EXPORT_PATH) -> None:
+        self._recent: deque = deque(maxlen=max(1, keep))
+        self._path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.export_errors = 0
+
+    def add(self, trace: Dict[str, Any]) -> None:
+        line = json.dumps(trace, ensure_ascii=False, default=str) if self._path is not None else None
+        with self._lock:
+            self._recent.append(trace)
+            self.exported += 1
+            if line is None:
+                return
+            try:
+                self._path.parent.mkdir(parents=True, exist_ok=True)
+                with self._path.open("a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                self.export_errors += 1
+                print(f"⚠️ Trace export failed: {e}", file=sys.stderr)
+
+    def recent(self, limit: int = 50, trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = list(self._recent)
+        if trace_id:
+            return [t for t in traces if t["trace_id"] == trace_id]
+        return traces[-limit:][::-1] if limit > 0 else []
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "trace_sample_rate": TRACE_SAMPLE_RATE,
+                "profile_sample_rate": PROFILE_SAMPLE_RATE,
+                "headers": TRACE_HEADERS,
+                "kept": len(self._recent),
+                "exported": self.exported,
+                "export_errors": self.export_errors,
+                "export_path": str(self._path) if self._path else None,
+            }
+
+
+TRACES = TraceExporter()
+
+
+def recent_traces(limit: int = 50, trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Most recent finished traces first (or the one with `trace_id`)."""
+    return TRACES.recent(limit, trace_id)
+
+
+def trace_stats() -> Dict[str, Any]:
+    return TRACES.stats()
+
+
+# --- Profiling ------------------------------------------------------------------------
+
+_PROFILE_LOCK = threading.Lock()
+
+
+class _Profiler:
+    def __init__(self, mode: str, trace_id: str) -> None:
+        self.mode = mode
+        self.path = PROFILE_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{trace_id}"
+        self._profile = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stacks: Counter = Counter()
+
+    @classmethod
+    def start(cls, mode: str, trace_id: str) -> Optional["_Profiler"]:
+        """Start profiling, or None if another request is being profiled."""
+        if not _PROFILE_LOCK.acquire(blocking=False):
+            return None
+        profiler = cls(mode, trace_id)
+        try:
+            if mode == "cprofile":
+                import cProfile
+                profiler._profile = cProfile.Profile()
+                profiler._profile.enable()
+            else:
+                profiler._thread = threading.Thread(target=profiler._sample, name="trace-profiler", daemon=True)
+                profiler._thread.start()
+        except Exception as e:
+            _PROFILE_LOCK.release()
+            print(f"⚠️ Profiler failed to start: {e}", file=sys.stderr)
+            return None
+        return profiler
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(PROFILE_INTERVAL_S):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> Optional[Path]:
+        """Stop and write the profile; returns its path (None if writing failed)."""
+        try:
+            if self._profile is not None:
+                self._profile.disable()
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            if self._profile is not None:
+                path = self.path.with_suffix(".prof")
+                self._profile.dump_stats(str(path))
+                return path
+            path = self.path.with_suffix(".collapsed")
+            with path.open("w", encoding="utf-8") as f:
+                for stack, count in self._stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            return path
+        except Exception as e:
+            print(f"⚠️ Profile not written: {e}", file=sys.stderr)
+            return None
+        finally:
+            _PROFILE_LOCK.release()
@@ -7,6 +7,9 @@ Public API:
 - UnifiedGuardrails.validate_input(user_input) -> dict
 - UnifiedGuardrails.validate_output(response, is_medical=True) -> str
 - UnifiedGuardrails.detect_intent(query) -> str
+- UnifiedGuardrails.analyze(user_input) -> (validation, intent, entities)
+- UnifiedGuardrails.validate_input_batch / detect_intent_batch /
+  validate_output_batch / analyze_batch -> columnar dict of lists (offline use)
 
 This class internally initializes NeMo LLMRails when available, and delegates
 to MedicalGuardrails for Vietnamese-focused safety and tone. It ensures a single
@@ -15,8 +18,14 @@ instance can be reused by both CLI and Streamlit UI to avoid duplication.
 
 from __future__ import annotations
 
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, List, Optional, Tuple, Union
+import copy
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 try:
@@ -26,13 +35,65 @@ except Exception:
     LLMRails = None
 
 from medical_guardrails import MedicalGuardrails
+import metrics
+import tracing
+
+# Batches at least this large are fanned out across a process pool (when workers > 1)
+PARALLEL_MIN_ITEMS = 2000
+# Bounded LRU of guardrail decisions keyed on the exact input hash
+DECISION_CACHE_SIZE = int(os.getenv("GUARDRAILS_DECISION_CACHE", "4096"))
+INPUT_COLUMNS = ("is_valid", "is_emergency", "reason", "response", "override_response")
+
+# Per-process MedicalGuardrails used by pool workers (built once by the initializer)
+_WORKER_GUARD: Optional[MedicalGuardrails] = None
+
+
+def _worker_init() -> None:
+    global _WORKER_GUARD
+    _WORKER_GUARD = MedicalGuardrails()
+
+
+def _run_batch(guard: MedicalGuardrails, op: str, items: List[Any]) -> Dict[str, List[Any]]:
+    """Run one batch op on a MedicalGuardrails and return columnar results."""
+    if op == "validate_output":
+        responses = [r for r, _ in items]
+        flags = [m for _, m in items]
+        return {"response": guard.validate_output_batch(responses, is_medical=flags)}
+    # One normalization pass shared by validation and intent detection
+    lowered = [(t or "").lower() for t in items]
+    columns: Dict[str, List[Any]] = {}
+    if op in ("validate_input", "analyze"):
+        results = guard.validate_input_batch(items, lowered=lowered)
+        columns = {
+            col: [r.get(col, False if col in ("is_valid", "is_emergency") else None) for r in results]
+            for col in INPUT_COLUMNS
+        }
+    if op in ("detect_intent", "analyze"):
+        columns["intent"] = guard.detect_intent_batch(items, lowered=lowered)
+    return columns
+
+
+def _worker_run(op: str, items: List[Any]) -> Dict[str, List[Any]]:
+    guard = _WORKER_GUARD if _WORKER_GUARD is not None else MedicalGuardrails()
+    return _run_batch(guard, op, items)
 
 
 class UnifiedGuardrails:
-    def __init__(self, llm=None, config_path: str = ".") -> None:
+    def __init__(self, llm=None, config_path: str = ".", enable_rails: bool = True) -> None:
         self.medical = MedicalGuardrails()
         self.rails = None
         self.rails_active: bool = False
+        # Decision cache: input hash -> {"validation"|"intent"|"entities": value}
+        self._decisions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._decision_costs: Dict[str, Dict[str, float]] = {}
+        self._decision_version: Optional[int] = None
+        # (fingerprint, version) of the rule lists: the full hash is only redone when they change
+        self._rules_seen: Optional[Tuple[Any, int]] = None
+        self._decision_lock = threading.Lock()
+        self._decision_stats = {"hits": 0, "misses": 0, "time_saved_s": 0.0, "invalidations": 0}
+        # Offline tools (and callers that own their own LLMRails) skip rails init
+        if not enable_rails:
+            return
         # Resolve config path to this file's directory by default
         base_dir = Path(config_path)
         if not base_dir.exists() or base_dir.is_file():
@@ -47,15 +108,19 @@ class UnifiedGuardrails:
             self.rails_active = False
 
     # Input validation delegates to MedicalGuardrails (VN-first)
+    @tracing.traced("guardrails.validate_input")
+    @metrics.STAGE_SECONDS.time("input_guardrails")
     def validate_input(self, user_input: str) -> Dict[str, Any]:
-        # Primary validation via MedicalGuardrails
-        result = self.medical.validate_input(user_input)
+        # Primary validation via MedicalGuardrails (cached per exact input)
+        result = self._cached_decision(user_input, "validation", self.medical.validate_input)
         # Optional: If NeMo rails are active, we could run input flows here in the future.
         # Current flows are mirrored by MedicalGuardrails, so we avoid duplicate work.
         return result
 
     # Output validation delegates to MedicalGuardrails; NeMo flows are loaded
     # and can be leveraged in future for post-processing if needed.
+    @tracing.traced("guardrails.validate_output")
+    @metrics.STAGE_SECONDS.time("output_validation")
     def validate_output(self, response: str, is_medical: bool = True) -> str:
         # Primary post-processing via MedicalGuardrails (adds disclaimer, trims, safety)
         processed = self.medical.validate_output(response, is_medical=is_medical)
@@ -63,12 +128,149 @@ class UnifiedGuardrails:
         return processed
 
     # Intent detection keeps current behavior via MedicalGuardrails
-    def detect_intent(self, query: str) -> str:
-        return self.medical.detect_intent(query)
+    @tracing.traced("guardrails.detect_intent")
+    @metrics.STAGE_SECONDS.time("intent")
+    def detect_intent(self, query: str, query_vec: Optional[Any] = None) -> str:
+        """`query_vec`: precomputed query embedding shared with retrieval (skips re-encoding)."""
+        return self._cached_decision(query, "intent", lambda q: self.medical.detect_intent(q, query_vec))
+
+    def analyze(self, user_input: str) -> Tuple[Dict[str, Any], str, Dict[str, Any]]:
+        """(validation result, intent, entities) for one input, served from the decision cache."""
+        return (
+            self.validate_input(user_input),
+            self.detect_intent(user_input),
+            self.extract_entities(user_input),
+        )
+
+    # --- Decision cache -------------------------------------------------
+    # validate_input / detect_intent / extract_entities are deterministic for a
+    # given input and rule set, so repeated inputs (retries, double-submits,
+    # greetings) are answered from a bounded LRU. The key is the exact input:
+    # the checks see its raw length and case, so no normalization is safe. The
+    # cache is versioned by a hash of every pattern/keyword list: replacing,
+    # adding or removing rules invalidates it (call refresh_rules() after
+    # editing a rule in place).
+    def _rules_fingerprint(self) -> Tuple[Any, ...]:
+        """Cheap change detector: identity and size of each rule list."""
+        m = self.medical
+        lists = (
+            m.blocked_patterns, m.inappropriate_patterns, m.illegal_patterns, m.emergency_keywords,
+            m.price_keywords, m.product_keywords, m.faq_keywords, m.web_keywords, m.medical_keywords,
+        )
+        phrases = m.intent_phrases
+        return (
+            tuple((id(rules), len(rules)) for rules in lists),
+            id(phrases), tuple((k, id(v), len(v)) for k, v in phrases.items()), m.semantic_threshold,
+        )
+
+    def _rules_version(self) -> int:
+        fingerprint = self._rules_fingerprint()
+        seen = self._rules_seen
+        if seen is not None and seen[0] == fingerprint:
+            return seen[1]
+        m = self.medical
+        version = hash((
+            tuple(m.blocked_patterns), tuple(m.inappropriate_patterns), tuple(m.illegal_patterns),
+            tuple(m.emergency_keywords), tuple(m.price_keywords), tuple(m.product_keywords),
+            tuple(m.faq_keywords), tuple(m.web_keywords), tuple(m.medical_keywords),
+            tuple((k, tuple(v)) for k, v in m.intent_phrases.items()), m.semantic_threshold,
+        ))
+        self._rules_seen = (fingerprint, version)
+        return version
+
+    def refresh_rules(self) -> None:
+        """Recompute the rules version (after editing MedicalGuardrails rule lists in place)."""
+        self._rules_seen = None
+
+    def _cached_decision(self, text: str, field: str, compute: Callable[[str], Any]) -> Any:
+        key = hashlib.blake2b((text or "").encode("utf-8"), digest_size=16).hexdigest()
+        version = self._rules_version()
+        with self._decision_lock:
+            if version != self._decision_version:
+                if self._decision_version is not None:
+                    self._decision_stats["invalidations"] += 1
+                self._decisions.clear()
+                self._decision_costs.clear()
+                self._decision_version = version
+            entry = self._decisions.get(key)
+            if entry is not None and field in entry:
+                self._decisions.move_to_end(key)
+                self._decision_stats["hits"] += 1
+                self._decision_stats["time_saved_s"] += self._decision_costs[key].get(field, 0.0)
+                return copy.deepcopy(entry[field])
+            self._decision_stats["misses"] += 1
+
+        started = time.perf_counter()
+        value = compute(text)
+        cost = time.perf_counter() - started
+
+        with self._decision_lock:
+            if version == self._decision_version:
+                entry = self._decisions.setdefault(key, {})
+                entry[field] = copy.deepcopy(value)
+                self._decision_costs.setdefault(key, {})[field] = cost
+                self._decisions.move_to_end(key)
+                while len(self._decisions) > DECISION_CACHE_SIZE:
+                    old_key, _ = self._decisions.popitem(last=False)
+                    self._decision_costs.pop(old_key, None)
+        return value
+
+    def decision_cache_stats(self) -> Dict[str, Any]:
+        with self._decision_lock:
+            hits = self._decision_stats["hits"]
+            misses = self._decision_stats["misses"]
+            return {
+                "size": len(self._decisions),
+                "capacity": DECISION_CACHE_SIZE,
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": hits / (hits + misses) if (hits + misses) else 0.0,
+                "time_saved_ms": self._decision_stats["time_saved_s"] * 1000.0,
+                "invalidations": self._decision_stats["invalidations"],
+            }
+
+    # Batch variants (offline evaluation / re-labelling / audits). Results are
+    # columnar: {column: [value per item]}. With workers > 1 and a large input,
+    # chunks are spread over a process pool (each worker builds its own guardrails).
+    def validate_input_batch(self, inputs: List[str], workers: int = 0) -> Dict[str, List[Any]]:
+        return self._batch("validate_input", list(inputs), workers)
+
+    def detect_intent_batch(self, queries: List[str], workers: int = 0) -> Dict[str, List[Any]]:
+        return self._batch("detect_intent", list(queries), workers)
+
+    def analyze_batch(self, inputs: List[str], workers: int = 0) -> Dict[str, List[Any]]:
+        """validate_input + detect_intent columns from a single normalization pass."""
+        return self._batch("analyze", list(inputs), workers)
+
+    def validate_output_batch(
+        self,
+        responses: List[str],
+        is_medical: Union[bool, List[bool]] = True,
+        workers: int = 0,
+    ) -> Dict[str, List[Any]]:
+        flags = is_medical if isinstance(is_medical, list) else [is_medical] * len(responses)
+        return self._batch("validate_output", list(zip(responses, flags)), workers)
+
+    def _batch(self, op: str, items: List[Any], workers: int) -> Dict[str, List[Any]]:
+        if workers <= 1 or len(items) < PARALLEL_MIN_ITEMS:
+            return _run_batch(self.medical, op, items)
+        n_chunks = workers * 4
+        size = max(1, -(-len(items) // n_chunks))
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        merged: Dict[str, List[Any]] = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init) as pool:
+            for part in pool.map(_worker_run, [op] * len(chunks), chunks):
+                for col, values in part.items():
+                    merged.setdefault(col, []).extend(values)
+        return merged
 
     # Entity extraction bridge
     def extract_entities(self, text: str) -> Dict[str, Any]:
-        return self.medical.extract_entities(text)
+        from entity_extraction import get_entity_extractor
+        # With async LLM enrichment the extractor's own cache holds the freshest result
+        if get_entity_extractor().use_llm:
+            return self.medical.extract_entities(text)
+        return self._cached_decision(text, "entities", self.medical.extract_entities)
 
     # Expose underlying rails for advanced usage (optional by caller)
     def get_rails(self):
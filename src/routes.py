@@ -0,0 +1,311 @@
+"""
+Chat routes for the ASGI app (src/main.py, served by uvicorn).
+
+Same API as the Flask server in services/chat_runner.py, but every request
+runs on the worker's single long-lived event loop: no per-request loop, no
+background-loop bridge for streaming and no nest_asyncio. The chatbot is
+created once per worker process in `lifespan`.
+
+    POST /api-chat          {"message", "user_id", "hf_token"} -> {"message"}
+    POST /api-chat/stream   Server-Sent Events: {"delta"} per chunk, then `event: done`
+    POST /api-chat/batch    {"items": [...], "hf_token", "concurrency"?, "path"?} -> NDJSON,
+                            one record per item as it completes, then {"done": true, ...}
+    GET  /health            status + cache/admission/memory stats
+    GET  /metrics           Prometheus text format (this worker process)
+    GET  /traces            recent request traces as JSON (see py/tracing.py)
+"""
+
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Any, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+# --- Path Setup ---
+PY_LOCAL_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 'py'))
+if PY_LOCAL_PATH not in sys.path:
+    sys.path.insert(0, PY_LOCAL_PATH)
+
+# This process owns its event loop; must be set before `main` is imported
+os.environ.setdefault("NEST_ASYNCIO", "0")
+
+from admission import Overloaded, anonymous_user_id, client_address, get_admission_controller  # noqa: E402
+from chat_format import BatchTally, batch_items, format_links, ndjson, sse_event  # noqa: E402
+from llm_cache import get_completion_cache  # noqa: E402
+from llm_policy import get_transport_policy  # noqa: E402
+from singleflight import flight_stats  # noqa: E402
+import metrics  # noqa: E402
+import tracing  # noqa: E402
+
+admission = get_admission_controller()
+
+
+class ChatRequest(BaseModel):
+    message: Optional[str] = None
+    user_id: Optional[str] = None
+    session_id: Optional[str] = None
+    hf_token: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: List[Any] = []
+    user_id: Optional[str] = None
+    session_id: Optional[str] = None
+    hf_token: Optional[str] = None
+    concurrency: Optional[int] = None
+    path: str = "run"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the chatbot once per worker; `app.state.chatbot_factory` overrides it (benchmarks)."""
+    factory = getattr(app.state, "chatbot_factory", None)
+    try:
+        if factory is None:
+            from main import RAGMedicalChatbot
+            factory = RAGMedicalChatbot
+        print("--- Initializing Chatbot Singleton ---")
+        app.state.chatbot = factory()
+        print("--- Chatbot Singleton Initialized ---")
+    except Exception as e:
+        print(f"FATAL: Could not initialize chatbot instance: {e}", file=sys.stderr)
+        app.state.chatbot = None
+    yield
+    chatbot = app.state.chatbot
+    if chatbot is not None:
+        # Let queued summaries land in the chat store before the worker exits
+        chatbot.summaries.drain(timeout=10)
+        chatbot.chat_store.flush()
+
+
+class RequestMetricsMiddleware:
+    """
+    chat_requests_total / chat_request_seconds / chat_inflight_requests for the
+    chat endpoints. Pure ASGI, so streamed responses are timed to their last byte.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        endpoint = metrics.CHAT_ENDPOINTS.get(scope.get("path")) if scope["type"] == "http" else None
+        if endpoint is None or scope.get("method") != "POST":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics.INFLIGHT.inc(endpoint)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.INFLIGHT.dec(endpoint)
+            metrics.REQUESTS.inc(endpoint, str(status))
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+
+
+class RequestTracingMiddleware:
+    """
+    Runs sampled chat requests with a trace attached (see tracing.py), up to the
+    last streamed byte, and returns its id in the X-Request-Id header.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        endpoint = metrics.CHAT_ENDPOINTS.get(scope.get("path")) if scope["type"] == "http" else None
+        trace = None
+        if endpoint is not None and scope.get("method") == "POST":
+            headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+            trace = tracing.begin(
+                endpoint,
+                trace_id=headers.get("x-request-id"),
+                trace_header=headers.get("x-trace"),
+                profile_header=headers.get("x-profile"),
+            )
+        if trace is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_id(message) -> None:
+            if message["type"] == "http.response.start":
+                trace.root.attrs["status"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", trace.trace_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        token = tracing.attach(trace)
+        error = None
+        try:
+            await self.app(scope, receive, send_with_id)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            tracing.detach(token)
+            tracing.finish(trace, error)
+
+
+def error_response(message: str, status: int) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status)
+
+
+def overloaded_response(e: Overloaded) -> JSONResponse:
+    """Fast 429 so clients back off instead of piling onto a saturated pipeline."""
+    return JSONResponse(
+        {"error": "Server is busy, please retry later.", "reason": e.reason},
+        status_code=429,
+        headers={"Retry-After": str(int(e.retry_after))},
+    )
+
+
+def request_user_id(data, request: Request) -> str:
+    """`user_id` of the body, else a per-client key (session id, then the client address)."""
+    if data.user_id:
+        return data.user_id
+    peer = request.client.host if request.client else None
+    return anonymous_user_id(data.session_id, client_address(peer, request.headers.get("x-forwarded-for")))
+
+
+def _check(chatbot, data: ChatRequest) -> Optional[JSONResponse]:
+    if not chatbot:
+        return error_response("Chatbot is not available.", 500)
+    if not data.message:
+        return error_response("Message is required", 400)
+    if not data.hf_token:
+        return error_response("Hugging Face token is required", 400)
+    return None
+
+
+def setup_routes(app: FastAPI) -> None:
+    app.add_middleware(RequestMetricsMiddleware)
+    app.add_middleware(RequestTracingMiddleware)
+
+    @app.post("/api-chat")
+    async def handle_chat(data: ChatRequest, request: Request):
+        chatbot = app.state.chatbot
+        invalid = _check(chatbot, data)
+        if invalid is not None:
+            return invalid
+        user_id = request_user_id(data, request)
+        try:
+            ticket = await admission.aacquire(chatbot.admission_priority(data.message), user_id)
+        except Overloaded as e:
+            return overloaded_response(e)
+        try:
+            response = await chatbot.run(user_message=data.message, user_id=user_id, hf_token=data.hf_token)
+            return {"message": format_links(response)}
+        except Exception as e:
+            print(f"Error during chat processing: {e}", file=sys.stderr)
+            return error_response("Failed to process chat message", 500)
+        finally:
+            admission.release(ticket)
+
+    @app.post("/api-chat/stream")
+    async def handle_chat_stream(data: ChatRequest, request: Request):
+        chatbot = app.state.chatbot
+        invalid = _check(chatbot, data)
+        if invalid is not None:
+            return invalid
+        user_id = request_user_id(data, request)
+        try:
+            ticket = await admission.aacquire(chatbot.admission_priority(data.message), user_id)
+        except Overloaded as e:
+            return overloaded_response(e)
+
+        async def generate():
+            stats = {}
+            parts = []
+            received = time.perf_counter()
+            try:
+                async for chunk in chatbot.run_stream(
+                    data.message, user_id=user_id, hf_token=data.hf_token, stats=stats
+                ):
+                    parts.append(chunk)
+                    yield sse_event({"delta": chunk})
+                stats["server_total_ms"] = (time.perf_counter() - received) * 1000
+                print(
+                    f"⏱️ stream user={user_id} ttft={stats.get('ttft_ms', 0):.0f}ms "
+                    f"total={stats.get('total_ms', 0):.0f}ms chunks={stats.get('chunks', len(parts))}",
+                    file=sys.stderr,
+                )
+                yield sse_event({"message": format_links("".join(parts)), **stats}, event="done")
+            except Exception as e:
+                print(f"Error during chat streaming: {e}", file=sys.stderr)
+                yield sse_event({"error": "Failed to process chat message"}, event="error")
+
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        # The background task runs after the response, including on client disconnect
+        return StreamingResponse(
+            generate(), media_type="text/event-stream", headers=headers,
+            background=BackgroundTask(admission.release, ticket),
+        )
+
+    @app.post("/api-chat/batch")
+    async def handle_chat_batch(data: BatchRequest, request: Request):
+        chatbot = app.state.chatbot
+        if not chatbot:
+            return error_response("Chatbot is not available.", 500)
+        if not data.hf_token:
+            return error_response("Hugging Face token is required", 400)
+        if data.path not in ("run", "stream"):
+            return error_response("path must be 'run' or 'stream'", 400)
+        try:
+            items = batch_items(data.items)
+        except ValueError as e:
+            return error_response(str(e), 400)
+        # Rate-limited once per batch; every item then takes its own admission slot
+        batch_user = request_user_id(data, request)
+        try:
+            admission.check_rate(batch_user)
+        except Overloaded as e:
+            return overloaded_response(e)
+
+        async def generate():
+            tally = BatchTally(len(items))
+            async for result in chatbot.run_batch(
+                items, hf_token=data.hf_token, concurrency=data.concurrency, path=data.path,
+                admission=admission, admission_user=batch_user,
+            ):
+                yield ndjson(tally.add(result))
+            yield ndjson(tally.summary())
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    @app.get("/metrics")
+    async def metrics_endpoint():
+        """Prometheus scrape endpoint (this worker process only)."""
+        return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    @app.get("/traces")
+    async def traces_endpoint(limit: int = 50, trace_id: Optional[str] = None):
+        """Recent finished traces of this worker process (offline analysis: TRACE_EXPORT_PATH)."""
+        return {"stats": tracing.trace_stats(), "traces": tracing.recent_traces(limit, trace_id)}
+
+    @app.get("/health")
+    async def health_check():
+        chatbot = app.state.chatbot
+        cache = get_completion_cache()
+        return {
+            "status": "healthy",
+            "chatbot_initialized": chatbot is not None,
+            "llm_cache": cache.stats() if cache is not None else None,
+            "singleflight": flight_stats(),
+            "llm_transport": get_transport_policy().stats(),
+            "admission": admission.stats(),
+            "memory": chatbot.user_memories.stats() if chatbot is not None else None,
+            "summaries": chatbot.summaries.stats() if chatbot is not None else None,
+        }
@@ -0,0 +1,108 @@
+// Per-message latency: spawn-per-request vs the warm worker pool.
+//
+//   spawn  a fresh `chat_runner.py --worker` per message (what chatController
+//          did before: Python startup + model/DB/rails init on every chat)
+//   pool   PythonWorkerPool with warm workers, requests multiplexed
+//
+// Run (with the mock LLM or a real HF token in the environment):
+//   node benchWorkerPool.js --messages 50 --concurrency 8 --workers 2 --token hf_xxx
+//   node benchWorkerPool.js --script /path/to/other_worker.py   # any worker speaking the frame protocol
+
+const { PythonWorkerPool } = require('./pythonWorkerPool');
+
+function parseArgs(argv) {
+  const args = {
+    messages: 20,
+    concurrency: 4,
+    workers: 2,
+    modes: 'spawn,pool',
+    token: process.env.HF_TOKEN || 'hf_bench',
+    script: undefined,
+  };
+  for (let i = 0; i < argv.length; i += 2) {
+    const key = argv[i].replace(/^--/, '');
+    if (!(key in args)) throw new Error(`unknown option --${key}`);
+    args[key] = typeof args[key] === 'number' ? Number(argv[i + 1]) : argv[i + 1];
+  }
+  return args;
+}
+
+function percentile(sorted, p) {
+  return sorted.length ? sorted[Math.min(sorted.length - 1, Math.floor(p * sorted.length))] : 0;
+}
+
+async function drive(args, send) {
+  const latencies = [];
+  let next = 0;
+  let errors = 0;
+  const started = Date.now();
+  async function lane() {
+    while (next < args.messages) {
+      const i = next++;
+      const t0 = process.hrtime.bigint();
+      try {
+        await send({ message: `Triệu chứng của bệnh số ${i} là gì?`, hfToken: args.token, userId: `bench_${i % 16}` });
+      } catch (e) {
+        errors += 1;
+      }
+      latencies.push(Number(process.hrtime.bigint() - t0) / 1e6);
+    }
+  }
+  await Promise.all(Array.from({ length: args.concurrency }, lane));
+  latencies.sort((a, b) => a - b);
+  return {
+    elapsedS: (Date.now() - started) / 1000,
+    p50: percentile(latencies, 0.5),
+    p95: percentile(latencies, 0.95),
+    errors,
+  };
+}
+
+function scriptOption(args) {
+  return args.script ? { script: args.script } : {};
+}
+
+async function spawnPerMessage(args, msg) {
+  const pool = new PythonWorkerPool({ size: 1, healthIntervalMs: 3600000, ...scriptOption(args) });
+  try {
+    return await pool.chat(msg);
+  } finally {
+    await pool.close();
+  }
+}
+
+function waitReady(pool) {
+  return new Promise((resolve) => {
+    const check = () => (pool.status().workers.every((w) => w.ready) ? resolve() : setTimeout(check, 50));
+    check();
+  });
+}
+
+async function main() {
+  const args = parseArgs(process.argv.slice(2));
+  const rows = [];
+  for (const mode of args.modes.split(',').map((m) => m.trim()).filter(Boolean)) {
+    if (mode === 'spawn') {
+      rows.push([mode, await drive(args, (msg) => spawnPerMessage(args, msg))]);
+    } else if (mode === 'pool') {
+      const pool = new PythonWorkerPool({ size: args.workers, ...scriptOption(args) });
+      const t0 = Date.now();
+      await waitReady(pool);
+      console.log(`pool: ${args.workers} workers ready in ${Date.now() - t0}ms (paid once)`);
+      rows.push([mode, await drive(args, (msg) => pool.chat(msg))]);
+      await pool.close();
+    } else {
+      throw new Error(`unknown mode ${mode}`);
+    }
+  }
+  console.log(`${'mode'.padEnd(8)}${'msg/s'.padStart(10)}${'p50 ms'.padStart(12)}${'p95 ms'.padStart(12)}${'errors'.padStart(8)}`);
+  for (const [mode, r] of rows) {
+    console.log(`${mode.padEnd(8)}${(args.messages / r.elapsedS).toFixed(1).padStart(10)}`
+      + `${r.p50.toFixed(1).padStart(12)}${r.p95.toFixed(1).padStart(12)}${String(r.errors).padStart(8)}`);
+  }
+}
+
+main().catch((e) => {
+  console.error(e);
+  process.exit(1);
+});
@@ -1,9 +1,22 @@
 import os
 import asyncio
-from flask import Flask, request, jsonify, make_response
+import json
+import threading
+import time
+from flask import Flask, Response, g, request, jsonify, make_response, stream_with_context
 from flask_cors import CORS
 import sys
-import re # Import the regex module
+import struct
+
+# --- Worker Mode I/O ---
+# `python chat_runner.py --worker`: persistent worker for the Node pool
+# (pythonWorkerPool.js). stdout carries protocol frames only, so it is kept on a
+# private fd and everything else printed (by this or imported modules) goes to stderr.
+WORKER_MODE = "--worker" in sys.argv
+if WORKER_MODE:
+    _FRAMES_OUT = os.fdopen(os.dup(1), "wb", buffering=0)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
 
 # --- Path Setup ---
 PY_LOCAL_PATH = os.path.join(os.path.dirname(__file__), '..', 'py')
@@ -14,6 +27,13 @@ if PY_LOCAL_PATH not in sys.path:
 # --- Import Chatbot ---
 try:
     from main import RAGMedicalChatbot
+    from llm_cache import get_completion_cache
+    from singleflight import flight_stats
+    from llm_policy import get_transport_policy
+    from admission import Overloaded, anonymous_user_id, client_address, get_admission_controller
+    from chat_format import BatchTally, batch_items, format_links, ndjson, sse_event
+    import metrics
+    import tracing
 except Exception as e:
     print(f"FATAL: Failed to import RAGMedicalChatbot: {e}", file=sys.stderr)
     sys.exit(1)
@@ -22,7 +42,26 @@ except Exception as e:
 app = Flask(__name__)
 # CORRECT CORS SETUP: Apply CORS to all routes for the specific frontend origin.
 # This will automatically handle OPTIONS preflight requests and add the necessary headers to all other responses.
-CORS(app, resources={r"/api-chat": {"origins": "http://localhost:5173"}})
+CORS(app, resources={r"/api-chat.*": {"origins": "http://localhost:5173"}})
+
+# --- Background Event Loop ---
+# Streaming responses are produced by a sync generator (Flask/WSGI), so the
+# chatbot's async generators are driven on one long-lived loop in a daemon thread.
+_STREAM_LOOP = asyncio.new_event_loop()
+threading.Thread(target=_STREAM_LOOP.run_forever, name="stream-loop", daemon=True).start()
+
+
+def iterate_async(agen):
+    """Consume an async generator from sync code via the background loop."""
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(agen.__anext__(), _STREAM_LOOP).result()
+            except StopAsyncIteration:
+                break
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), _STREAM_LOOP).result()
+
 
 # --- Singleton Chatbot Instance ---
 # Initialize the chatbot once when the server starts.
@@ -35,26 +74,99 @@ except Exception as e:
     print(f"FATAL: Could not initialize chatbot instance: {e}", file=sys.stderr)
     chatbot_instance = None
 
-# --- Helper Function to Format Links ---
-def format_links(text):
-    # Regex to find paths like /login, /products, etc.
-    path_regex = r"\/[a-zA-Z0-9-]+"
-    
-    found_paths = re.findall(path_regex, text)
-    
-    if found_paths:
-        # Process longer paths first to avoid partial replacements
-        unique_paths = sorted(list(set(found_paths)), key=len, reverse=True)
-        for path in unique_paths:
-            # Create a user-friendly name from the path
-            link_name = path.lstrip('/').replace('-', ' ').title()
-            markdown_link = f"[{link_name}]({path})"
-            
-            # More robust replacement that handles surrounding quotes or spaces
-            # This looks for the path not preceded or followed by other path-like characters
-            text = re.sub(r'(?<!\w)' + re.escape(path) + r'(?!\w)', markdown_link, text)
-            
-    return text
+admission = get_admission_controller()
+
+
+def request_user_id(data):
+    """`user_id` of the body, else a per-client key (session id, then the client address)."""
+    if data.get('user_id'):
+        return data['user_id']
+    address = client_address(request.remote_addr, request.headers.get('X-Forwarded-For'))
+    return anonymous_user_id(data.get('session_id'), address)
+
+
+def overloaded_response(e):
+    """Fast 429 so clients back off instead of piling onto a saturated pipeline."""
+    resp = make_response(jsonify({"error": "Server is busy, please retry later.", "reason": e.reason}), 429)
+    resp.headers["Retry-After"] = str(int(e.retry_after))
+    return resp
+
+# --- Request Metrics ---
+def finish_request_metrics(endpoint, started, status):
+    metrics.INFLIGHT.dec(endpoint)
+    metrics.REQUESTS.inc(endpoint, str(status))
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+
+
+@app.before_request
+def start_request_metrics():
+    endpoint = metrics.CHAT_ENDPOINTS.get(request.path)
+    if endpoint and request.method == 'POST':
+        g.metrics_endpoint = endpoint
+        g.metrics_started = time.perf_counter()
+        metrics.INFLIGHT.inc(endpoint)
+
+
+@app.after_request
+def record_response_metrics(response):
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint:
+        started, status = g.metrics_started, response.status_code
+        if response.is_streamed:
+            # Timed to the end of the stream
+            response.call_on_close(lambda: finish_request_metrics(endpoint, started, status))
+        else:
+            finish_request_metrics(endpoint, started, status)
+    return response
+
+
+@app.teardown_request
+def abort_request_metrics(exc):
+    # Unhandled error before a response was made
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint:
+        finish_request_metrics(endpoint, g.metrics_started, 500)
+
+# --- Request Tracing ---
+# Sampled chat requests (TRACE_SAMPLE_RATE, or X-Trace / X-Profile with
+# TRACE_HEADERS=1) run with a trace attached; see tracing.py.
+@app.before_request
+def start_request_trace():
+    endpoint = metrics.CHAT_ENDPOINTS.get(request.path)
+    if not endpoint or request.method != 'POST':
+        return
+    trace = tracing.begin(
+        endpoint,
+        trace_id=request.headers.get('X-Request-Id'),
+        trace_header=request.headers.get('X-Trace'),
+        profile_header=request.headers.get('X-Profile'),
+    )
+    if trace is not None:
+        g.trace = trace
+        g.trace_token = tracing.attach(trace)
+
+
+@app.after_request
+def finish_request_trace(response):
+    trace = g.get('trace')
+    if trace is not None:
+        response.headers['X-Request-Id'] = trace.trace_id
+        trace.root.attrs['status'] = response.status_code
+        if response.is_streamed:
+            # Closed at the end of the stream
+            g.trace_deferred = True
+            response.call_on_close(lambda: tracing.finish(trace))
+    return response
+
+
+@app.teardown_request
+def detach_request_trace(exc):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        tracing.detach(token)
+    trace = g.get('trace')
+    if trace is not None and not g.get('trace_deferred'):
+        tracing.finish(trace, exc)
 
 # --- API Routes ---
 @app.route('/api-chat', methods=['POST']) # No longer need to handle OPTIONS manually
@@ -65,7 +177,7 @@ async def handle_chat():
 
     data = request.get_json()
     query = data.get('message')
-    user_id = data.get('user_id', 'default_user')
+    user_id = request_user_id(data)
     hf_token = data.get('hf_token') # User's token from the frontend
 
     if not query:
@@ -73,6 +185,11 @@ async def handle_chat():
     if not hf_token:
         return jsonify({"error": "Hugging Face token is required"}), 400
 
+    try:
+        ticket = await admission.aacquire(chatbot_instance.admission_priority(query), user_id)
+    except Overloaded as e:
+        return overloaded_response(e)
+
     try:
         # Pass the user's message, ID, and token to the chatbot instance
         response = await chatbot_instance.run(
@@ -86,16 +203,255 @@ async def handle_chat():
     except Exception as e:
         print(f"Error during chat processing: {e}", file=sys.stderr)
         return jsonify({"error": "Failed to process chat message"}), 500
+    finally:
+        admission.release(ticket)
+
+@app.route('/api-chat/stream', methods=['POST'])
+def handle_chat_stream():
+    """Server-Sent Events: `data: {"delta": ...}` per chunk, then `event: done` with timings."""
+    if not chatbot_instance:
+        return jsonify({"error": "Chatbot is not available."}), 500
+
+    data = request.get_json() or {}
+    query = data.get('message')
+    user_id = request_user_id(data)
+    hf_token = data.get('hf_token')
+
+    if not query:
+        return jsonify({"error": "Message is required"}), 400
+    if not hf_token:
+        return jsonify({"error": "Hugging Face token is required"}), 400
+
+    try:
+        ticket = admission.acquire(chatbot_instance.admission_priority(query), user_id)
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    trace = g.get('trace')
+
+    def generate():
+        stats = {}
+        parts = []
+        received = time.perf_counter()
+        try:
+            agen = tracing.bind(
+                chatbot_instance.run_stream(query, user_id=user_id, hf_token=hf_token, stats=stats), trace
+            )
+            for chunk in iterate_async(agen):
+                parts.append(chunk)
+                yield sse_event({"delta": chunk})
+            stats["server_total_ms"] = (time.perf_counter() - received) * 1000
+            print(
+                f"⏱️ stream user={user_id} ttft={stats.get('ttft_ms', 0):.0f}ms "
+                f"total={stats.get('total_ms', 0):.0f}ms chunks={stats.get('chunks', len(parts))}",
+                file=sys.stderr,
+            )
+            yield sse_event({"message": format_links("".join(parts)), **stats}, event="done")
+        except Exception as e:
+            print(f"Error during chat streaming: {e}", file=sys.stderr)
+            yield sse_event({"error": "Failed to process chat message"}, event="error")
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+    # Runs even if the client disconnects before the generator starts
+    response.call_on_close(lambda: admission.release(ticket))
+    return response
+
+@app.route('/api-chat/batch', methods=['POST'])
+def handle_chat_batch():
+    """NDJSON: one record per item as it completes, then {"done": true, ...} with totals."""
+    if not chatbot_instance:
+        return jsonify({"error": "Chatbot is not available."}), 500
+
+    data = request.get_json() or {}
+    hf_token = data.get('hf_token')
+    path = data.get('path', 'run')
+    if not hf_token:
+        return jsonify({"error": "Hugging Face token is required"}), 400
+    if path not in ('run', 'stream'):
+        return jsonify({"error": "path must be 'run' or 'stream'"}), 400
+    try:
+        items = batch_items(data.get('items'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Rate-limited once per batch; every item then takes its own admission slot
+    batch_user = request_user_id(data)
+    try:
+        admission.check_rate(batch_user)
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    trace = g.get('trace')
+
+    def generate():
+        tally = BatchTally(len(items))
+        agen = tracing.bind(
+            chatbot_instance.run_batch(items, hf_token=hf_token, concurrency=data.get('concurrency'), path=path,
+                                       admission=admission, admission_user=batch_user),
+            trace,
+        )
+        for result in iterate_async(agen):
+            yield ndjson(tally.add(result))
+        yield ndjson(tally.summary())
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                    headers={"X-Accel-Buffering": "no"})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (this process only)."""
+    return Response(metrics.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+@app.route('/traces', methods=['GET'])
+def traces_endpoint():
+    """Recent finished traces of this process as JSON (?limit=N, ?trace_id=...)."""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        "stats": tracing.trace_stats(),
+        "traces": tracing.recent_traces(limit, request.args.get('trace_id')),
+    })
 
 @app.route('/health', methods=['GET'])
 def health_check():
+    cache = get_completion_cache()
     return jsonify({
         "status": "ok",
-        "chatbot_initialized": chatbot_instance is not None
+        "chatbot_initialized": chatbot_instance is not None,
+        "llm_cache": cache.stats() if cache is not None else None,
+        "singleflight": flight_stats(),
+        "llm_transport": get_transport_policy().stats(),
+        "admission": admission.stats(),
+        "memory": chatbot_instance.user_memories.stats() if chatbot_instance is not None else None,
+        "summaries": chatbot_instance.summaries.stats() if chatbot_instance is not None else None
     })
 
+# --- Persistent Worker Mode ---
+# Frames in both directions: 4-byte big-endian length + UTF-8 JSON object.
+#   -> {"id": 1, "type": "chat", "message": "...", "user_id": "...", "hf_token": "..."}
+#      (optional "request_id", "trace", "profile": same as the X-Request-Id / X-Trace / X-Profile headers;
+#       "session_id" / "client_addr" key anonymous callers when "user_id" is empty)
+#   <- {"id": 1, "ok": true, "reply": "..."}   or {"id": 1, "ok": false, "status": 429, "error": "..."}
+#   -> {"id": 2, "type": "ping"}                 <- {"id": 2, "ok": true, "type": "pong", "inflight": 0}
+# On startup the worker sends {"type": "ready", "pid": ...}, or exits with status 1
+# if the chatbot failed to initialize (the pool restarts it). Requests are
+# multiplexed: many can be in flight, replies come back in completion order.
+FRAME_HEADER = struct.Struct(">I")
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+_frames_lock = threading.Lock()
+_inflight = 0
+
+
+def write_frame(payload):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    with _frames_lock:
+        _FRAMES_OUT.write(FRAME_HEADER.pack(len(body)) + body)
+
+
+def read_frame(stream):
+    """Next request frame from `stream`, or None at EOF."""
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"frame too large: {length} bytes")
+    body = stream.read(length)
+    if len(body) < length:
+        return None
+    return json.loads(body.decode("utf-8"))
+
+
+def answer_ping(req):
+    """Health check, answered on the stdin reader thread: sync work in the pipeline can
+    stall _STREAM_LOOP, and a busy but healthy worker must not miss the pool's deadline."""
+    write_frame({"id": req.get("id"), "ok": True, "type": "pong", "inflight": _inflight,
+                 "admission": admission.stats()})
+
+
+async def handle_worker_request(req):
+    """Same pipeline as /api-chat, answered as a frame."""
+    global _inflight
+    req_id = req.get("id")
+    kind = req.get("type", "chat")
+    if kind != "chat":
+        write_frame({"id": req_id, "ok": False, "status": 400, "error": f"unknown request type: {kind}"})
+        return
+    query = req.get("message")
+    user_id = req.get("user_id") or anonymous_user_id(req.get("session_id"), req.get("client_addr"))
+    hf_token = req.get("hf_token")
+    if not chatbot_instance:
+        write_frame({"id": req_id, "ok": False, "status": 500, "error": "Chatbot is not available."})
+        return
+    if not query:
+        write_frame({"id": req_id, "ok": False, "status": 400, "error": "Message is required"})
+        return
+    if not hf_token:
+        write_frame({"id": req_id, "ok": False, "status": 400, "error": "Hugging Face token is required"})
+        return
+    try:
+        ticket = await admission.aacquire(chatbot_instance.admission_priority(query), user_id)
+    except Overloaded as e:
+        write_frame({"id": req_id, "ok": False, "status": 429, "error": "Server is busy, please retry later.",
+                     "reason": e.reason, "retry_after": e.retry_after})
+        return
+    _inflight += 1
+    metrics.INFLIGHT.inc("worker_chat")
+    started = time.perf_counter()
+    status = 500
+    try:
+        with tracing.start_trace("worker_chat", trace_id=req.get("request_id"),
+                                 trace_header=req.get("trace"), profile_header=req.get("profile")):
+            response = await chatbot_instance.run(user_message=query, user_id=user_id, hf_token=hf_token)
+        write_frame({"id": req_id, "ok": True, "reply": format_links(response)})
+        status = 200
+    except Exception as e:
+        print(f"Error during chat processing: {e}", file=sys.stderr)
+        write_frame({"id": req_id, "ok": False, "status": 500, "error": "Failed to process chat message"})
+    finally:
+        _inflight -= 1
+        metrics.INFLIGHT.dec("worker_chat")
+        metrics.REQUESTS.inc("worker_chat", str(status))
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, "worker_chat")
+        admission.release(ticket)
+
+
+def run_worker():
+    """Serve frames from stdin until EOF, then let in-flight requests finish."""
+    if chatbot_instance is None:
+        # No ready frame: the pool sees the exit and restarts this worker with backoff
+        print("Chatbot failed to initialize; worker exiting", file=sys.stderr)
+        sys.exit(1)
+    write_frame({"type": "ready", "pid": os.getpid(), "chatbot_initialized": True})
+    pending = set()
+    stdin = sys.stdin.buffer
+    while True:
+        try:
+            req = read_frame(stdin)
+        except (ValueError, json.JSONDecodeError) as e:
+            print(f"Bad frame from parent: {e}", file=sys.stderr)
+            break
+        if req is None:
+            break
+        if req.get("type") == "ping":
+            answer_ping(req)
+            continue
+        fut = asyncio.run_coroutine_threadsafe(handle_worker_request(req), _STREAM_LOOP)
+        pending.add(fut)
+        fut.add_done_callback(pending.discard)
+    for fut in list(pending):
+        try:
+            fut.result(timeout=60)
+        except Exception:
+            pass
+
+
 # --- Main Execution ---
 if __name__ == "__main__":
+    if WORKER_MODE:
+        run_worker()
+        sys.exit(0)
     # Chạy Flask server thay vì script một lần
     # Sử dụng Gunicorn hoặc Waitress trong production
     port = int(os.environ.get("CHATBOT_PY_PORT", 8003))
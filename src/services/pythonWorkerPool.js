@@ -0,0 +1,329 @@
+// Pool of persistent `python chat_runner.py --worker` processes.
+//
+// Spawning chat_runner per message paid Python startup, the BGE-M3 load, the
+// Mongo connection and NeMo rails init on every chat. Workers here start once
+// and stay warm; requests are multiplexed over each worker's stdin/stdout with
+// length-prefixed JSON frames (4-byte big-endian length + UTF-8 JSON), matched
+// to replies by id.
+//
+// - requests go to the ready worker with the fewest in-flight requests
+// - a ping every `healthIntervalMs`; a worker that misses `healthTimeoutMs` is killed
+// - crashed/killed workers fail their in-flight requests and are restarted
+//   with exponential backoff
+//
+// Configuration (env):
+//   PY_WORKERS                 number of workers (2)
+//   PY_WORKER_MAX_INFLIGHT     requests in flight per worker (16)
+//   PY_WORKER_TIMEOUT_MS       per-request timeout (120000)
+//   PY_WORKER_STARTUP_MS       max time to get the "ready" frame (180000)
+//   PYTHON_BIN                 interpreter (python)
+
+const { spawn } = require('child_process');
+const path = require('path');
+const EventEmitter = require('events');
+
+const HEADER_BYTES = 4;
+const MAX_FRAME_BYTES = 16 * 1024 * 1024;
+
+function encodeFrame(payload) {
+  const body = Buffer.from(JSON.stringify(payload), 'utf8');
+  const header = Buffer.alloc(HEADER_BYTES);
+  header.writeUInt32BE(body.length, 0);
+  return Buffer.concat([header, body]);
+}
+
+class WorkerError extends Error {
+  constructor(message, status = 500, extra = {}) {
+    super(message);
+    this.status = status;
+    Object.assign(this, extra);
+  }
+}
+
+class PythonWorker extends EventEmitter {
+  constructor(index, opts) {
+    super();
+    this.index = index;
+    this.opts = opts;
+    this.pending = new Map(); // id -> { resolve, reject, timer }
+    this.nextId = 1;
+    this.reserved = 0; // handed to a waiting request that has not sent yet
+    this.buffer = Buffer.alloc(0);
+    this.ready = false;
+    this.exited = false;
+    this.lastPong = Date.now();
+    this.startedAt = Date.now();
+
+    this.proc = spawn(opts.pythonBin, [opts.script, '--worker'], {
+      env: { ...process.env, ...opts.env },
+      stdio: ['pipe', 'pipe', 'pipe'],
+    });
+    this.pid = this.proc.pid;
+    this.proc.stdout.on('data', (chunk) => this._onData(chunk));
+    this.proc.stderr.on('data', (d) => {
+      if (opts.logStderr) process.stderr.write(`[py-worker ${index}] ${d}`);
+    });
+    this.proc.stdin.on('error', () => {}); // EPIPE after a crash; handled by 'exit'
+    this.proc.on('exit', (code, signal) => this._onExit(code, signal));
+    this.proc.on('error', (err) => this._onExit(null, null, err));
+
+    this.startupTimer = setTimeout(() => {
+      if (!this.ready) this.kill(`no ready frame after ${opts.startupMs}ms`);
+    }, opts.startupMs);
+  }
+
+  get inflight() {
+    return this.pending.size;
+  }
+
+  _onData(chunk) {
+    this.buffer = this.buffer.length ? Buffer.concat([this.buffer, chunk]) : chunk;
+    while (this.buffer.length >= HEADER_BYTES) {
+      const length = this.buffer.readUInt32BE(0);
+      if (length > MAX_FRAME_BYTES) {
+        this.kill(`frame too large (${length} bytes)`);
+        return;
+      }
+      if (this.buffer.length < HEADER_BYTES + length) break;
+      const body = this.buffer.subarray(HEADER_BYTES, HEADER_BYTES + length);
+      this.buffer = this.buffer.subarray(HEADER_BYTES + length);
+      let msg;
+      try {
+        msg = JSON.parse(body.toString('utf8'));
+      } catch (e) {
+        this.kill(`invalid JSON frame: ${e.message}`);
+        return;
+      }
+      this._onMessage(msg);
+    }
+  }
+
+  _onMessage(msg) {
+    if (msg.type === 'ready') {
+      if (msg.chatbot_initialized === false) {
+        // A worker that would fail every request: restart it instead of routing traffic to it
+        this.kill('chatbot failed to initialize');
+        return;
+      }
+      this.ready = true;
+      clearTimeout(this.startupTimer);
+      this.emit('ready', this);
+      return;
+    }
+    const entry = this.pending.get(msg.id);
+    if (!entry) return; // timed out already
+    this.pending.delete(msg.id);
+    clearTimeout(entry.timer);
+    if (msg.type === 'pong') this.lastPong = Date.now();
+    if (msg.ok) entry.resolve(msg);
+    else entry.reject(new WorkerError(msg.error || 'worker error', msg.status || 500, {
+      reason: msg.reason, retryAfter: msg.retry_after,
+    }));
+  }
+
+  _onExit(code, signal, err) {
+    if (this.exited) return;
+    this.exited = true;
+    this.ready = false;
+    clearTimeout(this.startupTimer);
+    const why = err ? err.message : `exited (code=${code}, signal=${signal})`;
+    for (const [, entry] of this.pending) {
+      clearTimeout(entry.timer);
+      entry.reject(new WorkerError(`python worker ${why}`, 502));
+    }
+    this.pending.clear();
+    this.emit('exit', this, why);
+  }
+
+  send(payload, timeoutMs) {
+    return new Promise((resolve, reject) => {
+      if (this.exited) {
+        reject(new WorkerError('python worker is not running', 502));
+        return;
+      }
+      const id = this.nextId++;
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new WorkerError(`python worker timed out after ${timeoutMs}ms`, 504));
+      }, timeoutMs);
+      this.pending.set(id, { resolve, reject, timer });
+      this.proc.stdin.write(encodeFrame({ ...payload, id }));
+    });
+  }
+
+  kill(reason) {
+    if (this.exited) return;
+    console.error(`python worker ${this.index} (pid ${this.pid}) killed: ${reason}`);
+    this.proc.kill('SIGKILL');
+  }
+
+  close() {
+    // EOF: the worker finishes in-flight requests and exits
+    if (!this.exited) this.proc.stdin.end();
+  }
+}
+
+class PythonWorkerPool {
+  constructor(options = {}) {
+    this.opts = {
+      size: 2,
+      maxInflight: 16,
+      requestTimeoutMs: 120000,
+      startupMs: 180000,
+      healthIntervalMs: 10000,
+      healthTimeoutMs: 5000,
+      restartBackoffMs: 1000,
+      restartBackoffMaxMs: 30000,
+      pythonBin: process.env.PYTHON_BIN || 'python',
+      script: path.join(__dirname, 'chat_runner.py'),
+      env: {},
+      logStderr: true,
+      ...options,
+    };
+    this.workers = new Array(this.opts.size).fill(null);
+    this.restarts = new Array(this.opts.size).fill(0);
+    this.waiters = []; // requests waiting for a ready worker with spare capacity
+    this.closed = false;
+    this.stats = { requests: 0, errors: 0, restarts: 0, healthKills: 0 };
+    for (let i = 0; i < this.opts.size; i++) this._start(i);
+    this.healthTimer = setInterval(() => this._healthCheck(), this.opts.healthIntervalMs);
+    this.healthTimer.unref();
+  }
+
+  _start(index) {
+    if (this.closed) return;
+    const worker = new PythonWorker(index, this.opts);
+    this.workers[index] = worker;
+    worker.on('ready', () => {
+      this.restarts[index] = 0;
+      this._drainWaiters();
+    });
+    worker.on('exit', (w, why) => {
+      if (this.closed || this.workers[index] !== w) return;
+      this.workers[index] = null;
+      const attempt = this.restarts[index]++;
+      const delay = Math.min(this.opts.restartBackoffMaxMs, this.opts.restartBackoffMs * 2 ** attempt);
+      console.error(`python worker ${index} ${why}; restarting in ${delay}ms`);
+      this.stats.restarts += 1;
+      setTimeout(() => this._start(index), delay).unref();
+    });
+  }
+
+  _pick() {
+    let best = null;
+    for (const w of this.workers) {
+      const load = w ? w.inflight + w.reserved : 0;
+      if (!w || !w.ready || w.exited || load >= this.opts.maxInflight) continue;
+      if (!best || load < best.inflight + best.reserved) best = w;
+    }
+    return best;
+  }
+
+  _drainWaiters() {
+    while (this.waiters.length) {
+      const worker = this._pick();
+      if (!worker) return;
+      worker.reserved += 1;
+      this.waiters.shift().resolve(worker);
+    }
+  }
+
+  _acquire(timeoutMs) {
+    // The returned worker carries a reservation that request() releases when it sends
+    const worker = this._pick();
+    if (worker) {
+      worker.reserved += 1;
+      return Promise.resolve(worker);
+    }
+    return new Promise((resolve, reject) => {
+      const waiter = {
+        resolve: (w) => {
+          clearTimeout(waiter.timer);
+          resolve(w);
+        },
+        reject: (e) => {
+          clearTimeout(waiter.timer);
+          reject(e);
+        },
+      };
+      waiter.timer = setTimeout(() => {
+        const i = this.waiters.indexOf(waiter);
+        if (i >= 0) this.waiters.splice(i, 1);
+        reject(new WorkerError('no python worker available', 503));
+      }, timeoutMs);
+      this.waiters.push(waiter);
+    });
+  }
+
+  async request(payload, timeoutMs = this.opts.requestTimeoutMs) {
+    if (this.closed) throw new WorkerError('worker pool is closed', 503);
+    this.stats.requests += 1;
+    const started = Date.now();
+    try {
+      const worker = await this._acquire(timeoutMs);
+      worker.reserved -= 1;
+      const reply = await worker.send(payload, Math.max(1, timeoutMs - (Date.now() - started)));
+      return reply;
+    } catch (e) {
+      this.stats.errors += 1;
+      throw e;
+    } finally {
+      this._drainWaiters();
+    }
+  }
+
+  chat({ message, hfToken, userId, clientAddr }) {
+    return this.request({ type: 'chat', message, hf_token: hfToken, user_id: userId, client_addr: clientAddr })
+      .then((r) => r.reply);
+  }
+
+  _healthCheck() {
+    for (const w of this.workers) {
+      if (!w || !w.ready || w.exited) continue;
+      w.send({ type: 'ping' }, this.opts.healthTimeoutMs).catch(() => {
+        if (!w.exited) {
+          this.stats.healthKills += 1;
+          w.kill('health check failed');
+        }
+      });
+    }
+  }
+
+  status() {
+    return {
+      ...this.stats,
+      waiting: this.waiters.length,
+      workers: this.workers.map((w, i) => (w
+        ? { index: i, pid: w.pid, ready: w.ready, inflight: w.inflight, lastPong: new Date(w.lastPong).toISOString() }
+        : { index: i, pid: null, ready: false, inflight: 0 })),
+    };
+  }
+
+  async close() {
+    this.closed = true;
+    clearInterval(this.healthTimer);
+    for (const waiter of this.waiters.splice(0)) waiter.reject(new WorkerError('worker pool is closed', 503));
+    const exits = this.workers.filter((w) => w && !w.exited).map((w) => new Promise((resolve) => {
+      w.once('exit', resolve);
+      w.close();
+      setTimeout(() => w.kill('shutdown timeout'), 10000).unref();
+    }));
+    await Promise.all(exits);
+  }
+}
+
+let sharedPool = null;
+
+function getWorkerPool() {
+  if (!sharedPool) {
+    sharedPool = new PythonWorkerPool({
+      size: parseInt(process.env.PY_WORKERS || '2', 10),
+      maxInflight: parseInt(process.env.PY_WORKER_MAX_INFLIGHT || '16', 10),
+      requestTimeoutMs: parseInt(process.env.PY_WORKER_TIMEOUT_MS || '120000', 10),
+      startupMs: parseInt(process.env.PY_WORKER_STARTUP_MS || '180000', 10),
+    });
+  }
+  return sharedPool;
+}
+
+module.exports = { PythonWorkerPool, WorkerError, encodeFrame, getWorkerPool };
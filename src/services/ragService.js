@@ -1,6 +1,7 @@
 const axios = require('axios');
 
 const PYTHON_API_URL = process.env.PYTHON_API_URL || 'http://127.0.0.1:8003/chat';
+const PYTHON_STREAM_URL = process.env.PYTHON_STREAM_URL || 'http://127.0.0.1:8003/api-chat/stream';
 
 async function getRagResponse(message, user_id, hf_token) {
   if (!message) {
@@ -74,4 +75,57 @@ async function getRagResponse(message, user_id, hf_token) {
   }
 }
 
-module.exports = { getRagResponse };
+// Opens the Python SSE endpoint and resolves with the raw response stream
+// (the caller pipes it to the browser as-is). `clientAddr` is sent as the only
+// X-Forwarded-For entry (run the Python service with TRUSTED_PROXIES=1 behind Node).
+async function streamRagResponse(message, user_id, hf_token, clientAddr) {
+  if (!message) {
+    throw new Error('Message is required');
+  }
+  if (!hf_token) {
+    throw new Error('Hugging Face token is required');
+  }
+
+  let response;
+  try {
+    response = await axios.post(PYTHON_STREAM_URL, {
+      message,
+      user_id,
+      hf_token
+    }, {
+      responseType: 'stream',
+      timeout: 0, // long generations; the client closing the connection aborts it
+      headers: {
+        'Content-Type': 'application/json',
+        'Accept': 'text/event-stream',
+        ...(clientAddr ? { 'X-Forwarded-For': clientAddr } : {})
+      }
+    });
+  } catch (error) {
+    if (!error.response) {
+      throw error;
+    }
+    // Non-2xx (e.g. 429 from admission control): keep the status, Retry-After and JSON body
+    const upstreamError = new Error(`Python service answered ${error.response.status}`);
+    upstreamError.status = error.response.status;
+    upstreamError.retryAfter = error.response.headers['retry-after'];
+    upstreamError.body = await readJsonBody(error.response.data);
+    throw upstreamError;
+  }
+  return response.data;
+}
+
+// Drains an error response opened with responseType 'stream'; null if it is not JSON.
+async function readJsonBody(stream) {
+  let raw = '';
+  try {
+    for await (const chunk of stream) {
+      raw += chunk;
+    }
+    return JSON.parse(raw);
+  } catch (err) {
+    return null;
+  }
+}
+
+module.exports = { getRagResponse, streamRagResponse };